@@ -0,0 +1,220 @@
+"""benchmark suite for the download and merge stages of binance-reporting
+
+**Goal**
+    - catch performance regressions before they reach scheduled production runs
+
+**Procedure**
+    - start the local stand-in of the exchange (binance_reporting.simulator) with synthetic data of the chosen scale
+    - run every stage against it and measure wall time and peak memory (tracemalloc) per stage
+    - write the results as json; compare against a baseline if provided and fail in case of regressions
+
+**Usage**
+
+    .. code:: bash
+
+        python benchmarks/benchmark.py --scale small --output bench_small.json
+        python benchmarks/benchmark.py --scale production --baseline bench_production.json --tolerance 0.2
+
+.. note:: weight limits of the stand-in are disabled and the used weight is reported as 0, so the client
+    never cools off (API_weight_check, WeightBudget) and the results do not depend on the wall-clock minute
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from binance_reporting import simulator
+from binance_reporting import helper
+from binance_reporting import downloader
+
+# data scales; production: 500 pairs x 3 years of 5m klines, 1M trades, 50 accounts
+scales = {
+    'small': {
+        'pairs': 20, 'days': 30, 'interval': '1h', 'traded_pairs': 5, 'trades_per_pair': 200,
+        'accounts': 3, 'snapshot_accounts': 1},
+    'medium': {
+        'pairs': 100, 'days': 365, 'interval': '1h', 'traded_pairs': 20, 'trades_per_pair': 2000,
+        'accounts': 10, 'snapshot_accounts': 2},
+    'production': {
+        'pairs': 500, 'days': 1095, 'interval': '5m', 'traded_pairs': 100, 'trades_per_pair': 10000,
+        'accounts': 50, 'snapshot_accounts': 5},
+}
+
+stages = [
+    'klines', 'merge_klines', 'balances', 'merge_files', 'daily_account_snapshots',
+    'trades_initial', 'trades_resume', 'orders_initial', 'orders_resume', 'deposits']
+
+
+def measure(name, function, memory=True):
+    """run one stage and measure wall time and peak memory
+
+    :returns: dict with the results of the stage
+    """
+    logging.info("--- benchmark stage %s ---", name)
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    rows = function()
+    seconds = time.perf_counter() - start
+    peak = 0
+    if memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    logging.info("--- %s finished after %.2f sec; peak memory %.1f MB ---", name, seconds, peak / 1e6)
+    return {'stage': name, 'seconds': round(seconds, 4), 'peak_mb': round(peak / 1e6, 2), 'rows': rows}
+
+
+def _rows(filename):
+    """amount of records in a csv file"""
+    if not os.path.isfile(filename):
+        return 0
+    with open(filename) as file:
+        return max(sum(1 for line in file) - 1, 0)
+
+
+def run(scale: dict, workdir: str, selected: list, memory: bool = True):
+    """run the selected stages with the given scale
+
+    :returns: list with the results of every stage
+    """
+    market = simulator.Market(
+        pairs=scale['pairs'], days=scale['days'],
+        traded_pairs=scale['traded_pairs'], trades_per_pair=scale['trades_per_pair'])
+    server = simulator.serve(market, limits={'api': None, 'sapi': None, 'fapi': None})
+    helper.api_url = server.url
+
+    accounts = ['bench' + str(nbr) for nbr in range(scale['accounts'])]
+    klines_dir = workdir + '/klines'
+    intervals = [scale['interval']] if scale['interval'] == '1d' else [scale['interval'], '1d']
+    symbols = market.symbols
+
+    def account_file(account, kind):
+        directory = workdir + '/' + account
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        return directory + '/' + kind + '_' + account + '.csv'
+
+    def klines():
+        downloader.klines(klines_dir, symbols, intervals, [], {})
+        return sum(_rows(klines_dir + '/' + interval + '/' + f)
+                   for interval in intervals for f in os.listdir(klines_dir + '/' + interval))
+
+    def merge_klines():
+        helper.merge_klines(klines_dir + '/1d', workdir, 'merged_1d_klines.csv')
+        return _rows(workdir + '/merged_1d_klines.csv')
+
+    def balances():
+        for account in accounts:
+            downloader.balances(account, 'SPOT', account, 'secret', account_file(account, 'balances'))
+        return sum(_rows(account_file(account, 'balances')) for account in accounts)
+
+    def merge_files():
+        helper.merge_files([account_file(account, 'balances') for account in accounts], workdir + '/balances_all_accounts.csv')
+        return _rows(workdir + '/balances_all_accounts.csv')
+
+    def snapshots():
+        for account in accounts[:scale['snapshot_accounts']]:
+            downloader.daily_account_snapshots(
+                account, 'SPOT', account, 'secret',
+                account_file(account, 'snapshot_daily_balances'),
+                account_file(account, 'snapshot_daily_positions'),
+                account_file(account, 'snapshot_daily_assets'))
+        return sum(_rows(account_file(account, 'snapshot_daily_assets')) for account in accounts[:scale['snapshot_accounts']])
+
+    def trades():
+        downloader.trades(accounts[0], 'SPOT', accounts[0], 'secret', symbols, account_file(accounts[0], 'trades'))
+        return _rows(account_file(accounts[0], 'trades'))
+
+    def orders():
+        downloader.orders(accounts[0], 'SPOT', accounts[0], 'secret', symbols, account_file(accounts[0], 'orders'))
+        return _rows(account_file(accounts[0], 'orders'))
+
+    def deposits():
+        for account in accounts:
+            downloader.deposits(account, 'SPOT', account, 'secret', account_file(account, 'deposits'))
+        return sum(_rows(account_file(account, 'deposits')) for account in accounts)
+
+    functions = {
+        'klines': klines, 'merge_klines': merge_klines, 'balances': balances, 'merge_files': merge_files,
+        'daily_account_snapshots': snapshots, 'trades_initial': trades, 'trades_resume': trades,
+        'orders_initial': orders, 'orders_resume': orders, 'deposits': deposits}
+
+    results = []
+    try:
+        for stage in stages:
+            if stage in selected:
+                results.append(measure(stage, functions[stage], memory))
+    finally:
+        server.stop()
+    return results
+
+
+def compare(results: list, baseline_file: str, tolerance: float):
+    """compare results with a baseline
+
+    :returns: list of stages, which are slower than the baseline plus tolerance
+    """
+    with open(baseline_file) as file:
+        baseline = {result['stage']: result for result in json.load(file)['results']}
+    regressions = []
+    for result in results:
+        previous = baseline.get(result['stage'])
+        if previous is None or previous['seconds'] == 0:
+            continue
+        result['baseline_seconds'] = previous['seconds']
+        result['change'] = round(result['seconds'] / previous['seconds'] - 1, 4)
+        if result['change'] > tolerance:
+            regressions.append(result['stage'])
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark suite for binance-reporting")
+    parser.add_argument('--scale', choices=list(scales), default='small')
+    parser.add_argument('--stages', nargs='*', default=stages, choices=stages)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', default='')
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed slow-down compared to baseline, e.g. 0.2 = 20%%")
+    parser.add_argument('--workdir', default='', help="directory for the generated files (default: temporary directory)")
+    parser.add_argument('--no-memory', action='store_true', help="do not trace memory allocations (faster)")
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level, format="%(asctime)s [%(levelname)s] - %(message)s")
+    workdir = args.workdir or tempfile.mkdtemp(prefix='binance_reporting_bench_')
+    try:
+        results = run(scales[args.scale], workdir, args.stages, not args.no_memory)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    regressions = []
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+
+    report = {
+        'scale': args.scale,
+        'parameters': scales[args.scale],
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'results': results,
+        'regressions': regressions}
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(json.dumps(results, indent=2))
+
+    if regressions:
+        sys.exit("Performance regression in: " + ', '.join(regressions))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,40 @@
 
 .. moduleauthor:: Jan Abraham
 
+Functions of the modules are loaded on first access only, so importing the package
+(e.g. by binance_reporting.start) does not pull in pandas, python-binance or python-telegram-bot.
 """
-from .downloader import *
-from .helper import *
-from .ticker import *
\ No newline at end of file
+import importlib
+
+# public functions and the module providing them
+_exports = {
+    "balances": "downloader",
+    "daily_account_snapshots": "downloader",
+    "trades": "downloader",
+    "orders": "downloader",
+    "open_orders": "downloader",
+    "deposits": "downloader",
+    "withdrawals": "downloader",
+    "prices": "downloader",
+    "klines": "downloader",
+    "read_config": "helper",
+    "get_symbols": "helper",
+    "get_catalog": "helper",
+    "API_weight_check": "helper",
+    "API_close_connection": "helper",
+    "file_remove_blanks": "helper",
+    "merge_files": "helper",
+    "merge_klines": "helper",
+    "send_bal": "ticker",
+    "cost_basis": "costbasis",
+    "daily_balances": "ledger",
+}
+
+__all__ = list(_exports)
+
+
+def __getattr__(name):
+    if name in _exports:
+        module = importlib.import_module("." + _exports[name], __name__)
+        return getattr(module, name)
+    raise AttributeError("module " + repr(__name__) + " has no attribute " + repr(name))
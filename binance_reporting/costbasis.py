@@ -0,0 +1,295 @@
+"""cost basis and profit & loss of trades
+
+**Goal**
+    - realized and unrealized PnL, open lots and fees per trading pair out of the history of trades
+      (instead of only 'portval - investment' of the ticker)
+    - accounts with millions of trades are processed in seconds
+
+**Procedure**
+    - trades are grouped per trading pair and processed in vectorized passes (numpy), no loop over single trades
+    - FIFO: the cost of every sell is the cost of the earliest bought units, taken out of the cumulative
+      bought quantity and cost of the pair (np.interp)
+    - average cost: every sell is valued with the average cost of the position at the time of the sell
+    - the state (open lots, realized PnL, fees and the last processed trade id per trading pair) is kept in a
+      json file, so the next run only processes the trades added since then
+
+.. note::
+    - PnL and fees are calculated in the quote asset of the trading pair (e.g. USDT for BTCUSDT)
+    - units sold without any recorded buy before (e.g. deposited coins) have an unknown cost basis; they are
+      reported as 'unmatched qty' and do not add to the realized PnL
+    - fees paid in other assets (e.g. BNB) are reported separately and not part of the PnL
+"""
+import os
+import json
+import logging
+import numpy as np
+import pandas as pd
+try:
+    from binance_reporting import helper as hlp
+    from binance_reporting import warehouse as wh
+    from binance_reporting import metrics
+    from binance_reporting import tracing
+except:
+    import helper as hlp
+    import warehouse as wh
+    import metrics
+    import tracing
+
+# quote assets, longest first, to split trading pairs into base and quote asset
+quote_assets = ['FDUSD', 'USDT', 'BUSD', 'USDC', 'TUSD', 'DAI', 'BTC', 'ETH', 'BNB', 'EUR', 'TRY', 'GBP', 'AUD', 'BRL']
+
+methods = ['fifo', 'average']
+
+# quantities below this are treated as zero (rounding of the exchange)
+eps = 1e-9
+
+
+def split_symbol(symbol: str):
+    """split a trading pair into base and quote asset, e.g. BTCUSDT => ('BTC', 'USDT')"""
+    for quote in quote_assets:
+        if symbol.endswith(quote) and len(symbol) > len(quote):
+            return symbol[:-len(quote)], quote
+    return symbol, ''
+
+
+def _prepare(trades):
+    """numeric columns, sorted by time and id, duplicates removed"""
+    trades = trades.drop_duplicates(subset=['symbol', 'id'])
+    trades = trades.astype({'price': float, 'qty': float, 'quoteQty': float, 'commission': float})
+    trades['isBuyer'] = trades['isBuyer'].astype(str).str.lower().isin(['true', '1'])
+    return trades.sort_values(by=['symbol', 'time', 'id'], kind='mergesort')
+
+
+def _fees(trades, base, quote):
+    """quantities and cost / proceeds of the trades of one pair after fees
+
+    fees in the base asset reduce the bought quantity (buys) or increase the sold quantity (sells);
+    fees in the quote asset increase the cost (buys) or reduce the proceeds (sells)
+    """
+    qty = trades['qty'].to_numpy()
+    quote_qty = trades['quoteQty'].to_numpy()
+    commission = trades['commission'].to_numpy()
+    fee_asset = trades['commissionAsset'].to_numpy()
+    is_buy = trades['isBuyer'].to_numpy()
+    base_fee = np.where(fee_asset == base, commission, 0.0)
+    quote_fee = np.where(fee_asset == quote, commission, 0.0)
+    quantity = np.where(is_buy, qty - base_fee, qty + base_fee)
+    value = np.where(is_buy, quote_qty + quote_fee, quote_qty - quote_fee)
+    fees_quote = quote_fee + base_fee * trades['price'].to_numpy()
+    other = trades[(fee_asset != base) & (fee_asset != quote) & (commission != 0)]
+    fees_other = other.groupby('commissionAsset')['commission'].sum().to_dict()
+    return is_buy, quantity, value, float(fees_quote.sum()), fees_other
+
+
+def _fifo(is_buy, quantity, value, lots):
+    """FIFO cost of all sells of one pair (vectorized)
+
+    :param lots: open lots of the previous run as [[qty, cost], ...]; they are consumed first
+
+    :returns: realized PnL, unmatched qty, open lots
+    """
+    lots = np.asarray(lots, dtype=np.float64).reshape(-1, 2)
+    buy_qty = np.concatenate([lots[:, 0], quantity[is_buy]])
+    buy_cost = np.concatenate([lots[:, 1], value[is_buy]])
+    # cumulative bought quantity / cost; the cost of the first x units is np.interp(x, bought, cost)
+    bought = np.concatenate([[0.0], np.cumsum(buy_qty)])
+    cost = np.concatenate([[0.0], np.cumsum(buy_cost)])
+
+    bought_at = lots[:, 0].sum() + np.cumsum(np.where(is_buy, quantity, 0.0))
+    sold = np.cumsum(np.where(is_buy, 0.0, quantity))
+    # units sold beyond the bought units have no cost basis (unmatched); the rest is matched FIFO
+    excess = sold - bought_at
+    excess[excess < eps] = 0
+    unmatched = np.maximum.accumulate(excess) if len(excess) else excess
+    matched = sold - unmatched
+
+    matched_cost = np.diff(np.interp(matched, bought, cost), prepend=0.0)
+    matched_qty = np.diff(matched, prepend=0.0)
+    sell_qty = np.where(is_buy, 1.0, quantity)
+    proceeds = np.where(is_buy, 0.0, value * matched_qty / np.where(sell_qty == 0, 1.0, sell_qty))
+    realized = float((proceeds - matched_cost).sum())
+
+    # open lots: everything bought after the last matched unit
+    consumed = matched[-1] if len(matched) else 0.0
+    first = int(np.searchsorted(bought, consumed, side='right'))
+    open_lots = []
+    if first < len(bought):
+        open_lots.append([bought[first] - consumed, cost[first] - float(np.interp(consumed, bought, cost))])
+        open_lots.extend([[q, c] for q, c in zip(buy_qty[first:], buy_cost[first:])])
+    open_lots = [lot for lot in open_lots if lot[0] > eps]
+    return realized, float(unmatched[-1]) if len(unmatched) else 0.0, open_lots
+
+
+def _average(is_buy, quantity, value, position, position_cost):
+    """average cost of all sells of one pair
+
+    the average cost is a recurrence (every buy changes it), so this is one sequential pass over plain arrays
+
+    :returns: realized PnL, unmatched qty, position, cost of the position
+    """
+    realized = 0.0
+    unmatched = 0.0
+    for buy, qty, val in zip(is_buy.tolist(), quantity.tolist(), value.tolist()):
+        if buy:
+            position += qty
+            position_cost += val
+            continue
+        matched = min(qty, position)
+        if qty > 0 and matched > eps:
+            average = position_cost / position
+            realized += val * matched / qty - average * matched
+            position_cost -= average * matched
+            position -= matched
+        unmatched += qty - matched
+        if position <= eps:
+            position, position_cost = 0.0, 0.0
+    return realized, unmatched, position, position_cost
+
+
+def compute(trades, method: str = 'fifo', state: dict = None):
+    """cost basis and PnL per trading pair
+
+    :param trades: required; trades as downloaded by downloader.trades (new trades only, if state is given)
+    :type trades: pandas DataFrame
+    :param str method: optional; 'fifo' or 'average'
+    :param dict state: optional; state of the previous run (as returned by this function)
+
+    :returns: state per trading pair (dict); contains open lots / position, realized PnL, fees and last trade id
+    """
+    if method not in methods:
+        raise ValueError("unknown cost basis method " + str(method) + "; use one of " + ', '.join(methods))
+    state = {} if state is None else state
+    if trades.empty:
+        return state
+    trades = _prepare(trades)
+    for symbol, pair_trades in tracing.iterate(trades.groupby('symbol', sort=False), 'symbol'):
+        previous = state.get(symbol, {})
+        pair_trades = pair_trades[pair_trades['id'] > previous.get('last_id', -1)]
+        if pair_trades.empty:
+            continue
+        base, quote = split_symbol(symbol)
+        is_buy, quantity, value, fees_quote, fees_other = _fees(pair_trades, base, quote)
+        if method == 'fifo':
+            realized, unmatched, lots = _fifo(is_buy, quantity, value, previous.get('lots', []))
+            position = float(sum(lot[0] for lot in lots))
+            position_cost = float(sum(lot[1] for lot in lots))
+        else:
+            realized, unmatched, position, position_cost = _average(
+                is_buy, quantity, value, previous.get('position', 0.0), previous.get('position_cost', 0.0))
+            lots = []
+        for asset, amount in previous.get('fees_other', {}).items():
+            fees_other[asset] = fees_other.get(asset, 0.0) + amount
+        state[symbol] = {
+            'base': base,
+            'quote': quote,
+            'lots': lots,
+            'position': position,
+            'position_cost': position_cost,
+            'realized': previous.get('realized', 0.0) + realized,
+            'unmatched': previous.get('unmatched', 0.0) + unmatched,
+            'fees_quote': previous.get('fees_quote', 0.0) + fees_quote,
+            'fees_other': {asset: float(amount) for asset, amount in fees_other.items()},
+            'trades': previous.get('trades', 0) + len(pair_trades),
+            'last_id': int(pair_trades['id'].max()),
+            'last_time': int(pair_trades['time'].max())}
+    return state
+
+
+def report(state: dict, prices: dict = None, account_name: str = '', method: str = 'fifo'):
+    """cost basis and PnL per trading pair as dataframe
+
+    :param dict state: required; as returned by compute
+    :param dict prices: optional; current price per trading pair for the unrealized PnL, e.g. {'BTCUSDT': 30000.0}
+
+    :returns: dataframe with one line per trading pair
+    """
+    prices = prices or {}
+    rows = []
+    for symbol, pair in state.items():
+        price = prices.get(symbol, np.nan)
+        rows.append({
+            'symbol': symbol,
+            'base': pair['base'],
+            'quote': pair['quote'],
+            'method': method,
+            'position': pair['position'],
+            'position cost': pair['position_cost'],
+            'average cost': pair['position_cost'] / pair['position'] if pair['position'] > eps else 0.0,
+            'open lots': len(pair['lots']),
+            'realized PnL': pair['realized'],
+            'price': price,
+            'market value': pair['position'] * price,
+            'unrealized PnL': pair['position'] * price - pair['position_cost'],
+            'fees': pair['fees_quote'],
+            'fees other': json.dumps(pair['fees_other']) if pair['fees_other'] else '',
+            'unmatched qty': pair['unmatched'],
+            'trades': pair['trades'],
+            'last id': pair['last_id'],
+            'UTCTime': pd.to_datetime(pair['last_time'], unit='ms', utc=True),
+            'account': account_name})
+    return pd.DataFrame(rows)
+
+
+@metrics.timed
+@tracing.traced
+def cost_basis(account_name, trades_file, cost_basis_file, state_file='', method='fifo', prices=None, db=None):
+    """update cost basis and PnL of an account with the trades added since the last run
+
+    **Goal**
+        - know the realized and unrealized PnL and the fees per trading pair
+
+    **Procedure**
+        - read the state of the last run (if any) and the trades
+        - process only trades with an id above the last processed id per trading pair (see compute)
+        - value open positions with the current prices
+        - write the cost basis per trading pair to a csv file (or the warehouse) and the state to a json file
+
+    :param str account_name: required; added to the csv file for easier tracking
+    :param str trades_file: required; csv file with the trades (see downloader.trades)
+    :param str cost_basis_file: required; name and location of the csv file for the cost basis per trading pair
+    :param str state_file: optional; json file with the state for incremental updates (default: no state)
+    :param str method: optional; 'fifo' or 'average'
+    :param dict prices: optional; current price per trading pair (default: current prices of the exchange)
+    :param object db: optional; warehouse connection; if provided, trades are read from and the cost basis is written to the warehouse
+
+    :returns: dataframe with the cost basis per trading pair
+    """
+    logging.info(" - Start calculating cost basis (%s) for account %s -", method, account_name)
+    state = {}
+    if state_file != '' and os.path.isfile(state_file):
+        with open(state_file) as file:
+            saved = json.load(file)
+        if saved.get('method') == method:
+            state = saved['symbols']
+        else:
+            logging.info(" . cost basis method changed; re-calculating all trades")
+
+    if db is not None:
+        trades = wh.read(db, 'trades', account=account_name)
+    elif os.path.isfile(trades_file):
+        trades = hlp.read_csv(trades_file)
+    else:
+        trades = pd.DataFrame()
+    if not trades.empty and state:
+        last_ids = pd.Series({symbol: pair['last_id'] for symbol, pair in state.items()})
+        trades = trades[trades['id'] > trades['symbol'].map(last_ids).fillna(-1)]
+    logging.debug("new trades to be processed: %s", str(len(trades)))
+
+    state = compute(trades, method, state)
+
+    if prices is None:
+        prices = {ticker['symbol']: float(ticker['price']) for ticker in hlp.get_all_tickers(hlp.get_client())}
+    result = report(state, prices, account_name, method)
+
+    if db is not None:
+        wh.replace(db, 'cost_basis', result, account=account_name)
+    elif not result.empty:
+        hlp.to_csv(result, cost_basis_file, index=False)
+    if state_file != '':
+        with open(state_file + '.tmp', 'w') as file:
+            json.dump({'method': method, 'symbols': state}, file)
+        os.replace(state_file + '.tmp', state_file)
+
+    logging.info(" - Finished calculating cost basis for %s trading pairs of account %s -",
+        str(len(result)), account_name)
+    return result
@@ -0,0 +1,93 @@
+"""decoding of API responses into typed columns
+
+**Goal**
+    - millions of candles without millions of python lists and strings: klines are parsed straight out of the
+      response body into one numpy array, instead of json => list of lists => dataframe => pd.to_numeric
+    - only the needed fields are kept (open time and OHLCV of the 12 fields of a candle)
+    - faster parsing of all other responses (trades, orders, snapshots, ...)
+
+**Procedure**
+    - klines: the API client returns the raw response body (see raw and helper.get_client); brackets and quotes are
+      removed and numpy parses the numbers in one go (all fields of a candle are numbers)
+    - other responses: parsed by orjson, if installed (optional; pip install orjson); otherwise by json
+
+**Usage**
+
+    .. code:: python
+
+        from binance_reporting import decoding
+        klines = decoding.get_klines(client, symbol='BTCUSDT', interval='1h', startTime=0, limit=1000)
+        klines[:, 0]    # open times (ms)
+"""
+import json
+import threading
+import contextlib
+import numpy as np
+try:
+    import orjson       # optional; faster parsing of responses
+except ImportError:
+    orjson = None
+
+kline_fields = 12       # fields of a candle in the response of api/v3/klines
+kline_columns = 6       # kept: open time, open, high, low, close, volume
+
+_raw = threading.local()
+
+
+def loads(content):
+    """parse a json response body (orjson, if installed)
+
+    :param bytes content: required; response body
+
+    :returns: parsed response (lists, dicts, strings, numbers)
+    :raises ValueError: in case the body is no valid json
+    """
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+@contextlib.contextmanager
+def raw():
+    """responses of the API client are returned as raw body (bytes) within this context (current thread only)"""
+    previous = getattr(_raw, 'active', False)
+    _raw.active = True
+    try:
+        yield
+    finally:
+        _raw.active = previous
+
+
+def raw_active():
+    """True, if the calling thread requested raw response bodies (see raw)"""
+    return getattr(_raw, 'active', False)
+
+
+def kline_array(content):
+    """open time and OHLCV of klines as float64 array
+
+    :param content: required; raw response body of api/v3/klines (bytes) or the parsed list of lists
+
+    :returns: numpy array with one line per candle: open time (ms), open, high, low, close, volume
+    :raises ValueError: in case the response does not consist of candles with 12 fields
+    """
+    if not isinstance(content, (bytes, bytearray)):
+        # response has been parsed already (e.g. client without raw responses)
+        return np.array([row[:kline_columns] for row in content], dtype=np.float64).reshape(-1, kline_columns)
+    values = np.fromstring(bytes(content).translate(None, b'[]"'), dtype=np.float64, sep=',')
+    if values.size % kline_fields != 0:
+        raise ValueError("invalid klines response: " + bytes(content[:100]).decode(errors='replace'))
+    return values.reshape(-1, kline_fields)[:, :kline_columns].copy()
+
+
+def get_klines(client, **params):
+    """download klines as float64 array (see kline_array)
+
+    :param object client: required; API client (see helper.get_client)
+    :param params: required; parameters of api/v3/klines, e.g. symbol, interval, startTime, endTime, limit
+
+    :returns: numpy array with one line per candle: open time (ms), open, high, low, close, volume
+    """
+    with raw():
+        content = client.get_klines(**params)
+    return kline_array(content)
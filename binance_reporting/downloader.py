@@ -20,15 +20,33 @@ functions available for:
 import os               # set home directory of current user depending on OS
 import sys              # get arguments from calling the script
 import time
+import json
+import threading
+import concurrent.futures
 import pandas as pd
 from binance.client import Client
 import logging
-from finta import TA        # for technical indicators
 try:
     from binance_reporting import helper as hlp
+    from binance_reporting import warehouse as wh
+    from binance_reporting import metrics
+    from binance_reporting import tracing
+    from binance_reporting import resilience
+    from binance_reporting import valuation
+    from binance_reporting import pipeline
+    from binance_reporting import decoding
 except:
     import helper as hlp
-
+    import warehouse as wh
+    import metrics
+    import tracing
+    import resilience
+    import valuation
+    import pipeline
+    import decoding
+
+@metrics.timed
+@tracing.traced
 def balances(
     account_name: str,  # used to differentiate info in debug log
     account_type: str,
@@ -38,6 +56,8 @@ def balances(
     bal_fut_positions_file: str = '',
     bal_fut_assets_file: str = '',
     writetype: str = 'w',  # 'a' or 'w'
+    db = None,
+    store = None,
     ):
     """download balances from exchange and write it into a csv file if provided
 
@@ -56,6 +76,9 @@ def balances(
     :param str bal_fut_positions_file: optional; name and location of the csv file to be filled with future positions info
     :param vbal_fut_assets_file: optional; name and location of the csv file to be filled with futures assets info
     :param str writetype: optional; indicates if balances should be added ('a') or a new file should be written ('w')
+    :param object db: optional; warehouse connection; if provided, the balances of the account are replaced in the warehouse
+    :param object store: optional; result store of the run (see helper.ResultStore); balances already downloaded
+        in this run (e.g. by the ticker) are re-used as long as they are fresh enough
     
     :return:
         - writes csv file with balances of the account (if filenames have been provided)
@@ -63,15 +86,58 @@ def balances(
     :rtype: float64
     """
     logging.info(" - Start downloading balances for Account: %s -", account_name)
+    data = store.get('balances', account_name) if store is not None else None
+    if data is None:
+        data = _download_balances(account_name, account_type, PUBLIC, SECRET)
+        if store is not None:
+            store.put('balances', account_name, data)
+    else:
+        logging.info(" . re-using balances downloaded %s sec ago", str(round(store.age('balances', account_name))))
+    balances = data['balances']
+    fut_pos = data['fut_pos']
+    fut_assets = data['fut_assets']
+    result = data['result']
+
+    if account_type == "FUTURES" and bal_fut_positions_file != '':
+        logging.debug("write balances to %s", bal_fut_positions_file)
+        hlp.to_csv(fut_pos, bal_fut_positions_file, index=False)
+        hlp.to_csv(fut_assets, bal_fut_assets_file, index=False)
+
+    if balances_file != '':
+        logging.debug("write balances to %s", balances_file)
+        if writetype == "a":
+            hlp.to_csv(balances, balances_file, index=False, header=False, mode=writetype)
+        else:
+            hlp.to_csv(balances, balances_file, index=False)
+
+    if db is not None:
+        logging.debug("write balances to warehouse")
+        wh.replace(db, 'balances', balances, account=account_name)
+        if account_type == "FUTURES":
+            wh.replace(db, 'balances_positions', fut_pos, account=account_name)
+            wh.replace(db, 'balances_assets', fut_assets, account=account_name)
+
+    logging.info(" - Finished downloading balances for account %s -", account_name)
+
+    return result
+
+
+def _download_balances(account_name, account_type, PUBLIC, SECRET):
+    """download balances and prices from exchange and calculate the values of all assets
+
+    :returns: dict with balances, fut_pos, fut_assets (dataframes) and result (as returned by balances)
+    """
     logging.debug("connecting to binance ...")
 
-    client = Client(api_key=PUBLIC, api_secret=SECRET)
+    client = hlp.get_client(PUBLIC, SECRET)
 
     logging.debug("reading balances and prices from exchnge ...")
     hlp.API_weight_check(client)
     fut_pos = pd.DataFrame()
     fut_assets = pd.DataFrame()
-    prices = pd.DataFrame(client.get_all_tickers())
+    tickers = hlp.get_all_tickers(client)
+    ticker_prices = {ticker['symbol']: float(ticker['price']) for ticker in tickers}
+    graph = valuation.graph(client, tickers)
     balances = pd.DataFrame()
     if account_type == "FUTURES":
         balances = pd.DataFrame()
@@ -101,24 +167,16 @@ def balances(
         logging.debug("collecting future account positions and assets")
         fut_pos = pd.DataFrame(accountinfo_fut['positions'])
         fut_pos.drop(fut_pos[fut_pos.initialMargin == '0'].index, inplace = True)
-        fut_pos['USDT price'] = 0
-        for symbol in fut_pos["symbol"]:
-            fut_pos["USDT price"].loc[fut_pos.symbol == symbol] = (prices["price"].loc[prices.symbol == symbol].iloc[0])
-            fut_pos['UTCtime'] = pd.to_datetime(fut_pos["updateTime"], unit='ms', utc=True)
+        fut_pos['USDT price'] = fut_pos['symbol'].map(ticker_prices).fillna(0)
+        fut_pos['UTCtime'] = pd.to_datetime(fut_pos["updateTime"], unit='ms', utc=True)
         fut_pos['account'] = account_name
         fut_pos['type'] = account_type
         logging.debug("collecting future account assets")
 
         fut_assets = pd.DataFrame(accountinfo_fut['assets'])
         fut_assets.drop(fut_assets[fut_assets.updateTime == 0].index, inplace=True)
-        fut_assets['USDT price'] = 0
-        for asset in fut_assets['asset']:
-            if asset == 'USDT':
-                price = 1
-            else:
-                price = prices["price"].loc[prices.symbol == asset + 'USDT'].iloc[0]
-            fut_assets['USDT price'].loc[fut_assets.asset == asset] = price
-      
+        fut_assets['USDT price'] = graph.prices(fut_assets['asset']).values
+
         fut_assets[["marginBalance", "USDT price"]] = fut_assets[["marginBalance", "USDT price"]].apply(pd.to_numeric)
         fut_assets['Asset value'] = fut_assets['marginBalance'] * fut_assets['USDT price']
         portval = {
@@ -142,10 +200,6 @@ def balances(
             'cash' : float(accountinfo_fut['totalMarginBalance']) - float(accountinfo_fut['totalMaintMargin']), #needed for Ticker => Balance
             "portval": float(balances["Asset value"].values[0])
         }
-        if bal_fut_positions_file != '':
-            logging.debug("write balances to %s", bal_fut_positions_file)
-            fut_pos.to_csv(bal_fut_positions_file, index=False)
-            fut_assets.to_csv(bal_fut_assets_file, index=False)
 
     if account_type == 'SPOT':
         accountinfo = client.get_account()
@@ -153,20 +207,13 @@ def balances(
         logging.debug("reducing lists of balances and prices to the minimum ...")
         balances = pd.DataFrame(accountinfo["balances"])
         balances[["free", "locked"]] = balances[["free", "locked"]].apply(pd.to_numeric)
-        prices["price"] = pd.to_numeric(prices["price"])
         balances.drop(
             balances[(balances.free == 0) & (balances.locked == 0)].index, inplace=True
         )
-        prices = prices[prices["symbol"].isin(balances["asset"] + "USDT")]
 
         logging.debug("adding USDT prices current date and to list")
-        balances["USDT price"] = 0
         pd.set_option('mode.chained_assignment', None)
-        for symbol in prices["symbol"]:
-            balances["USDT price"].loc[balances.asset + "USDT" == symbol] = (
-                prices["price"].loc[prices.symbol == symbol].iloc[0]
-            )
-        balances["USDT price"].loc[balances.asset == "USDT"] = 1
+        balances["USDT price"] = graph.prices(balances["asset"]).values
 
         logging.debug("calculate additional values for the balance overview")
         balances["Free Coin Value"] = balances["free"] * balances["USDT price"]
@@ -202,19 +249,12 @@ def balances(
 
     balances['account'] = account_name
     balances['type'] = account_type
-    
-    if balances_file != '':
-        logging.debug("write balances to %s", balances_file)
-        if writetype == "a":
-            balances.to_csv(balances_file, index=False, header=False, mode=writetype)
-        else:
-            balances.to_csv(balances_file, index=False)
-
-    logging.info(" - Finished downloading balances for account %s -", account_name)
 
-    return result
+    return {'balances': balances, 'fut_pos': fut_pos, 'fut_assets': fut_assets, 'result': result}
 
 
+@metrics.timed
+@tracing.traced
 def daily_account_snapshots(
     account_name,
     account_type,
@@ -222,7 +262,8 @@ def daily_account_snapshots(
     SECRET,
     snapshots_balances_file,
     snapshots_positions_file,
-    snapshots_assets_file
+    snapshots_assets_file,
+    db = None
     ):
     """download daily account snapshots from exchange and write it into a csv file
 
@@ -231,6 +272,8 @@ def daily_account_snapshots(
         - walk through the assets of that day one-by-one to determine the close-price of that asset on the date of the snapshot
         - in case there is no price found: '0' value will be filled in
         - save the data into the respective csv files
+        - download, valuation and writing run as stages connected by bounded queues (see pipeline): while a snapshot
+          is valued and written, the next window is downloaded already
 
     If you want to re-download all snapshots again, you just need to delete this file. Be cautious: Binance only holds max. 180 days of snapshots. In case you want to go back furhter, these
     days might be your only available information about older snapshots written by this procedure in case you have run it before. I recommend to save the previous version and add the missing dates manually into 
@@ -249,6 +292,7 @@ def daily_account_snapshots(
     :param str snapshot_balances_file: optional. filename (incl. absolute path), where the balances per day are exported to (in csv-format). For SPOT and FUTURE accounts.
     :param str snapshot_positions_file: optional. filename (incl. absolute path), where the positions per day are exported to (in csv-format). For FUTURE accounts only.
     :param str snapshot_assets_file: optional. filename (incl. absolute path), where the assets per day are exported to (in csv-format). For SPOT and FUTURE accounts.
+    :param object db: optional. warehouse connection; if provided, the snapshots are upserted into the warehouse instead of being written to the csv files
 
     :return: portfolio value and written csv file(s) in case filename(s) have been provided
     :rtype: float64
@@ -278,265 +322,432 @@ def daily_account_snapshots(
         "verify if csv file already exists and \
         determine last recorded snapshot"
     )
-    snaps = pd.DataFrame()
-    snaps_new = pd.DataFrame()
     snap_balances = pd.DataFrame()
     snap_assets = pd.DataFrame()
-    snap_assets_new = pd.DataFrame()
     snap_positions = pd.DataFrame()
-    snap_pos_new = pd.DataFrame()
     start_time_ms = current_time_ms - snapshot_days_max_ms
-    if os.path.isfile(snapshots_balances_file):
-        snap_balances = pd.read_csv(snapshots_balances_file)
+    last_snapshot_ms = None
+    if db is not None:
+        last_snapshot_ms = wh.watermark(db, 'snapshot_daily_balances', 'updateTime', account=account_name)
+    elif os.path.isfile(snapshots_balances_file):
+        snap_balances = hlp.read_csv(snapshots_balances_file)
         if not snap_balances.empty:
-            start_time_ms = snap_balances["updateTime"].max() + 1
-            if current_time_ms - start_time_ms < daily_ms:
-                logging.info(" . No newer snapshot available.")
-                logging.debug(" ... Date of last recorded snapshot is %s", str(pd.to_datetime(start_time_ms, unit="ms", utc=True)))
-                return "No newer snapshot available."
-            if os.path.isfile(snapshots_assets_file):
-                snap_assets = pd.read_csv(snapshots_assets_file)
+            last_snapshot_ms = snap_balances["updateTime"].max()
+    if last_snapshot_ms is not None:
+        start_time_ms = last_snapshot_ms + 1
+        if current_time_ms - start_time_ms < daily_ms:
+            logging.info(" . No newer snapshot available.")
+            logging.debug(" ... Date of last recorded snapshot is %s", str(pd.to_datetime(start_time_ms, unit="ms", utc=True)))
+            return "No newer snapshot available."
+        if db is None and os.path.isfile(snapshots_assets_file):
+            snap_assets = hlp.read_csv(snapshots_assets_file)
 
     #
     # download missing snapshots
     #
     logging.debug(" ... Opening connection to exchange.")
-    client = Client(api_key=PUBLIC, api_secret=SECRET)
+    client = hlp.get_client(PUBLIC, SECRET)
     # default value of 10 is too low for 30 days snapshot download per request
     client.REQUEST_TIMEOUT = 30
-    logging.debug("download snapshots for Account %s", account_name)
-    while start_time_ms < current_time_ms:
-        logging.info(" . timeframe of snapshot download: %s to %s",
-            str(pd.to_datetime(start_time_ms, unit="ms", utc=True)),
-            str(pd.to_datetime(start_time_ms + step_ms, unit='ms', utc=True))
-        )
-        hlp.API_weight_check(client)
-        try:
-            snaps_new = pd.DataFrame(client.get_account_snapshot(
-                    type=account_type,
-                    startTime=int(start_time_ms),
-                    endTime=int(start_time_ms + step_ms))
-            )
-        except Exception as e:
-            logging.warning("Exception occured: ", exc_info=True)
-            continue
-        snaps = pd.concat([snaps, snaps_new], ignore_index=True)
-        logging.info(" . overall nbr of snapshots downloaded: %s.", str(len(snaps)))
-        start_time_ms = start_time_ms + step_ms + 1
 
-    # get list of tickers and prices to add them later
-    prices = pd.DataFrame(client.get_all_tickers())
-    prices["price"] = pd.to_numeric(prices["price"])
+    # conversion paths of all assets into USDT (via other assets, if there is no USDT pair);
+    # prices are downloaded by the valuation stage with its own client, while the next snapshots are downloaded
+    price_client = hlp.get_client()
+    graph = valuation.graph(price_client)
 
-    hlp.API_close_connection(client)
+    def download(start_time_ms):
+        """download stage (own thread): snapshots of one window after the other"""
+        downloaded = 0
+        logging.debug("download snapshots for Account %s", account_name)
+        try:
+            while start_time_ms < current_time_ms:
+                logging.info(" . timeframe of snapshot download: %s to %s",
+                    str(pd.to_datetime(start_time_ms, unit="ms", utc=True)),
+                    str(pd.to_datetime(start_time_ms + step_ms, unit='ms', utc=True))
+                )
+                hlp.API_weight_check(client)
+                try:
+                    with tracing.span(str(pd.to_datetime(start_time_ms, unit="ms").date()), 'window'):
+                        snaps_new = pd.DataFrame(client.get_account_snapshot(
+                                type=account_type,
+                                startTime=int(start_time_ms),
+                                endTime=int(start_time_ms + step_ms))
+                        )
+                except Exception as e:
+                    # failed requests have been retried already (see resilience); continuing with the same window would
+                    # never end. Downloaded snapshots are written; the next run continues after the last written snapshot
+                    logging.warning("snapshots from %s could not be downloaded; stopping the snapshot download: %s",
+                        str(pd.to_datetime(start_time_ms, unit="ms", utc=True)), str(e))
+                    metrics.count('download_failures_total', 1, 'windows / trading pairs, which could not be downloaded')
+                    break
+                downloaded = downloaded + len(snaps_new)
+                metrics.record_rows('downloaded', len(snaps_new))
+                logging.info(" . overall nbr of snapshots downloaded: %s.", str(downloaded))
+                if "snapshotVos" in snaps_new:
+                    for snap in snaps_new["snapshotVos"]:
+                        yield snap
+                start_time_ms = start_time_ms + step_ms + 1
+        finally:
+            hlp.API_close_connection(client)
 
     #
     # split downloaded snapshots and add more data before writing it to csv file
     #
-    logging.debug("writing snapshots to csv ...")
-    if account_type == "SPOT":
-        for snap in snaps["snapshotVos"]:
-            updatetime_ms = snap["updateTime"]
-            updatetime_utc = pd.to_datetime(snap["updateTime"], unit="ms", utc=True)
-            snap_balance = pd.DataFrame(snap["data"]["balances"])
-            snap_balance[["free", "locked"]] = snap_balance[["free", "locked"]].apply(
-                pd.to_numeric
-            )
-            snap_balance.drop(
-                snap_balance[(snap_balance.free == 0) & (snap_balance.locked == 0)].index, inplace=True
-            )
-            snap_balance["USDT symbol"] = snap_balance["asset"] + "USDT"
-            snap_balance["USDT price"] = 0
-            symbol_shortlist = prices[prices["symbol"].isin(snap_balance["asset"] + "USDT")]
-            logging.info(" . add USDT prices to %s assets from snapshot of %s", str(len(symbol_shortlist)), str(updatetime_utc))
-            for symbol in symbol_shortlist["symbol"]:
-                try:
-                    kline = pd.DataFrame(
-                        client.get_historical_klines(
-                            symbol,
-                            Client.KLINE_INTERVAL_1DAY,
-                            updatetime_ms,
-                            updatetime_ms + daily_ms,
-                            )
-                        )
-                except Exception as e:
-                    logging.warning(" . API connection lost. Trying to re-connect and re-try.")
-                    hlp.API_close_connection(client)
-                    hlp.API_weight_check(client)
-                logging.debug("downloading historic prices for %s. API payload: %s",
-                    symbol,
-                    str(hlp.API_weight_check(client))
+    def value_spot(snap):
+        """valuation stage: USDT prices and values of the balances of one snapshot"""
+        updatetime_ms = snap["updateTime"]
+        updatetime_utc = pd.to_datetime(snap["updateTime"], unit="ms", utc=True)
+        snap_balance = pd.DataFrame(snap["data"]["balances"])
+        snap_balance[["free", "locked"]] = snap_balance[["free", "locked"]].apply(
+            pd.to_numeric
+        )
+        snap_balance.drop(
+            snap_balance[(snap_balance.free == 0) & (snap_balance.locked == 0)].index, inplace=True
+        )
+        logging.info(" . add USDT prices to %s assets from snapshot of %s", str(len(snap_balance)), str(updatetime_utc))
+        # assets without price at that time (e.g. delisted coins) get the price 0
+        rates = graph.historical(price_client, snap_balance["asset"].unique(), updatetime_ms)
+        snap_balance["USDT price"] = snap_balance["asset"].map(rates).fillna(0)
+        logging.debug("calculate additional values for the balance overview")
+        snap_balance["Free Coin Value"] = snap_balance["free"] * snap_balance["USDT price"]
+        snap_balance["Locked Coin Value"] = snap_balance["locked"] * snap_balance["USDT price"]
+        snap_balance["Asset value"] = (
+            snap_balance["Free Coin Value"] + snap_balance["Locked Coin Value"]
+        )
+        snap_balance.sort_values(by=["asset"], inplace=True)
+        snap_balance['updateTime'] = updatetime_ms
+        if snap_balance.loc[snap_balance["asset"] == "USDT"].empty:
+            free_coin_value = 0
+        else:
+            free_coin_value = snap_balance["Free Coin Value"].loc[snap_balance["asset"] == "USDT"].iloc[0]
+        portval = {
+            "asset": "PortVal",
+            "Free Coin Value": snap_balance["Free Coin Value"].sum()- free_coin_value,
+            "Locked Coin Value": snap_balance["Locked Coin Value"].sum(),
+            "Asset value": snap_balance["Asset value"].sum(),
+            "updateTime" : updatetime_ms
+        }
+        portval = pd.DataFrame(portval, index=[0])
+        snap_balance = pd.concat([snap_balance, portval], ignore_index=True)
+        return updatetime_ms, snap_balance, portval
+
+    def write_spot(valued):
+        """write stage (this thread): add one snapshot to the files (or the warehouse)"""
+        nonlocal snap_assets, snap_balances
+        updatetime_ms, snap_balance, portval = valued
+
+        #
+        # write daily asset information into snapshot assets file
+        # writing is done for every single snapshot to mitigate API timeouts without loosing the already downloaded snapshots
+        # several date formatting actions to ensure
+        # - UTCTime does not contain hh:mm:ss (for better handling in excel)
+        # - no duplicates
+        #
+        snap_assets = pd.concat([snap_assets, snap_balance], ignore_index=True)
+        snap_assets["UTCTime"] = pd.to_datetime(snap_assets['updateTime'], unit="ms", utc=True)
+        snap_assets['UTCTime'] = pd.to_datetime(snap_assets['UTCTime'], format="%Y-%m-%d", utc=True, infer_datetime_format=True).dt.date
+        snap_assets['UTCTime'] = pd.to_datetime(snap_assets['UTCTime'], format="%Y-%m-%d", utc=True, infer_datetime_format=True)
+        snap_assets["account"] = account_name
+        snap_assets["type"] = account_type
+        snap_assets.drop_duplicates(
+                subset=["UTCTime", "asset", "account", "type"], keep="last", inplace=True
+                )
+        if db is not None:
+            _snapshot_to_warehouse(db, 'snapshot_daily_assets', snap_assets, updatetime_ms)
+        else:
+            hlp.to_csv(snap_assets, snapshots_assets_file, index=False, date_format="%Y-%m-%d")
+
+        # writing daily balances
+        snap_balances = pd.concat([snap_balances, portval], ignore_index=True)
+        snap_balances["UTCTime"] = pd.to_datetime(snap_balances["updateTime"], unit="ms", utc=True)
+        snap_balances['UTCTime'] = pd.to_datetime(snap_balances['UTCTime'], format="%Y-%m-%d", utc=True, infer_datetime_format=True).dt.date
+        snap_balances['UTCTime'] = pd.to_datetime(snap_balances['UTCTime'], format="%Y-%m-%d", utc=True, infer_datetime_format=True)
+        snap_balances["account"] = account_name
+        snap_balances["type"] = account_type
+        snap_balances.drop_duplicates(
+                subset=["UTCTime", "asset", "account", "type"], keep="last", inplace=True
+                )
+        snap_balances.sort_values(by=['UTCTime'], ascending=False, inplace=True)
+        if db is not None:
+            _snapshot_to_warehouse(db, 'snapshot_daily_balances', snap_balances, updatetime_ms)
+        else:
+            hlp.to_csv(snap_balances, snapshots_balances_file, index=False, date_format="%Y-%m-%d")
+
+    def value_futures(snap):
+        """valuation stage: USDT prices and values of the assets and positions of one snapshot"""
+        updatetime_ms = snap["updateTime"]
+
+        snap_assets_new = pd.DataFrame(snap["data"]["assets"])
+        rates = graph.historical(price_client, snap_assets_new['asset'].unique(), updatetime_ms)
+        snap_assets_new['USDT price'] = snap_assets_new['asset'].map(rates).fillna(0)
+
+        # the order of following actions is important
+        # some actions might appear double work, but it ensures consistent quality
+        #
+        # work on assets
+        snap_assets_new[["marginBalance", "walletBalance", "USDT price"]] = snap_assets_new[["marginBalance", "walletBalance", "USDT price"]].apply(pd.to_numeric)
+        snap_assets_new['Margin value'] = snap_assets_new['marginBalance'] * snap_assets_new['USDT price']
+        snap_assets_new['Wallet value'] = snap_assets_new['walletBalance'] * snap_assets_new['USDT price']
+        snap_assets_new['PnL'] = snap_assets_new['marginBalance'] - snap_assets_new['walletBalance']
+        snap_assets_new["Asset value"] = snap_assets_new['Margin value']
+        portval = {
+            "asset": "PortVal",
+            "Margin value": snap_assets_new["Margin value"].sum(),
+            "Wallet value": snap_assets_new["Wallet value"].sum(),
+            "PnL" : snap_assets_new["PnL"].sum(),
+            "Asset value": snap_assets_new["Margin value"].sum()}
+        portval = pd.DataFrame(portval, index=[0])
+        snap_assets_new = pd.concat([snap_assets_new, portval], ignore_index=True)
+        snap_assets_new["updateTime"] = updatetime_ms
+
+        # work on positions, case there are positions
+        snap_pos_new = pd.DataFrame(snap["data"]["position"])
+        if not snap_pos_new.empty:
+            snap_pos_new[["entryPrice", "markPrice", "positionAmt", "unRealizedProfit"]] = snap_pos_new[["entryPrice", "markPrice", "positionAmt", "unRealizedProfit"]].apply(pd.to_numeric)
+            snap_pos_new.drop(snap_pos_new[
+                    (snap_pos_new.entryPrice == 0)
+                    & (snap_pos_new.positionAmt == 0)
+                    & (snap_pos_new.unRealizedProfit == 0)
+                    ].index, inplace=True)
+            snap_pos_new['USDT price'] = snap_pos_new['markPrice']
+            snap_pos_new['entryValue'] = snap_pos_new['entryPrice'] * snap_pos_new['positionAmt']
+            snap_pos_new['markValue'] = snap_pos_new['markPrice'] * snap_pos_new['positionAmt']
+            snap_pos_new['ValueDiff'] = snap_pos_new['markValue'] - snap_pos_new['entryValue']
+            posval = {
+                "symbol": "PosVal",
+                "unRealizedProfit": snap_pos_new["unRealizedProfit"].sum(),
+                "entryValue": snap_pos_new["entryValue"].sum(),
+                "markValue": snap_pos_new["markValue"].sum(),
+                "ValueDiff": snap_pos_new["ValueDiff"].sum()}
+            posval = pd.DataFrame(posval, index=[0])
+            snap_pos_new = pd.concat([snap_pos_new, posval], ignore_index=True)
+            snap_pos_new["updateTime"] = updatetime_ms
+        return updatetime_ms, snap_assets_new, snap_pos_new
+
+    def write_futures(valued):
+        """write stage (this thread): add one snapshot to the files (or the warehouse)"""
+        nonlocal snap_assets, snap_balances, snap_positions
+        updatetime_ms, snap_assets_new, snap_pos_new = valued
+
+        # save assets file
+        snap_assets = pd.concat([snap_assets, snap_assets_new], ignore_index=True)
+        snap_assets["UTCTime"] = pd.to_datetime(snap_assets["updateTime"], unit="ms", utc=True)
+        snap_assets['UTCTime'] = pd.to_datetime(snap_assets['UTCTime'], format="%Y-%m-%d", utc=True, infer_datetime_format=True).dt.date
+        snap_assets['UTCTime'] = pd.to_datetime(snap_assets['UTCTime'], format="%Y-%m-%d", utc=True, infer_datetime_format=True)
+        snap_assets["account"] = account_name
+        snap_assets["type"] = account_type
+        snap_assets.drop_duplicates(
+                subset=["UTCTime", "asset", "account", "type"], keep="last", inplace=True)
+        if db is not None:
+            _snapshot_to_warehouse(db, 'snapshot_daily_assets', snap_assets, updatetime_ms)
+        else:
+            hlp.to_csv(snap_assets, snapshots_assets_file, index=False, date_format="%Y-%m-%d")
+
+        # work on and save balances file
+        snap_balances = snap_assets[snap_assets['asset'] == 'PortVal']
+        snap_balances.drop(['marginBalance', 'walletBalance', 'USDT price'], axis=1, inplace=True)
+        snap_balances.sort_values(by=['updateTime'], ascending=False, inplace=True)
+        if db is not None:
+            _snapshot_to_warehouse(db, 'snapshot_daily_balances', snap_balances, updatetime_ms)
+        else:
+            hlp.to_csv(snap_balances, snapshots_balances_file, index=False, date_format="%Y-%m-%d")
+
+        # save position file, case there are positions
+        if not snap_pos_new.empty:
+            snap_positions = pd.concat([snap_positions, snap_pos_new], ignore_index=True)
+            snap_positions["UTCTime"] = pd.to_datetime(snap_positions["updateTime"], unit="ms", utc=True)
+            snap_positions['UTCTime'] = pd.to_datetime(snap_positions['UTCTime'], format="%Y-%m-%d", utc=True, infer_datetime_format=True).dt.date
+            snap_positions['UTCTime'] = pd.to_datetime(snap_positions['UTCTime'], format="%Y-%m-%d", utc=True, infer_datetime_format=True)
+            snap_positions["account"] = account_name
+            snap_positions["type"] = account_type
+            snap_positions.drop_duplicates(
+                    subset=["UTCTime", "symbol", "account", "type"], keep="last", inplace=True
                     )
-                if not kline.empty:
-                    snap_balance["USDT price"].loc[snap_balance["USDT symbol"] == symbol] = float(kline[4][0])
-                else:
-                    snap_balance["USDT price"].loc[snap_balance["USDT symbol"] == symbol] = 0
-            snap_balance.drop("USDT symbol", inplace=True, axis=1)
-            snap_balance["USDT price"].loc[snap_balance.asset == "USDT"] = 1
-            logging.debug("calculate additional values for the balance overview")
-            snap_balance["Free Coin Value"] = snap_balance["free"] * snap_balance["USDT price"]
-            snap_balance["Locked Coin Value"] = snap_balance["locked"] * snap_balance["USDT price"]
-            snap_balance["Asset value"] = (
-                snap_balance["Free Coin Value"] + snap_balance["Locked Coin Value"]
-            )
-            snap_balance.sort_values(by=["asset"], inplace=True)
-            snap_balance['updateTime'] = updatetime_ms
-            if snap_balance.loc[snap_balance["asset"] == "USDT"].empty:
-                free_coin_value = 0
+            if db is not None:
+                _snapshot_to_warehouse(db, 'snapshot_daily_positions', snap_positions, updatetime_ms)
             else:
-                free_coin_value = snap_balance["Free Coin Value"].loc[snap_balance["asset"] == "USDT"].iloc[0]
-            portval = {
-                "asset": "PortVal",
-                "Free Coin Value": snap_balance["Free Coin Value"].sum()- free_coin_value,
-                "Locked Coin Value": snap_balance["Locked Coin Value"].sum(),
-                "Asset value": snap_balance["Asset value"].sum(),
-                "updateTime" : updatetime_ms
-            }
-            portval = pd.DataFrame(portval, index=[0])
-            snap_balance = pd.concat([snap_balance, portval], ignore_index=True)
-
-            #
-            # write daily asset information into snapshot assets file
-            # writing is done for every single snapshot to mitigate API timeouts without loosing the already downloaded snapshots
-            # several date formatting actions to ensure
-            # - UTCTime does not contain hh:mm:ss (for better handling in excel)
-            # - no duplicates
-            #
-            snap_assets = pd.concat([snap_assets, snap_balance], ignore_index=True)
-            snap_assets["UTCTime"] = pd.to_datetime(snap_assets['updateTime'], unit="ms", utc=True)
-            snap_assets['UTCTime'] = pd.to_datetime(snap_assets['UTCTime'], format="%Y-%m-%d", utc=True, infer_datetime_format=True).dt.date
-            snap_assets['UTCTime'] = pd.to_datetime(snap_assets['UTCTime'], format="%Y-%m-%d", utc=True, infer_datetime_format=True)
-            snap_assets["account"] = account_name
-            snap_assets["type"] = account_type
-            snap_assets.drop_duplicates(
-                    subset=["UTCTime", "asset", "account", "type"], keep="last", inplace=True
-                    )
-            snap_assets.to_csv(snapshots_assets_file, index=False, date_format="%Y-%m-%d")
-
-            # writing daily balances
-            snap_balances = pd.concat([snap_balances, portval], ignore_index=True)
-            snap_balances["UTCTime"] = pd.to_datetime(snap_balances["updateTime"], unit="ms", utc=True)
-            snap_balances['UTCTime'] = pd.to_datetime(snap_balances['UTCTime'], format="%Y-%m-%d", utc=True, infer_datetime_format=True).dt.date
-            snap_balances['UTCTime'] = pd.to_datetime(snap_balances['UTCTime'], format="%Y-%m-%d", utc=True, infer_datetime_format=True)
-            snap_balances["account"] = account_name
-            snap_balances["type"] = account_type
-            snap_balances.drop_duplicates(
-                    subset=["UTCTime", "asset", "account", "type"], keep="last", inplace=True
-                    )
-            snap_balances.sort_values(by=['UTCTime'], ascending=False, inplace=True)
-            snap_balances.to_csv(snapshots_balances_file, index=False, date_format="%Y-%m-%d")
+                hlp.to_csv(snap_positions, snapshots_positions_file, index=False, date_format="%Y-%m-%d")
 
-    if account_type == "FUTURES":
-        kline = pd.DataFrame()
+    logging.debug("writing snapshots to csv ...")
+    line = pipeline.Pipeline('snapshots')
+    if account_type == "SPOT":
+        line.stage('valuation', value_spot)
+        line.run(download(start_time_ms), write_spot)
 
+    if account_type == "FUTURES":
         # load prev. positions / balances and assets have been loaded already
-        if os.path.isfile(snapshots_positions_file):
-            snap_positions = pd.read_csv(snapshots_positions_file)
-
-        for snap in snaps["snapshotVos"]:
-            updatetime_ms = snap["updateTime"]
-            updatetime_utc = pd.to_datetime(snap["updateTime"], unit="ms", utc=True)
-
-            snap_assets_new = pd.DataFrame(snap["data"]["assets"])
-            snap_assets_new['USDT price'] = 0
-            for asset in snap_assets_new['asset']:
-                if asset == 'USDT':
-                    price = 1
-                else:
-                    logging.info(" . downloading historic prices for %s. API payload: %s",
-                        asset,
-                        str(hlp.API_weight_check(client)))
-                    kline = pd.DataFrame(
-                        client.get_historical_klines(
-                            asset + 'USDT',
-                            Client.KLINE_INTERVAL_1DAY,
-                            updatetime_ms,
-                            updatetime_ms + daily_ms,
-                        )
-                    )
-                    if not kline.empty:
-                        price = float(kline[4][0])
-                    else:
-                        price = 0
-                snap_assets_new["USDT price"].loc[snap_assets_new["asset"] == asset] = price
-                
-            # the order of following actions is important
-            # some actions might appear double work, but it ensures consistent quality
-            #
-            # work on and save assets file
-            snap_assets_new[["marginBalance", "walletBalance", "USDT price"]] = snap_assets_new[["marginBalance", "walletBalance", "USDT price"]].apply(pd.to_numeric)
-            snap_assets_new['Margin value'] = snap_assets_new['marginBalance'] * snap_assets_new['USDT price']
-            snap_assets_new['Wallet value'] = snap_assets_new['walletBalance'] * snap_assets_new['USDT price']
-            snap_assets_new['PnL'] = snap_assets_new['marginBalance'] - snap_assets_new['walletBalance']
-            snap_assets_new["Asset value"] = snap_assets_new['Margin value']
-            portval = {
-                "asset": "PortVal",
-                "Margin value": snap_assets_new["Margin value"].sum(),
-                "Wallet value": snap_assets_new["Wallet value"].sum(),
-                "PnL" : snap_assets_new["PnL"].sum(),
-                "Asset value": snap_assets_new["Margin value"].sum()}
-            portval = pd.DataFrame(portval, index=[0])
-            snap_assets_new = pd.concat([snap_assets_new, portval], ignore_index=True)
-            snap_assets_new["updateTime"] = updatetime_ms
-            snap_assets = pd.concat([snap_assets, snap_assets_new], ignore_index=True)
-            snap_assets["UTCTime"] = pd.to_datetime(snap_assets["updateTime"], unit="ms", utc=True)
-            snap_assets['UTCTime'] = pd.to_datetime(snap_assets['UTCTime'], format="%Y-%m-%d", utc=True, infer_datetime_format=True).dt.date
-            snap_assets['UTCTime'] = pd.to_datetime(snap_assets['UTCTime'], format="%Y-%m-%d", utc=True, infer_datetime_format=True)
-            snap_assets["account"] = account_name
-            snap_assets["type"] = account_type
-            snap_assets.drop_duplicates(
-                    subset=["UTCTime", "asset", "account", "type"], keep="last", inplace=True)
-            snap_assets.to_csv(snapshots_assets_file, index=False, date_format="%Y-%m-%d")
-
-            # work on and save balances file
-            snap_balances = snap_assets[snap_assets['asset'] == 'PortVal']
-            snap_balances.drop(['marginBalance', 'walletBalance', 'USDT price'], axis=1, inplace=True)
-            snap_balances.sort_values(by=['updateTime'], ascending=False, inplace=True)
-            snap_balances.to_csv(snapshots_balances_file, index=False, date_format="%Y-%m-%d")
-
-            # work on and save position file, case there are positions
-            snap_pos_new = pd.DataFrame(snap["data"]["position"])
-            if not snap_pos_new.empty:
-                snap_pos_new[["entryPrice", "markPrice", "positionAmt", "unRealizedProfit"]] = snap_pos_new[["entryPrice", "markPrice", "positionAmt", "unRealizedProfit"]].apply(pd.to_numeric)
-                snap_pos_new.drop(snap_pos_new[
-                        (snap_pos_new.entryPrice == 0)
-                        & (snap_pos_new.positionAmt == 0)
-                        & (snap_pos_new.unRealizedProfit == 0)
-                        ].index, inplace=True)
-                snap_pos_new['USDT price'] = snap_pos_new['markPrice']
-                snap_pos_new['entryValue'] = snap_pos_new['entryPrice'] * snap_pos_new['positionAmt']
-                snap_pos_new['markValue'] = snap_pos_new['markPrice'] * snap_pos_new['positionAmt']
-                snap_pos_new['ValueDiff'] = snap_pos_new['markValue'] - snap_pos_new['entryValue']
-                posval = {
-                    "symbol": "PosVal",
-                    "unRealizedProfit": snap_pos_new["unRealizedProfit"].sum(),
-                    "entryValue": snap_pos_new["entryValue"].sum(),
-                    "markValue": snap_pos_new["markValue"].sum(),
-                    "ValueDiff": snap_pos_new["ValueDiff"].sum()}
-                posval = pd.DataFrame(posval, index=[0])
-                snap_pos_new = pd.concat([snap_pos_new, posval], ignore_index=True)
-                snap_pos_new["updateTime"] = updatetime_ms
-                snap_positions = pd.concat([snap_positions, snap_pos_new], ignore_index=True)
-                snap_positions["UTCTime"] = pd.to_datetime(snap_positions["updateTime"], unit="ms", utc=True)
-                snap_positions['UTCTime'] = pd.to_datetime(snap_positions['UTCTime'], format="%Y-%m-%d", utc=True, infer_datetime_format=True).dt.date
-                snap_positions['UTCTime'] = pd.to_datetime(snap_positions['UTCTime'], format="%Y-%m-%d", utc=True, infer_datetime_format=True)
-                snap_positions["account"] = account_name
-                snap_positions["type"] = account_type
-                snap_positions.drop_duplicates(
-                        subset=["UTCTime", "symbol", "account", "type"], keep="last", inplace=True
-                        )
-                snap_positions.to_csv(snapshots_positions_file, index=False, date_format="%Y-%m-%d")
+        if db is None and os.path.isfile(snapshots_positions_file):
+            snap_positions = hlp.read_csv(snapshots_positions_file)
+        line.stage('valuation', value_futures)
+        line.run(download(start_time_ms), write_futures)
         
     logging.info(" - Finished writing daily snapshots for account: %s -", account_name)
 
 
+def _snapshot_to_warehouse(db, table, data, updatetime_ms):
+    """upsert the records of one snapshot day into the warehouse
+
+    UTCTime is written in the same format as in the csv files (without hh:mm:ss)
+    """
+    data = data[data['updateTime'] == updatetime_ms].copy()
+    data['UTCTime'] = data['UTCTime'].dt.strftime('%Y-%m-%d')
+    wh.upsert(db, table, data)
+
+
+futures_start_ms = 1567900800000    # 8.Sept 2019; start of the USDT-M futures
+futures_income_window_ms = 604800000    # 7 days; max. time range of one income request
+futures_page = 1000                 # max. records per request of trades, orders and income
+_futures_clients = threading.local()
+
+
+def _futures_client(PUBLIC, SECRET):
+    """one API client per worker thread and API key (clients keep the last response for the weight budget)"""
+    if not hasattr(_futures_clients, 'clients'):
+        _futures_clients.clients = {}
+    if PUBLIC not in _futures_clients.clients:
+        _futures_clients.clients[PUBLIC] = hlp.get_client(PUBLIC, SECRET, cached=False)
+    return _futures_clients.clients[PUBLIC]
+
+
+def _futures_symbols(client, budget, account_name, symbols_file, known_symbols):
+    """symbols of a futures account with positions or income (realized PnL, fees, funding) since the last scan
+
+    the symbols found and the end of the scanned time range are kept in symbols_file,
+    so every run only scans the income since the previous run
+
+    :returns: sorted list of symbols
+    """
+    state = {'scanned_until': futures_start_ms, 'symbols': []}
+    if os.path.isfile(symbols_file):
+        with open(symbols_file) as file:
+            state = json.load(file)
+    symbols = set(state['symbols']) | set(known_symbols)
+
+    budget.acquire(hlp.endpoint_weights[('fapi', 'account')])
+    account = client.futures_account()
+    budget.update(client)
+    symbols.update(position['symbol'] for position in account['positions'] if float(position['positionAmt']) != 0)
+
+    now_ms = int(time.time() * 1000)
+    window_start = state['scanned_until']
+    while window_start < now_ms:
+        window_end = min(window_start + futures_income_window_ms, now_ms)
+        start_time = window_start
+        with tracing.span(str(pd.to_datetime(window_start, unit="ms").date()), 'window'):
+            while True:
+                budget.acquire(hlp.endpoint_weights[('fapi', 'income')])
+                income = client.futures_income_history(startTime=start_time, endTime=window_end, limit=futures_page)
+                budget.update(client)
+                symbols.update(record['symbol'] for record in income if record.get('symbol'))
+                if len(income) < futures_page:
+                    break
+                start_time = income[-1]['time'] + 1
+        window_start = window_end + 1
+
+    state = {'scanned_until': now_ms, 'symbols': sorted(symbols)}
+    with open(symbols_file, 'w') as file:
+        json.dump(state, file)
+    logging.info(" . %s futures symbols with positions or income", str(len(symbols)))
+    return state['symbols']
+
+
+def _futures_history(PUBLIC, SECRET, budget, kind, symbol, last_id):
+    """all trades / orders of a futures symbol after the last recorded id"""
+    client = _futures_client(PUBLIC, SECRET)
+    rows = []
+    from_id = 0 if last_id is None else int(last_id) + 1
+    with tracing.span(symbol, 'symbol'):
+        while True:
+            budget.acquire(hlp.endpoint_weights[('fapi', 'userTrades' if kind == 'trades' else 'allOrders')])
+            if kind == 'trades':
+                page = client.futures_account_trades(symbol=symbol, fromId=from_id, limit=futures_page)
+            else:
+                page = client.futures_get_all_orders(symbol=symbol, orderId=from_id, limit=futures_page)
+            budget.update(client)
+            rows.extend(page)
+            if len(page) < futures_page:
+                return rows
+            from_id = page[-1]['id' if kind == 'trades' else 'orderId'] + 1
+
+
+def _futures_download(kind, account_name, PUBLIC, SECRET, history_file, db=None, workers=4):
+    """download trades or orders of a futures account and write them in the layout of the SPOT download
+
+    **Procedure**
+        - last recorded id per symbol (csv file or warehouse)
+        - symbols with positions or income history (see _futures_symbols) and symbols already recorded
+        - new records of all symbols are downloaded at the same time (workers), within the weight budget
+          of the futures API (helper.WeightBudget)
+        - new records are added to the csv file (or upserted into the warehouse)
+
+    :param str kind: required; 'trades' or 'orders'
+    """
+    id_column = 'id' if kind == 'trades' else 'orderId'
+    history = pd.DataFrame()
+    if db is not None:
+        last_ids = wh.watermarks(db, kind, id_column, 'symbol', account=account_name)
+    elif os.path.isfile(history_file):
+        history = hlp.read_csv(history_file)
+        last_ids = history.groupby('symbol', as_index=False)[id_column].max() if not history.empty else pd.DataFrame()
+    else:
+        last_ids = pd.DataFrame()
+    last_ids = dict(zip(last_ids['symbol'], last_ids[id_column])) if not last_ids.empty else {}
+
+    client = hlp.get_client(PUBLIC, SECRET)
+    budget = hlp.WeightBudget('fapi')
+    symbols_file = os.path.dirname(os.path.abspath(history_file)) + '/futures_symbols_' + account_name + '.json'
+    symbols = _futures_symbols(client, budget, account_name, symbols_file, last_ids)
+
+    new_rows = []
+    failed_pairs = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(_futures_history, PUBLIC, SECRET, budget, kind, symbol, last_ids.get(symbol)): symbol
+            for symbol in symbols}
+        for future in concurrent.futures.as_completed(futures):
+            symbol = futures[future]
+            try:
+                new_rows.extend(future.result())
+            except Exception as e:
+                # failed requests have been retried already (see resilience); the next run tries this symbol again
+                logging.warning("%s of %s could not be downloaded: %s", kind, symbol, str(e))
+                metrics.count('download_failures_total', 1, 'windows / trading pairs, which could not be downloaded')
+                failed_pairs.append(symbol)
+    if failed_pairs:
+        logging.warning("%s of %s futures symbols could not be downloaded: %s",
+            kind, str(len(failed_pairs)), ', '.join(sorted(failed_pairs)))
+
+    metrics.record_rows('downloaded', len(new_rows))
+    hlp.API_close_connection(client)
+
+    if len(new_rows) == 0:
+        logging.info(" - Finished writing 0 %s for account %s -", kind, account_name)
+        return
+    new_rows = pd.DataFrame(new_rows)
+    if db is not None:
+        new_rows["UTCTime"] = pd.to_datetime(new_rows["time"], unit="ms", utc=True)
+        new_rows['account'] = account_name
+        wh.upsert(db, kind, new_rows)
+    else:
+        history = pd.concat([history, new_rows], ignore_index=True)
+        history = history.drop_duplicates(subset=['symbol', id_column], keep='last')
+        history["UTCTime"] = pd.to_datetime(history["time"], unit="ms", utc=True)
+        history.sort_values(by=["time"], inplace=True, ascending=False)
+        hlp.to_csv(history, history_file, index=False)
+    logging.info(" - Finished writing %s %s for account %s -", str(len(new_rows)), kind, account_name)
+
+
+@metrics.timed
+@tracing.traced
 def trades(
-    account_name, account_type, PUBLIC, SECRET, list_of_trading_pairs, trades_file
+    account_name, account_type, PUBLIC, SECRET, list_of_trading_pairs, trades_file, db = None, workers = 4
     ):
     """get trades and write them to csv file
 
     **Procedure:**
         - check if account is SPOT or FUTURES (there are different data models behind these two)
+        - FUTURES: trades of all symbols with positions or income history are downloaded at the same time
+          (see _futures_download); the list of trading pairs is not needed
         - verify if file already exists and determine last recorded trade
         - loop through provided trading pairs and download historic trades if available
         - save the downloaded trades to csv file
@@ -548,20 +759,23 @@ def trades(
     :param SECRET: required; secret part of API key to open connection to exchange
     :param list list_of_trading_pairs: required; list of trading pairs for which trades should be downloaded; if list is empty, every trading pair is being checked (there are over 2k trading pairs, so this can take a while)
     :param str trades_file: required; name and location of the csv file to be filled with historic trades
+    :param object db: optional; warehouse connection; if provided, new trades are upserted into the warehouse instead of the csv file
+    :param int workers: optional; FUTURES only: amount of symbols downloaded at the same time
     
     :return: writes csv file with historic trades of the provided account
     :rtype: csv file
-
-    :TODO: include trades for FUTURES accounts as well 
     """
     if account_type == "FUTURES":
-        result = "Sorry, future accounts are not yet supported by this procedure."
-        return result
+        logging.info(" - Start downloading futures trades for account: %s -", account_name)
+        return _futures_download('trades', account_name, PUBLIC, SECRET, trades_file, db, workers)
             
     trades = pd.DataFrame()
     last_rec_trade_time = 0
-    if os.path.isfile(trades_file):
-        trades = pd.read_csv(trades_file)
+    if db is not None:
+        # last recorded trade per trading pair is enough to continue the download
+        trades = wh.watermarks(db, 'trades', 'time', 'symbol', account=account_name)
+    elif os.path.isfile(trades_file):
+        trades = hlp.read_csv(trades_file)
 
     new_trades = []
 
@@ -569,9 +783,10 @@ def trades(
     logging.debug("connecting to binance ...")
 
     # open connection to exchange
-    client = Client(api_key=PUBLIC, api_secret=SECRET)
+    client = hlp.get_client(PUBLIC, SECRET)
 
-    for trading_pair in list_of_trading_pairs:
+    failed_pairs = []
+    for trading_pair in tracing.iterate(list_of_trading_pairs, 'symbol'):
         logging.debug(
             "reading trades from Binance for Trading Pair %s ...", trading_pair)
         hlp.API_weight_check(client)
@@ -595,24 +810,44 @@ def trades(
             # only read further trades from binance if they are not recorded yet in the csv file
             while trade_time < last_trade_time:
                 # read new trades, which are not yet in the csv file
-                new_trades.extend(
-                    client.get_my_trades(symbol=trading_pair, startTime=trade_time)
-                )
+                page = client.get_my_trades(symbol=trading_pair, startTime=trade_time)
+                if len(page) == 0:
+                    break
+                new_trades.extend(page)
                 # read timestamp of last downloaded record from binance
-                trade_time = new_trades[-1]["time"]
+                trade_time = page[-1]["time"]
             logging.debug("  ... overall amount of not yet recorded trades read: %s",
                 str(len(new_trades)))
             logging.debug("  ... be gentle with the API and wait for 1sec")
             time.sleep(1)
         except Exception as e:
-            logging.warning("Exception occured: ", exc_info=True)
+            # failed requests have been retried already (see resilience); trades downloaded so far are kept,
+            # the next run continues after them
+            logging.warning("trades of %s could not be downloaded: %s", trading_pair, str(e))
+            metrics.count('download_failures_total', 1, 'windows / trading pairs, which could not be downloaded')
+            failed_pairs.append(trading_pair)
+            if isinstance(e, resilience.CircuitOpenError):
+                # the exchange is not available; no need to try the remaining pairs
+                failed_pairs.extend(list_of_trading_pairs[list_of_trading_pairs.index(trading_pair) + 1:])
+                break
             continue
 
+    if failed_pairs:
+        logging.warning("trades of %s trading pairs could not be downloaded: %s",
+            str(len(failed_pairs)), ', '.join(failed_pairs))
+
     logging.debug("Amount of new Trading Records to be written: %s", str(len(new_trades)))
+    metrics.record_rows('downloaded', len(new_trades))
     hlp.API_close_connection(client)
 
     # only write trades into csv file if there have been new trades found
-    if not len(new_trades) == 0:
+    if not len(new_trades) == 0 and db is not None:
+        new_trades = pd.DataFrame(new_trades)
+        new_trades["UTCTime"] = pd.to_datetime(new_trades["time"], unit="ms", utc=True)
+        new_trades['account'] = account_name
+        logging.debug("writing trades to warehouse ...")
+        wh.upsert(db, 'trades', new_trades)
+    elif not len(new_trades) == 0:
         # adding new trades to existing list of trades from csv
         new_trades = pd.DataFrame(new_trades)
         trades = pd.concat([trades, new_trades], ignore_index=True)
@@ -621,7 +856,7 @@ def trades(
         trades.sort_values(by=["time"], inplace=True, ascending=False)
 
         logging.debug("writing trades to csv ...")
-        trades.to_csv(trades_file, index=False)
+        hlp.to_csv(trades, trades_file, index=False)
 
     logging.info(
         " - Finished writing %s Trades for account %s -", 
@@ -629,13 +864,17 @@ def trades(
         account_name)
 
 
+@metrics.timed
+@tracing.traced
 def orders(
-    account_name, account_type, PUBLIC, SECRET, list_of_trading_pairs, orders_file
+    account_name, account_type, PUBLIC, SECRET, list_of_trading_pairs, orders_file, db = None, workers = 4
     ):
     """get orders and write them to csv file
 
     **Procedure:**
         - check if account is SPOT or FUTURES (there are different data models behind these two)
+        - FUTURES: orders of all symbols with positions or income history are downloaded at the same time
+          (see _futures_download); the list of trading pairs is not needed
         - verify if file already exists and determine last recorded order
         - loop through provided trading pairs and download historic orders if available
         - save the downloaded orders to csv file
@@ -647,20 +886,19 @@ def orders(
     :param SECRET: required; secret part of API key to open connection to exchange
     :param list list_of_trading_pairs: required; list of trading pairs for which orders should be downloaded; if list is empty, every trading pair is being checked (there are over 2k trading pairs, so this can take a while)
     :param str orders_file: required; name and location of the csv file to be filled with historic orders
+    :param object db: optional; warehouse connection; if provided, new orders are upserted into the warehouse instead of the csv file
+    :param int workers: optional; FUTURES only: amount of symbols downloaded at the same time
     
     :return: writes csv file with historic orders of the provided account
     :rtype: csv file
-
-    :TODO: include orders for FUTURES accounts as well 
     """
     logging.info(" - Start downloading orders for account: %s -", account_name)
     logging.debug("connecting to binance ...")
 
     if account_type == "FUTURES":
-        result = "Sorry, future accounts are not yet supported by this procedure."
-        return result
+        return _futures_download('orders', account_name, PUBLIC, SECRET, orders_file, db, workers)
         
-    client = Client(api_key=PUBLIC, api_secret=SECRET)
+    client = hlp.get_client(PUBLIC, SECRET)
 
     #
     # get orders and write them to csv file
@@ -669,11 +907,14 @@ def orders(
 
     orders = pd.DataFrame()
     last_rec_order_time = 0
-    if os.path.isfile(orders_file):
-        orders = pd.read_csv(orders_file)
+    if db is not None:
+        orders = wh.watermarks(db, 'orders', 'time', 'symbol', account=account_name)
+    elif os.path.isfile(orders_file):
+        orders = hlp.read_csv(orders_file)
 
     new_orders = []
-    for trading_pair in list_of_trading_pairs:
+    failed_pairs = []
+    for trading_pair in tracing.iterate(list_of_trading_pairs, 'symbol'):
         logging.debug("reading orders from Binance for Trading Pair %s ...", trading_pair)
         hlp.API_weight_check(client)
         # find out last recorded order for this trading pair
@@ -697,24 +938,43 @@ def orders(
             # only read further orders from binance if they are not recorded yet in the csv file
             while order_time < last_order_time:
                 # read new orders, which are not yet in the csv file
-                new_orders.extend(
-                    client.get_all_orders(symbol=trading_pair, startTime=order_time)
-                )
+                page = client.get_all_orders(symbol=trading_pair, startTime=order_time)
+                if len(page) == 0:
+                    break
+                new_orders.extend(page)
                 # read timestamp of last downloaded record from binance
-                order_time = new_orders[-1]["time"]
+                order_time = page[-1]["time"]
             logging.debug("  ... overall amount of not yet recorded orders: %s",
                 str(len(new_orders)))
             logging.debug("  ... be gentle with the API and wait for 1 sec")
             time.sleep(1)
         except Exception as e:
-            logging.warning("Exception occured: ", exc_info=True)
+            # failed requests have been retried already (see resilience); orders downloaded so far are kept
+            logging.warning("orders of %s could not be downloaded: %s", trading_pair, str(e))
+            metrics.count('download_failures_total', 1, 'windows / trading pairs, which could not be downloaded')
+            failed_pairs.append(trading_pair)
+            if isinstance(e, resilience.CircuitOpenError):
+                # the exchange is not available; no need to try the remaining pairs
+                failed_pairs.extend(list_of_trading_pairs[list_of_trading_pairs.index(trading_pair) + 1:])
+                break
             continue
 
+    if failed_pairs:
+        logging.warning("orders of %s trading pairs could not be downloaded: %s",
+            str(len(failed_pairs)), ', '.join(failed_pairs))
+
     logging.debug("Amount of new Order Records to be written: %s", str(len(new_orders)))
+    metrics.record_rows('downloaded', len(new_orders))
     hlp.API_close_connection(client)
 
     # only write orders into csv file if there have been new orders found
-    if not len(new_orders) == 0:
+    if not len(new_orders) == 0 and db is not None:
+        new_orders = pd.DataFrame(new_orders)
+        new_orders["UTCTime"] = pd.to_datetime(new_orders["time"], unit="ms", utc=True)
+        new_orders['account'] = account_name
+        logging.debug("writing orders to warehouse ...")
+        wh.upsert(db, 'orders', new_orders)
+    elif not len(new_orders) == 0:
         # adding new orders to existing list of orders from csv
         new_orders = pd.DataFrame(new_orders)
         orders = pd.concat([orders, new_orders], ignore_index=True)
@@ -723,14 +983,16 @@ def orders(
         orders.sort_values(by=["time"], inplace=True, ascending=False)
 
         logging.debug("writing orders to csv ...")
-        orders.to_csv(orders_file, index=False)
+        hlp.to_csv(orders, orders_file, index=False)
         logging.debug("Finished writing Orders!")
 
     logging.info(" - Finished writing %s orders for account %s -",
         str(len(new_orders)), account_name)
 
 
-def open_orders(account_name, account_type, PUBLIC, SECRET, open_orders_file):
+@metrics.timed
+@tracing.traced
+def open_orders(account_name, account_type, PUBLIC, SECRET, open_orders_file, db = None):
     """get open orders and write them to csv file
 
     **Procedure:**
@@ -744,24 +1006,23 @@ def open_orders(account_name, account_type, PUBLIC, SECRET, open_orders_file):
     :param str PUBLIC: required; public part of API key to open connection to exchange
     :param SECRET: required; secret part of API key to open connection to exchange
     :param str open_orders_file: required; name and location of the csv file to be filled with the open orders
+    :param object db: optional; warehouse connection; if provided, the open orders of the account are replaced in the warehouse
     
     :return: writes csv file with open orders of the provided account
     :rtype: csv file
-
-    :TODO: include open orders for FUTURES accounts as well
     """
     logging.info(" - Start downloading open orders for account: %s -", account_name)
     logging.debug("connecting to binance ...")
 
-    if account_type == "FUTURES":
-        result = "Sorry, future accounts are not yet supported by this procedure."
-        return result
-        
-    client = Client(api_key=PUBLIC, api_secret=SECRET)
+    client = hlp.get_client(PUBLIC, SECRET)
     hlp.API_weight_check(client)
 
     logging.debug("reading all open orders from Binance ...")
-    open_orders = pd.DataFrame(client.get_open_orders())
+    if account_type == "FUTURES":
+        open_orders = pd.DataFrame(client.futures_get_open_orders())
+    else:
+        open_orders = pd.DataFrame(client.get_open_orders())
+    metrics.record_rows('downloaded', len(open_orders))
     if not open_orders.empty:
         logging.debug("change timestamps in the open orders to a readable format ...")
         # add column with timestamp in a human readable format
@@ -769,12 +1030,19 @@ def open_orders(account_name, account_type, PUBLIC, SECRET, open_orders_file):
         # sorting open orders for time descending
 
     hlp.API_close_connection(client)
-    logging.debug("writing open orders to csv ...")
-    open_orders.to_csv(open_orders_file, index=False)
+    if db is not None:
+        logging.debug("writing open orders to warehouse ...")
+        open_orders['account'] = account_name
+        wh.replace(db, 'open_orders', open_orders, account=account_name)
+    else:
+        logging.debug("writing open orders to csv ...")
+        hlp.to_csv(open_orders, open_orders_file, index=False)
     logging.info(" - finished writing open orders to csv for account: %s -", account_name)
 
 
-def deposits(account_name, account_type, PUBLIC, SECRET, deposits_file):
+@metrics.timed
+@tracing.traced
+def deposits(account_name, account_type, PUBLIC, SECRET, deposits_file, db = None):
     """download account deposits from exchange and write them into a csv file
 
     Procedure:
@@ -793,10 +1061,11 @@ def deposits(account_name, account_type, PUBLIC, SECRET, deposits_file):
     :param str PUBLIC: required; public part of API key to open connection to exchange
     :param SECRET: required; secret part of API key to open connection to exchange
     :param str deposits_file: required; name and location of the csv file to be filled with the deposits
+    :param object db: optional; warehouse connection; if provided, new deposits are upserted into the warehouse instead of the csv file
 
     :return:
         - writes csv file with deposits of the binance account
-        - dataframe with all deposits
+        - dataframe with all deposits (only the new deposits in case of a warehouse)
 
     :TODO: add deposits for Futures Account
     """
@@ -808,7 +1077,6 @@ def deposits(account_name, account_type, PUBLIC, SECRET, deposits_file):
 
     # internal variables
     step_ms = 7776000000  # = 90 days; Binance does only allow to get deposit and withdraw data for 90 days timeframe
-    klines_step_ms = 86400000  # for downloading asset price at the time of deposit
     current_time_ms = int(time.time() * 1000)  # current time in milliseconds
 
     if account_type == "FUTURES":
@@ -817,62 +1085,46 @@ def deposits(account_name, account_type, PUBLIC, SECRET, deposits_file):
         
     deposits = pd.DataFrame()
     # fetch list of already downloaded deposits
-    if os.path.isfile(deposits_file):
-        deposits = pd.read_csv(deposits_file)
+    if db is not None:
+        last_deposit_ms = wh.watermark(db, 'deposits', 'insertTime', account=account_name)
+        if last_deposit_ms is not None:
+            start_time_ms = int(last_deposit_ms + 1)
+    elif os.path.isfile(deposits_file):
+        deposits = hlp.read_csv(deposits_file)
         if not deposits.empty:
             start_time_ms = int(deposits.insertTime.max() + 1)
 
     # fetch list of new deposits, if any
     logging.debug("connecting to binance ...")
 
-    client = Client(api_key=PUBLIC, api_secret=SECRET)
+    client = hlp.get_client(PUBLIC, SECRET)
     client.REQUEST_TIMEOUT = 10
 
     deposits_new = pd.DataFrame()
     while start_time_ms < current_time_ms:
         hlp.API_weight_check(client)
-        deposits_new = pd.concat([deposits_new, 
-            pd.DataFrame(
-                client.get_deposit_history(
-                    startTime=start_time_ms, endTime=start_time_ms + step_ms
-                )
-            )],
-            ignore_index=True,
-        )
+        with tracing.span(str(pd.to_datetime(start_time_ms, unit="ms").date()), 'window'):
+            deposits_new = pd.concat([deposits_new, 
+                pd.DataFrame(
+                    client.get_deposit_history(
+                        startTime=start_time_ms, endTime=start_time_ms + step_ms
+                    )
+                )],
+                ignore_index=True,
+            )
         start_time_ms = start_time_ms + step_ms + 1
 
+    metrics.record_rows('downloaded', len(deposits_new))
     # work with downloaded deposits, if any
     if not deposits_new.empty:
-        prices = pd.DataFrame(
-            client.get_all_tickers()
-        )  # get list of tickers and prices
-        prices["price"] = pd.to_numeric(prices["price"])
+        graph = valuation.graph(client)
         logging.debug(" ... add USDT prices to deposited assets")
-        deposits_new["USDT symbol"] = deposits_new["coin"] + "USDT"
         deposits_new[["USDT price", "Asset value"]] = 0
-        symbol_shortlist = prices[prices["symbol"].isin(deposits_new["coin"] + "USDT")]
-        deposits_shortlist = deposits_new[
-            deposits_new["USDT symbol"].isin(symbol_shortlist["symbol"])
-        ]
-        for ind in deposits_shortlist.index:
-            symbol = deposits_shortlist["USDT symbol"][ind]
-            updatetime_ms = deposits_shortlist["insertTime"][ind]
-            endtime_ms = updatetime_ms + klines_step_ms
-            logging.debug(
-                "downloading historic prices for %s. API payload: %s",
-                symbol, str(hlp.API_weight_check(client)))
-            kline = pd.DataFrame(
-                client.get_historical_klines(
-                    symbol, "1d", str(updatetime_ms), str(endtime_ms)
-                )
-            )
-            deposits_new["USDT price"].loc[
-                (deposits_new.insertTime == updatetime_ms)
-                & (deposits_new["USDT symbol"] == symbol)
-            ] = float(kline[4][0])
+        for updatetime_ms, coins in deposits_new.groupby("insertTime")["coin"]:
+            rates = graph.historical(client, coins.unique(), updatetime_ms)
+            deposits_new.loc[coins.index, "USDT price"] = coins.map(rates).fillna(0)
         hlp.API_close_connection(client)
 
-        deposits_new.drop(["USDT symbol"], inplace=True, axis=1)
         deposits = pd.concat([deposits, deposits_new], ignore_index=True)
         logging.debug("calculate additional values for the deposits overview")
         deposits["USDT price"].loc[deposits.coin == "USDT"] = 1
@@ -887,14 +1139,20 @@ def deposits(account_name, account_type, PUBLIC, SECRET, deposits_file):
         deposits['type'] = account_type
         deposits['transaction'] = 'DEPOSIT'
 
-        logging.debug("writing deposits to csv ...")
-        deposits.to_csv(deposits_file, index=False)
+        if db is not None:
+            logging.debug("writing deposits to warehouse ...")
+            wh.upsert(db, 'deposits', deposits)
+        else:
+            logging.debug("writing deposits to csv ...")
+            hlp.to_csv(deposits, deposits_file, index=False)
 
     logging.info(" - Finished writing deposits for account: %s -", account_name)
     return deposits
 
 
-def withdrawals(account_name, account_type, PUBLIC, SECRET, withdrawals_file):
+@metrics.timed
+@tracing.traced
+def withdrawals(account_name, account_type, PUBLIC, SECRET, withdrawals_file, db = None):
     """download account withdrawals from exchange and write them into a csv file
 
     Procedure:
@@ -913,10 +1171,11 @@ def withdrawals(account_name, account_type, PUBLIC, SECRET, withdrawals_file):
     :param str PUBLIC: required; public part of API key to open connection to exchange
     :param SECRET: required; secret part of API key to open connection to exchange
     :param str withdrawals_file: required; name and location of the csv file to be filled with the withdrawals
+    :param object db: optional; warehouse connection; if provided, new withdrawals are upserted into the warehouse instead of the csv file
 
     :return:
         - writes csv file with withdrawals of the binance account
-        - dataframe with all withdrawals
+        - dataframe with all withdrawals (only the new withdrawals in case of a warehouse)
 
     :TODO: add withdrawals for Futures Account
     """
@@ -927,7 +1186,6 @@ def withdrawals(account_name, account_type, PUBLIC, SECRET, withdrawals_file):
 
     # internal variables
     step_ms = 7776000000  # = 90 days; Binance does only allow to get deposit and withdraw data for 90 days timeframe
-    klines_step_ms = 86400000  # for downloading asset price at the time of deposit
     current_time_ms = int(time.time() * 1000)  # current time in milliseconds
 
     if account_type == "FUTURES":
@@ -936,68 +1194,52 @@ def withdrawals(account_name, account_type, PUBLIC, SECRET, withdrawals_file):
         
     transactions = pd.DataFrame()
     # fetch list of already downloaded transactions
-    if os.path.isfile(withdrawals_file):
-        transactions = pd.read_csv(withdrawals_file)
+    if db is not None:
+        last_withdrawal_ms = wh.watermark(db, 'withdrawals', 'insertTime', account=account_name)
+        if last_withdrawal_ms is not None:
+            start_time_ms = int(last_withdrawal_ms + 1)
+    elif os.path.isfile(withdrawals_file):
+        transactions = hlp.read_csv(withdrawals_file)
         if not transactions.empty:
             start_time_ms = int(transactions.insertTime.max() + 1)
 
     # fetch list of new transactions, if any
     logging.debug("connecting to binance ...")
 
-    client = Client(api_key=PUBLIC, api_secret=SECRET)
+    client = hlp.get_client(PUBLIC, SECRET)
     client.REQUEST_TIMEOUT = 10
 
     transactions_new = pd.DataFrame()
     while start_time_ms < current_time_ms:
         hlp.API_weight_check(client)
-        transactions_new = pd.concat([transactions_new, 
-            pd.DataFrame(
-                client.get_withdraw_history(
-                    startTime=start_time_ms, endTime=start_time_ms + step_ms
-                )
-            )],
-            ignore_index=True,
-        )
+        with tracing.span(str(pd.to_datetime(start_time_ms, unit="ms").date()), 'window'):
+            transactions_new = pd.concat([transactions_new, 
+                pd.DataFrame(
+                    client.get_withdraw_history(
+                        startTime=start_time_ms, endTime=start_time_ms + step_ms
+                    )
+                )],
+                ignore_index=True,
+            )
         start_time_ms = start_time_ms + step_ms + 1
 
+    metrics.record_rows('downloaded', len(transactions_new))
     # work with downloaded transactions, if any
     if not transactions_new.empty:
         # adding a column with 'insertTime', containing epoch time, to be
         # aligned with the deposit downloads and re-using the same logic
-        prices = pd.DataFrame(
-            client.get_all_tickers()
-        )  # get list of tickers and prices
-        prices["price"] = pd.to_numeric(prices["price"])
+        graph = valuation.graph(client)
         logging.debug("add USDT prices to deposited assets")
-        transactions_new["USDT symbol"] = transactions_new["coin"] + "USDT"
         transactions_new[["USDT price", "Asset value"]] = 0.00
         transactions_new["insertTime"] = pd.to_datetime(transactions_new["applyTime"], utc=True)
         transactions_new["insertTime"] = (
             transactions_new["insertTime"].astype("int64") // 1e9 * 1000
         )
-        symbol_shortlist = prices[
-            prices["symbol"].isin(transactions_new["coin"] + "USDT")
-        ]
-        transactions_shortlist = transactions_new[
-            transactions_new["USDT symbol"].isin(symbol_shortlist["symbol"])
-        ]
-        for ind in transactions_shortlist.index:
-            symbol = transactions_shortlist["USDT symbol"][ind]
-            updatetime_ms = int(transactions_shortlist["insertTime"][ind])
-            endtime_ms = updatetime_ms + klines_step_ms
-            logging.debug(
-                "downloading historic prices for %s. API payload: %s",
-                symbol, str(hlp.API_weight_check(client)))
-            kline = pd.DataFrame(
-                client.get_historical_klines(
-                    symbol, "1d", str(updatetime_ms), str(endtime_ms)
-                )
-            )
-            transactions_new["USDT price"][ind] = float(kline[4][0])
-            # transactions_new['USDT price'].loc[(transactions_new.insertTime == updatetime_ms) & (transactions_new['USDT symbol'] == symbol)] = float(kline[4][0])
+        for updatetime_ms, coins in transactions_new.groupby("insertTime")["coin"]:
+            rates = graph.historical(client, coins.unique(), int(updatetime_ms))
+            transactions_new.loc[coins.index, "USDT price"] = coins.map(rates).fillna(0)
         hlp.API_close_connection(client)
 
-        transactions_new.drop(["USDT symbol"], inplace=True, axis=1)
         transactions = pd.concat([transactions, transactions_new], ignore_index=True)
         logging.debug("calculate additional values for the transactions overview")
         # difference between deposits and withdrawals:
@@ -1021,14 +1263,20 @@ def withdrawals(account_name, account_type, PUBLIC, SECRET, withdrawals_file):
         transactions['account'] = account_name
         transactions['type'] = account_type
         transactions['transaction'] = 'WITHDRAWAL'
-        logging.debug("writing transactions to csv ...")
-        transactions.to_csv(withdrawals_file, index=False)
+        if db is not None:
+            logging.debug("writing transactions to warehouse ...")
+            wh.upsert(db, 'withdrawals', transactions)
+        else:
+            logging.debug("writing transactions to csv ...")
+            hlp.to_csv(transactions, withdrawals_file, index=False)
 
     logging.info(" - Finished writing withdrawals for account %s -", account_name)
     return transactions
 
 
-def prices(prices_file):
+@metrics.timed
+@tracing.traced
+def prices(prices_file, db = None):
     """read prices for all trading pairs and write them to prices.csv file
 
     Procedure:
@@ -1036,124 +1284,324 @@ def prices(prices_file):
         - save the downloaded prices to csv file
 
     :param str prices_file: required; name and location of the csv file to be filled with the prices
+    :param object db: optional; warehouse connection; if provided, the prices are replaced in the warehouse instead of the csv file
 
     :return: writes csv file with prices of all trading pairs on the exchange
     """
     logging.info(" - Start downloading prices for all trading pairs from exchange -")
     logging.debug("connecting to binance ...")
 
-    client = Client()
+    client = hlp.get_client()
 
     logging.debug("reading all prices from Binance ...")
-    prices = pd.DataFrame(client.get_all_tickers())
-    logging.debug("writing prices to csv ...")
-    prices.to_csv(prices_file, index=False)
+    prices = pd.DataFrame(hlp.get_all_tickers(client))
+    if db is not None:
+        logging.debug("writing prices to warehouse ...")
+        wh.replace(db, 'prices', prices)
+    else:
+        logging.debug("writing prices to csv ...")
+        hlp.to_csv(prices, prices_file, index=False)
     logging.info(" - Finished writing Prices to csv! -")
 
 
-def klines(dir, symbols, intervals, indicators, indicators_config):
+kline_columns = ['open time', 'open', 'high', 'low', 'close', 'volume', 'open time ux']
+kline_page = 1000       # max. klines per request
+
+
+def _download_klines(client, pair, interval, start_ms):
+    """download the klines of a pair since start_ms, page by page
+
+    the pages are parsed straight into a numpy array (see decoding); no earliest-timestamp request upfront
+    (the exchange starts with the first candle of the pair anyway) and no sleep between the pages
+    (the weight is checked instead)
+
+    :returns: numpy array with one line per candle: open time (ms), open, high, low, close, volume
+    """
+    import numpy as np
+
+    pages = []
+    while True:
+        page = decoding.get_klines(client, symbol=pair, interval=interval, startTime=int(start_ms), limit=kline_page)
+        pages.append(page)
+        if len(page) < kline_page:
+            break
+        start_ms = int(page[-1, 0]) + 1
+        hlp.API_weight_check(client)
+    return np.concatenate(pages)
+
+
+def _kline_watermark(history_file):
+    """open time (ms) of the last complete candle of a kline file + 1
+
+    the last candle of a file might have been incomplete; it is downloaded again and replaced.
+    Only the end of the file is read.
+
+    :returns: open time in ms; None if the file has less than two candles
+    """
+    with open(history_file, 'rb') as file:
+        file.seek(0, os.SEEK_END)
+        position = file.tell()
+        block = b''
+        lines = []
+        while position > 0 and len(lines) < 4:
+            size = min(4096, position)
+            position -= size
+            file.seek(position)
+            block = file.read(size) + block
+            lines = [line for line in block.splitlines() if line.strip()]
+    lines = lines[1:] if position == 0 else lines     # header
+    if len(lines) < 2:
+        return None
+    return int(float(lines[-2].decode().split(',')[6])) + 1
+
+
+def _add_indicators(klines, indicators, indicators_config):
+    """add technical indicators (finta) to klines
+
+    :param list indicators: required; names of finta indicators, e.g. ['RSI', 'EMA']
+    :param dict indicators_config: required; parameters per indicator, e.g. {'RSI': {'period': 14}};
+        a list of periods adds one column per period, e.g. {'EMA': {'period': [50, 100, 200]}} => EMA50, EMA100, EMA200
+    """
+    from finta import TA        # for technical indicators; only needed for klines
+
+    for indicator in indicators:
+        parameters = dict((indicators_config or {}).get(indicator) or {})
+        periods = parameters.pop('period', None)
+        if isinstance(periods, list):
+            for period in periods:
+                klines[indicator + str(period)] = getattr(TA, indicator)(klines, period=period, **parameters)
+            continue
+        if periods is not None:
+            parameters['period'] = periods
+        values = getattr(TA, indicator)(klines, **parameters)
+        if isinstance(values, pd.DataFrame):
+            # e.g. MACD: one column per line of the indicator
+            for column in values.columns:
+                klines[indicator + ' ' + str(column)] = values[column]
+        else:
+            klines[indicator] = values
+    return klines
+
+
+def _process_klines(task):
+    """CPU-bound part of the kline download of one pair; runs in a worker process (see klines)
+
+    **Procedure**
+        - read the downloaded klines out of the handoff file (numpy; written by the download stage)
+        - convert, add to the existing klines of the pair (csv file or warehouse), sort
+        - add technical indicators
+        - csv: write the kline file of the pair
+        - warehouse: write the new klines into a handoff file; they are upserted by the main process
+          (one writer for the database)
+
+    :param dict task: required; pair, interval, raw_file, history_file, k_time, indicators, indicators_config, db_file
+
+    :returns: dict with pair, interval and the amount of rows and bytes; for the warehouse: handoff file and columns
+    """
+    import numpy as np
+
+    result = {'pair': task['pair'], 'interval': task['interval'], 'bytes_read': 0, 'bytes_written': 0}
+    kline_new = pd.DataFrame(np.load(task['raw_file']), columns=kline_columns[:6])
+    kline_new['open time ux'] = kline_new['open time'].astype('int64')
+
+    klines = pd.DataFrame()
+    if task['db_file'] is not None:
+        if task['indicators']:
+            # history is needed for the indicators only; read-only connection of this process
+            import sqlite3
+            con = sqlite3.connect('file:' + task['db_file'] + '?mode=ro', uri=True)
+            klines = wh.read(con, 'klines', kline_columns, interval=task['interval'], pair=task['pair'])
+            con.close()
+            if not klines.empty:
+                klines = klines[klines['open time ux'] < task['k_time']]
+    elif os.path.isfile(task['history_file']):
+        result['bytes_read'] = os.path.getsize(task['history_file'])
+        klines = pd.read_csv(task['history_file'], usecols=range(7))
+        # last candle might have been incomplete; it is downloaded again (see _kline_watermark)
+        klines = klines.iloc[:-1]
+
+    klines = pd.concat([klines, kline_new], ignore_index=True)
+    klines['open time'] = pd.to_datetime(klines['open time ux'], unit='ms')
+    klines.sort_values(by=['open time ux'], inplace=True)
+    klines = _add_indicators(klines, task['indicators'], task['indicators_config'])
+
+    if task['db_file'] is not None:
+        klines_new = klines[klines['open time ux'] >= task['k_time']]
+        columns = [column for column in klines_new.columns if column != 'open time']
+        result['handoff_file'] = task['raw_file'][:-4] + '_new.npy'
+        result['columns'] = columns
+        np.save(result['handoff_file'], klines_new[columns].to_numpy(dtype=np.float64))
+        result['rows'] = len(klines_new)
+    else:
+        klines.to_csv(task['history_file'], index=False)
+        result['bytes_written'] = os.path.getsize(task['history_file'])
+        result['rows'] = len(klines)
+    return result
+
+
+def _finish_klines(result, db=None):
+    """main process: record metrics of a processed pair and upsert its new klines into the warehouse"""
+    import numpy as np
+
+    metrics.count('csv_bytes_read', result['bytes_read'], 'bytes of csv files read')
+    if db is not None:
+        klines_new = pd.DataFrame(np.load(result['handoff_file']), columns=result['columns'])
+        klines_new['open time ux'] = klines_new['open time ux'].astype('int64')
+        klines_new.insert(0, 'open time', pd.to_datetime(klines_new['open time ux'], unit='ms'))
+        klines_new['interval'] = result['interval']
+        klines_new['pair'] = result['pair']
+        wh.upsert(db, 'klines', klines_new)
+    else:
+        metrics.record_rows('written', result['rows'])
+        metrics.count('csv_bytes_written', result['bytes_written'], 'bytes of csv files written')
+    logging.info("--- FINISHED --- %s --- %s --- %s rows ---", result['pair'], result['interval'], str(result['rows']))
+
+
+@metrics.timed
+@tracing.traced
+def klines(dir, symbols, intervals, indicators = None, indicators_config = None, db = None, workers = 0):
     """ downloading historic ohlc data from exchange
 
     **Procedure:**
         - verify if kline data has been downloaded already previously
-        - if so, determine the timestamp of the last read kline
+        - if so, determine the timestamp of the last read kline (only the end of the file is read)
         - check if new klines are available on the exchange
-        - if so, add these to the existing klines if available
-        - write ohlc data into a file per pair and kline interval
+        - download stage (network; own thread): new klines of every pair are parsed straight into a numpy array
+          (see decoding) and written into a handoff file
+        - processing stage (CPU): conversion, sorting and indicators run in worker processes,
+          one pair per process, while the next pairs are downloaded (see _process_klines)
+        - write stage (this thread): metrics and warehouse upserts of the processed pairs (see _finish_klines)
+        - the stages are connected by bounded queues (see pipeline); a slow stage holds back the download
         - create new file for all data from 1d kline interval for use in excel
 
     :param str dir: required; name and location of the directory where the date should be written to
     :param list symbols: required. list of trading pairs for which the klines should be downloaded for
     :param list intervals: required; list of intervals (e.g. 1m, 5m, 1d) for which the klines should be downloaded for
-    :param str indicators: optional; indicators, which should be added to the csv file
-    :param str indicators_config: optional; parameters for the indicators, if required
+    :param list indicators: optional; finta indicators, which should be added to the csv file, e.g. ['RSI', 'EMA']
+    :param dict indicators_config: optional; parameters for the indicators, e.g. {'EMA': {'period': [50, 200]}}
+    :param object db: optional; warehouse connection; if provided, klines are upserted into the warehouse table 'klines' instead of csv files
+    :param int workers: optional; worker processes for the processing stage (0 = one per CPU core; 1 = no worker processes)
     
     :return: writes csv files with downloaded klines and technical indicators (one file for each provided symbol)
     :rtype: csv file
 
     This data can be used for backtesting (currently done in excel)
 
-    .. note:: Indicators are not yet implemented
-
     Further information: description of headers for klines is documented here: https://python-binance.readthedocs.io/en/latest/binance.html?highlight=get_historical_klines_generator#module-binance.client
 
     :TODO: klines: avoid downloading klines for pairs which dont provide up-to-date data anymore (e.g. last entry is longer ago than 10 times the selected timeframe)
     :TODO: klines: cleanup files, which dont have up-to-date data anymore
-    :TODO: adding technical indicators after downloading klines according to config file
     """
-    # internal variables
-    klines = pd.DataFrame()
+    import shutil
+    import tempfile
+    import numpy as np
 
     logging.info("--- Start --- binance kline downloading ---")
 
     logging.debug('---- connecting to binance ...')
 
     # create the binance Client; no need for api key
-    client = Client("", "", {"timeout": 30})
-
-    logging.info('---- downloading klines of %s Trading pairs ...', str(len(symbols)))
-
-    for interval in intervals:
-        paircount = 0
-        klines_file = dir + '/' + interval + '/' + 'history_' + interval + '_klines'
-        if not os.path.exists(dir + '/' + interval):
-            os.makedirs(dir + '/' + interval)
-        for pair in symbols:
-            paircount = paircount + 1
-            logging.info("---- START --- %s --- %s --- %s / %s ---", str(pair), interval, str(paircount), str(len(symbols)))
-            logging.debug('  ... verify previous downloads of historic data ...')
-            history_file_pair = klines_file + '_' + str(pair) +'.csv'
-            k_time = 0
-            if os.path.isfile(history_file_pair):
-                logging.debug('  ... previous downloads found! Reading ...')
-                klines = pd.read_csv(history_file_pair, header=0, skip_blank_lines=True, usecols=[0,1,2,3,4,5,6], skipfooter=1, engine='python')
-                logging.debug('  ... ' + str(len(klines)) + ' Records found')
-                if klines.empty: continue
-                k_time = klines.iloc[-1, 6] + 1 #time of last entry
-            else:
-                logging.debug('  ... no previous downloads found!')
-            k = pd.to_datetime(k_time, unit='ms') # datetime.utcfromtimestamp(k_time/1000).strftime('%d-%m-%y %H:%M:%S')
-            logging.debug("  ... Time of last record: %s", str(k))
-            logging.debug('  ... Checking for new records ...')
-            kline_new = pd.DataFrame(client.get_historical_klines_generator(pair, interval, int(k_time)))
-            if len(kline_new) < 2:
-                logging.debug('  ... No new records available ...')
-                continue
-            logging.debug('  ... %s new Records found', str(len(kline_new)))
-            kline_new = kline_new.drop([6,7,8,9,10,11], axis = 1)
-            kline_new = kline_new.apply(pd.to_numeric)
-            kline_new.columns = ['open time', 'open', 'high', 'low', 'close', 'volume']
-            kline_new['open time ux'] = kline_new['open time']
-
-            logging.debug('  ... adding new klines to existing klines (if available)')
-            klines = pd.concat([klines, kline_new], ignore_index=True)
-            klines['open time'] = pd.to_datetime(klines['open time ux'], unit='ms')
-            klines.sort_values(by=['open time ux'], inplace=True)
-
-            
-            if os.environ.get('USERNAME') == 'Jan':
-                logging.debug('  ... adding technical indicators')
-                #for indicator in indicators:
-                #    if period is list:
-                #        for period in klines_config[]
-                #    else:
-                #        klines[indicator + klines_config[indicator][period]] = TA.indicator(klines_config[indicator][period])
-                klines['RSI'] = TA.RSI(klines, 14)
-                klines['WilliamsR'] = TA.WILLIAMS(klines, 14)
-                klines['WRSI'] = klines['RSI'] + klines['WilliamsR']
-                #klines['EMA50'] = TA.EMA(klines, period=50)
-                #klines['EMA100'] = TA.EMA(klines, period=100)
-                #klines['EMA200'] = TA.EMA(klines, period=200)
-                #klines['DEMA50'] = TA.DEMA(klines, period=50)
-                #klines['DEMA100'] = TA.DEMA(klines, period=100)
-                #klines['DEMA200'] = TA.DEMA(klines, period=200)
-
-            logging.debug("  ... writing new records for " + str(pair))
-            klines.to_csv(history_file_pair, index=False)
-            logging.debug("  ... check API payload and wait for cool-off if necessary")
-            hlp.API_weight_check(client)
-            logging.info("--- FINISHED --- " + str(pair) + " --- " + interval + " --- " + str(paircount) + " / " + str(len(symbols)) + " ---")
-
-    hlp.merge_klines(dir + '/1d/', dir, 'history_1d_klines_all_Assets.csv')
+    client = hlp.get_client("", "", {"timeout": 30})
+
+    workers = workers or os.cpu_count() or 1
+    logging.info('---- downloading klines of %s Trading pairs (%s worker processes) ...', str(len(symbols)), str(workers))
+
+    db_file = None
+    if db is not None:
+        # worker processes open their own read-only connection
+        db_file = [row[2] for row in db.execute('PRAGMA database_list') if row[1] == 'main'][0]
+    if not os.path.exists(dir):
+        os.makedirs(dir)
+    handoff_dir = tempfile.mkdtemp(prefix='handoff_', dir=dir)
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+
+    # last recorded candles of all pairs; read here, as the connection can only be used by this thread
+    watermarks = {}
+    if db is not None:
+        for interval in intervals:
+            last = wh.watermarks(db, 'klines', 'open time ux', 'pair', interval=interval)
+            watermarks[interval] = dict(zip(last['pair'], last['open time ux']))
+
+    failed_pairs = []
+
+    def download():
+        """download stage (own thread): new klines of one pair after the other"""
+        for interval in tracing.iterate(intervals, 'interval'):
+            paircount = 0
+            klines_file = dir + '/' + interval + '/' + 'history_' + interval + '_klines'
+            if not os.path.exists(dir + '/' + interval):
+                os.makedirs(dir + '/' + interval)
+            for pair in tracing.iterate(symbols, 'symbol'):
+                paircount = paircount + 1
+                logging.info("---- START --- %s --- %s --- %s / %s ---", str(pair), interval, str(paircount), str(len(symbols)))
+                logging.debug('  ... verify previous downloads of historic data ...')
+                history_file_pair = klines_file + '_' + str(pair) +'.csv'
+                k_time = 0
+                if db is not None:
+                    # last candle might have been incomplete; it is downloaded again and replaced
+                    k_time = watermarks[interval].get(pair) or 0
+                elif os.path.isfile(history_file_pair):
+                    logging.debug('  ... previous downloads found! Reading ...')
+                    k_time = _kline_watermark(history_file_pair)
+                    if k_time is None: continue
+                else:
+                    logging.debug('  ... no previous downloads found!')
+                k = pd.to_datetime(k_time, unit='ms') # datetime.utcfromtimestamp(k_time/1000).strftime('%d-%m-%y %H:%M:%S')
+                logging.debug("  ... Time of last record: %s", str(k))
+                logging.debug('  ... Checking for new records ...')
+                try:
+                    kline_new = _download_klines(client, pair, interval, k_time)
+                except Exception as e:
+                    # failed requests have been retried already (see resilience); the next run tries this pair again
+                    logging.warning("klines of %s (%s) could not be downloaded: %s", pair, interval, str(e))
+                    metrics.count('download_failures_total', 1, 'windows / trading pairs, which could not be downloaded')
+                    failed_pairs.append(pair + ' ' + interval)
+                    if isinstance(e, resilience.CircuitOpenError):
+                        break
+                    continue
+                if len(kline_new) < 2:
+                    logging.debug('  ... No new records available ...')
+                    continue
+                logging.debug('  ... %s new Records found', str(len(kline_new)))
+                metrics.record_rows('downloaded', len(kline_new))
+
+                # handoff to the processing stage: open time and OHLCV as numpy file
+                raw_file = handoff_dir + '/' + interval + '_' + pair + '.npy'
+                np.save(raw_file, kline_new)
+                yield {
+                    'pair': pair, 'interval': interval, 'raw_file': raw_file, 'history_file': history_file_pair,
+                    'k_time': int(k_time), 'indicators': list(indicators or []),
+                    'indicators_config': indicators_config or {}, 'db_file': db_file}
+                logging.debug("  ... check API payload and wait for cool-off if necessary")
+                hlp.API_weight_check(client)
+
+    def process(task):
+        """processing stage: one thread per worker process, waiting for the result of its pair"""
+        try:
+            if executor is not None:
+                return executor.submit(_process_klines, task).result()
+            return _process_klines(task)
+        except Exception as e:
+            logging.warning("klines of %s could not be processed: %s", task['pair'] + ' ' + task['interval'], str(e))
+            failed_pairs.append(task['pair'] + ' ' + task['interval'])
+            return None
+
+    line = pipeline.Pipeline('klines')
+    line.stage('process', process, workers)
+    try:
+        # results are written by this thread (one writer for files and warehouse)
+        line.run(download(), lambda result: _finish_klines(result, db))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        shutil.rmtree(handoff_dir, ignore_errors=True)
+
+    if failed_pairs:
+        logging.warning("klines of %s trading pairs could not be downloaded: %s",
+            str(len(failed_pairs)), ', '.join(failed_pairs))
+
+    # warehouse table 'klines' holds all pairs already; merging is only needed for csv files
+    if db is None:
+        hlp.merge_klines(dir + '/1d/', dir, 'history_1d_klines_all_Assets.csv')
 
     logging.info("--- Finished --- binance kline downloading ---")
@@ -1,6 +1,8 @@
 """helper modules for binance-reporting library
 
 **Modules available**
+    - API client (re-used while caches are activated, e.g. in daemon mode)
+    - cached market data (tickers) and cached csv files; market data is shared between processes (see sharedcache)
     - API close connection
     - API weight check and cool down if overheated
     - removing blank lines in csv files
@@ -13,8 +15,63 @@ import os       # file & dir ops
 import time     # sleep for API cool-off
 import yaml     # read config file
 import logging
-from binance.client import Client       # read trading pairs from exchange
-import pandas as pd
+import threading
+try:
+    from binance_reporting import metrics
+    from binance_reporting import tracing
+    from binance_reporting import resilience
+    from binance_reporting import weightledger
+    from binance_reporting import sharedcache
+except:
+    import metrics
+    import tracing
+    import resilience
+    import weightledger
+    import sharedcache
+# pandas and python-binance are imported in the functions using them;
+# reading the config must not pull in these heavy packages (see start.py)
+
+# in-memory caches; only used after cache_activate() has been called (e.g. in daemon mode)
+cache_active = False
+market_data_ttl = 0     # seconds market data (e.g. tickers) are re-used
+_clients = {}           # API clients per API key
+_market_data = {}       # key => (timestamp, data)
+_files = {}             # filename => (mtime, size, dataframe)
+_catalog = {}           # 'catalog' => (timestamp, SymbolCatalog)
+catalog_ttl = 86400     # seconds the symbol catalog is re-used (listings change rarely)
+
+# base url of an exchange stand-in (e.g. binance_reporting.simulator); if empty, the real exchange is used
+api_url = os.environ.get('BINANCE_REPORTING_API_URL', '')
+_client_classes = {}    # api_url => client class
+# base url of the websocket streams of an exchange stand-in (see stream module)
+ws_url = os.environ.get('BINANCE_REPORTING_WS_URL', '')
+
+# length of kline intervals in milliseconds
+kline_intervals_ms = {
+    '1m': 60000, '3m': 180000, '5m': 300000, '15m': 900000, '30m': 1800000,
+    '1h': 3600000, '2h': 7200000, '4h': 14400000, '6h': 21600000, '8h': 28800000, '12h': 43200000,
+    '1d': 86400000, '3d': 259200000, '1w': 604800000, '1M': 2592000000}
+
+# request weight per endpoint (area, endpoint) as charged by the exchange; endpoints not listed have a weight of 1
+endpoint_weights = {
+    ('api', 'ticker/price'): 2,
+    ('api', 'ticker/24hr'): 40,
+    ('api', 'klines'): 1,
+    ('api', 'myTrades'): 10,
+    ('api', 'allOrders'): 10,
+    ('api', 'openOrders'): 40,
+    ('api', 'account'): 10,
+    ('api', 'exchangeInfo'): 10,
+    ('sapi', 'accountSnapshot'): 2400,
+    ('fapi', 'account'): 5,
+    ('fapi', 'userTrades'): 5,
+    ('fapi', 'allOrders'): 5,
+    ('fapi', 'openOrders'): 40,
+    ('fapi', 'income'): 30,
+}
+
+# max. weight per minute and area (api = spot, sapi = wallet / snapshots, fapi = futures)
+rate_limits = {'api': 1200, 'sapi': 12000, 'fapi': 2400}
 
 def read_config(args):
     """read config from a given file and convert it into a dictionary
@@ -42,7 +99,9 @@ def read_config(args):
             "withdrawals": False,
             "ticker": False,
             "prices": False,
-            "klines": False},
+            "klines": False,
+            "cost_basis": False,
+            "ledger": False},
         "accounts": {
             "Account1": {
             "dir": "dir1",
@@ -77,14 +136,71 @@ def read_config(args):
             "log_activate": True,
             "log_level": "INFO",
             "log_target": "console",
-            "log_file" : "binance_reporting.log"},
+            "log_file" : "binance_reporting.log",
+            "profile": False,
+            "trace_file": "binance_reporting_trace.json",
+            "cprofile": False,
+            "tracemalloc": 0},
         "klines": {
             "dir": "klines_data",
             "symbol": ['USDT'],
             "kline_interval": ['5m', '1d']},
         "daily_account_snapshots": {
             "snapshot_days_max": 180,
-            "snapshot_days_per_request": 30}}
+            "snapshot_days_per_request": 30},
+        "warehouse": {
+            "activate": False,
+            "db_file": "binance_reporting.db"},
+        "daemon": {
+            "activate": False,
+            "tick": 60,
+            "default_interval": 3600,
+            "intervals": {},
+            "market_data_ttl": 60,
+            "status_file": ""},
+        "stream": {
+            "activate": False,
+            "threshold": 0.01,
+            "min_interval": 60,
+            "check_interval": 5,
+            "ws_url": ""},
+        "cost_basis": {
+            "method": "fifo"},
+        "result_store": {
+            "max_age": 300},
+        "futures": {
+            "workers": 4},
+        "planner": {
+            "activate": False,
+            "dry_run": True,
+            "optimize": False,
+            "latency": 0.3},
+        "resilience": {
+            "max_retries": 5,
+            "base_delay": 0.5,
+            "max_delay": 30,
+            "budget_ratio": 0.1,
+            "budget_min": 10,
+            "failure_threshold": 5,
+            "reset_timeout": 30},
+        "pipeline": {
+            "queue_size": 4},
+        "weight_ledger": {
+            "activate": False,
+            "file": "",
+            "threshold": 0.75},
+        "shared_cache": {
+            "activate": False,
+            "file": "",
+            "max_mb": 64,
+            "ttl": {
+                "tickers": 10,
+                "exchange_info": 3600,
+                "klines": 2592000}},
+        "metrics": {
+            "activate": False,
+            "format": "prometheus",
+            "file": "binance_reporting.prom"}}
 
     logging.info(' - Read configuration file. -')
     config = 0
@@ -111,53 +227,416 @@ def read_config(args):
     return config
 
 
+class SymbolCatalog:
+    """trading pairs of the exchange with base asset, quote asset, status and filters (exchangeInfo)
+
+    **Goal**
+        - exact lookups of trading pairs instead of building symbols by string concatenation (asset + 'USDT')
+          and filtering the tickers with str.contains (e.g. 'USDT' also matched USDTBRL)
+        - constant-time lookups (dicts) instead of scanning dataframes again and again
+
+    **Procedure**
+        - exchangeInfo is downloaded once (see get_catalog) and indexed by symbol, base asset and quote asset
+
+    :param dict exchange_info: required; response of client.get_exchange_info()
+    """
+
+    def __init__(self, exchange_info: dict):
+        self.symbols = {}       # symbol => {'symbol', 'baseAsset', 'quoteAsset', 'status', 'filters'}
+        self.by_quote = {}      # quote asset => list of symbols
+        self.by_base = {}       # base asset => {quote asset: symbol}
+        for info in exchange_info['symbols']:
+            symbol = info['symbol']
+            self.symbols[symbol] = {
+                'symbol': symbol,
+                'baseAsset': info['baseAsset'],
+                'quoteAsset': info['quoteAsset'],
+                'status': info.get('status', ''),
+                'filters': {flt['filterType']: flt for flt in info.get('filters', [])}}
+            self.by_quote.setdefault(info['quoteAsset'], []).append(symbol)
+            self.by_base.setdefault(info['baseAsset'], {})[info['quoteAsset']] = symbol
+
+    def __contains__(self, symbol):
+        return symbol in self.symbols
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def get(self, symbol: str):
+        """base asset, quote asset, status and filters of a symbol; None for unknown symbols"""
+        return self.symbols.get(symbol)
+
+    def pair(self, base: str, quote: str = 'USDT'):
+        """symbol of a base asset quoted in a quote asset, e.g. ('BTC', 'USDT') => 'BTCUSDT'; None if not listed"""
+        return self.by_base.get(base, {}).get(quote)
+
+    def split(self, symbol: str):
+        """base and quote asset of a symbol, e.g. 'BTCUSDT' => ('BTC', 'USDT'); None for unknown symbols"""
+        info = self.symbols.get(symbol)
+        return (info['baseAsset'], info['quoteAsset']) if info is not None else None
+
+    def quoted_in(self, quote: str):
+        """symbols quoted in an asset, e.g. 'USDT' => ['BTCUSDT', 'ETHUSDT', ...]"""
+        return list(self.by_quote.get(quote, []))
+
+    def select(self, patterns):
+        """symbols matching patterns (see get_symbols)"""
+        if type(patterns) == str:
+            patterns = [patterns]
+        selected = set()
+        for pattern in patterns:
+            if pattern == '':
+                selected.update(self.symbols)
+            elif pattern in self.symbols:
+                selected.add(pattern)
+            elif pattern in self.by_quote:
+                selected.update(self.by_quote[pattern])
+            elif pattern in self.by_base:
+                selected.update(self.by_base[pattern].values())
+            else:
+                logging.warning("%s is neither a trading pair nor an asset of the exchange", pattern)
+        return sorted(selected)
+
+    def asset_prices(self, tickers, quote: str = 'USDT'):
+        """prices of the assets in a quote asset out of the tickers, e.g. {'BTC': 20000.0, 'USDT': 1.0}
+
+        :param list tickers: required; as returned by get_all_tickers
+        :param str quote: optional; asset the prices are quoted in
+
+        :returns: dict asset => price; assets without a trading pair in the quote asset are missing
+        """
+        prices = {quote: 1.0}
+        for ticker in tickers:
+            info = self.symbols.get(ticker['symbol'])
+            if info is not None and info['quoteAsset'] == quote:
+                prices[info['baseAsset']] = float(ticker['price'])
+        return prices
+
+
+def get_catalog(client=None):
+    """symbol catalog of the exchange (see SymbolCatalog); downloaded once and re-used for catalog_ttl seconds
+
+    :param object client: optional; API client (default: new client without API key)
+
+    :returns: SymbolCatalog
+    """
+    if 'catalog' in _catalog:
+        timestamp, catalog = _catalog['catalog']
+        if time.time() - timestamp < catalog_ttl:
+            return catalog
+    logging.debug("downloading symbol catalog (exchangeInfo) ...")
+    catalog = SymbolCatalog(sharedcache.get(
+        'exchange_info', sharedcache.ttl['exchange_info'], lambda: (client or get_client()).get_exchange_info()))
+    _catalog['catalog'] = (time.time(), catalog)
+    logging.debug("symbol catalog with %s trading pairs", str(len(catalog)))
+    return catalog
+
+
 def get_symbols(patterns:list = ['']):
-    """get available trading pairs from exchange which contain a given string (e.g. USDT)
+    """get available trading pairs from exchange for given assets or trading pairs (e.g. USDT)
 
     **Goal**
         - reduce the amount of trading pairs to walk through, e.g. when downloading historic trades
 
     **Procedure**
-        - get list of available trading pairs from exchange
-        - filter the list according to pattern provided
+        - get the symbol catalog of the exchange (see get_catalog)
+        - select the trading pairs according to the patterns provided (exact lookups, no substring matching)
 
     **Parameters**
         - no parameter = get all trading pairs
-        - a string = trading pairs, which contain this string
-        - a list of strings = trading pairs, which contain any of the strings in the list
+        - a trading pair (e.g. BTCUSDT) = this trading pair
+        - a quote asset (e.g. USDT) = all trading pairs quoted in this asset (BTCUSDT, ETHUSDT, ...)
+        - any other asset (e.g. SHIB) = all trading pairs of this base asset (SHIBUSDT, SHIBEUR, ...)
+        - a list of strings = trading pairs matching any of the strings in the list
 
     :param str or list pattern: required (if empty, all trading pairs will be returned)
 
-    :returns: list of filtered trading pairs available on exchange
+    :returns: sorted list of trading pairs available on exchange
     """
-
     logging.debug("get list of Trading Pairs to download data about ...")
-    client = Client()
-    symbols_list = []
+    symbols_list = get_catalog().select(patterns)
+    logging.debug(
+        "Amount of Symbols with provided patterns available on exchange: %s", str(len(symbols_list)))
+
+    return symbols_list
+
 
-    # in case a string is given, change it into a list
-    if type(patterns) == str:
-        patterns = [patterns]
+def cache_activate(ttl: int = 60):
+    """keep API clients, market data and csv files warm in memory
 
-    # get all symbols from the exchange
-    symbols_all = pd.DataFrame(client.get_all_tickers()).loc[:, ["symbol"]]
+    **Goal**
+        - avoid creating clients, downloading tickers and reading unchanged csv files again and again in long running processes (daemon mode)
 
-    # filter out pairs which are in the list of patterns
+    **Procedure**
+        - API clients are re-used per API key
+        - market data is re-used for the given amount of seconds
+        - csv files are re-used as long as they have not been changed on disk
 
-    for pattern in patterns:
-        symbols = symbols_all[
-            symbols_all.symbol.str.contains(pattern)]
-        symbols = symbols["symbol"].values.tolist()
-        symbols_list.extend(symbols)
+    :param int ttl: optional; seconds market data is re-used before downloading it again
+    """
+    global cache_active, market_data_ttl
+    logging.debug("activating in-memory caches; market data ttl: %s sec", str(ttl))
+    cache_active = True
+    market_data_ttl = ttl
 
-    # remove duplicates & sort
-    symbols_list = list(dict.fromkeys(symbols_list))
-    symbols_list.sort()
 
-    logging.debug(
-        "Amount of Symbols with provided patterns available on exchange: %s", str(len(symbols_list)))
+def cache_clear():
+    """remove everything from the in-memory caches"""
+    _clients.clear()
+    _market_data.clear()
+    _files.clear()
+    _catalog.clear()
 
-    return symbols_list
+
+class ResultStore:
+    """results of one run, shared between the modules of the run
+
+    **Goal**
+        - download data only once per run, even if several modules need it
+          (e.g. balances are needed by the ticker, the csv files and the account groups)
+
+    **Procedure**
+        - results are stored per kind (e.g. 'balances') and key (e.g. account name)
+        - results older than max_age seconds are not returned anymore (freshness bound),
+          so a long run never reports outdated balances
+
+    :param int max_age: optional; seconds a result is re-used
+    """
+
+    def __init__(self, max_age: int = 300):
+        self.max_age = max_age
+        self._results = {}      # (kind, key) => (timestamp, result)
+
+    def put(self, kind: str, key: str, result):
+        """store a result"""
+        self._results[(kind, key)] = (time.time(), result)
+
+    def age(self, kind: str, key: str):
+        """seconds since the result has been stored; None if there is no result"""
+        if (kind, key) not in self._results:
+            return None
+        return time.time() - self._results[(kind, key)][0]
+
+    def get(self, kind: str, key: str):
+        """stored result; None if there is no result or it is older than max_age"""
+        age = self.age(kind, key)
+        if age is None or age > self.max_age:
+            return None
+        return self._results[(kind, key)][1]
+
+
+class WeightBudget:
+    """API weight per minute of one area of the exchange (api, sapi, fapi), shared by concurrent requests
+
+    **Goal**
+        - several threads downloading at the same time must not exceed the rate limit together
+          (API_weight_check only knows the last response of one client)
+
+    **Procedure**
+        - the weight of a request is reserved before it is sent (acquire)
+        - if the budget of the current minute is used up, the request waits for the next minute
+        - the used weight reported by the exchange is taken over after every request (update)
+
+    :param str area: required; area of the exchange, e.g. 'fapi' (see rate_limits)
+    :param float threshold: optional; share of the rate limit to be used (0.75 as in API_weight_check)
+    """
+
+    def __init__(self, area: str, threshold: float = 0.75):
+        self.area = area
+        self.limit = rate_limits[area] * threshold
+        self.used = 0
+        self.minute = int(time.time() // 60)
+        self.lock = threading.Lock()
+
+    def acquire(self, weight: int):
+        """reserve the weight of a request; waits for the next minute if the budget is used up"""
+        with self.lock:
+            while True:
+                minute = int(time.time() // 60)
+                if minute != self.minute:
+                    self.minute = minute
+                    self.used = 0
+                if self.used == 0 or self.used + weight <= self.limit:
+                    self.used += weight
+                    return
+                seconds = (minute + 1) * 60 - time.time() + 0.1
+                logging.warning("weight budget of %s used up (%s); waiting %.1f sec", self.area, str(self.used), seconds)
+                time.sleep(seconds)
+                metrics.record_sleep(seconds)
+
+    def update(self, client):
+        """take over the used weight reported by the exchange in the last response of the client"""
+        response = getattr(client, 'response', None)
+        if response is None or 'x-mbx-used-weight-1m' not in response.headers:
+            return
+        used = int(response.headers['x-mbx-used-weight-1m'])
+        with self.lock:
+            if int(time.time() // 60) == self.minute:
+                self.used = max(self.used, used)
+
+
+def get_client(PUBLIC: str = None, SECRET: str = None, requests_params: dict = None, cached: bool = True):
+    """get an API client for the exchange
+
+    while caches are active, the client of an API key is created only once and re-used afterwards
+
+    :param str PUBLIC: optional; public part of API key (not needed for market data)
+    :param str SECRET: optional; secret part of API key (not needed for market data)
+    :param dict requests_params: optional; parameters for the requests library, e.g. {"timeout": 30}
+    :param bool cached: optional; False creates a client of its own, even while caches are active
+        (e.g. one client per worker thread; clients keep the last response for the weight check)
+
+    :returns: API client
+    """
+    key = (PUBLIC, SECRET, str(requests_params))
+    if cached and cache_active and key in _clients:
+        return _clients[key]
+    logging.debug("creating new API client")
+    client_class = _client_class(api_url)
+    client = client_class(api_key=PUBLIC, api_secret=SECRET, requests_params=requests_params)
+    if cached and cache_active:
+        _clients[key] = client
+    return client
+
+
+def _client_class(url: str = ''):
+    """client class recording every request (see metrics module)
+
+    if an url is given, all requests are sent to this base url instead of the exchange;
+    used to run all downloads against a local stand-in of the exchange (see simulator module)
+    """
+    from binance.client import Client
+
+    url = url.rstrip('/')
+    if url not in _client_classes:
+        attributes = {'_request': _request, '_handle_response': _handle_response}
+        if url != '':
+            logging.debug("redirecting API clients to %s", url)
+            attributes.update({
+                'API_URL': url + '/api',
+                'MARGIN_API_URL': url + '/sapi',
+                'WEBSITE_URL': url,
+                'FUTURES_URL': url + '/fapi',
+                'FUTURES_DATA_URL': url + '/futures/data',
+                'FUTURES_COIN_URL': url + '/dapi',
+                'FUTURES_COIN_DATA_URL': url + '/futures/data'})
+        _client_classes[url] = type('ReportingClient', (Client,), attributes)
+    return _client_classes[url]
+
+
+def _request(self, method, uri: str, signed: bool, force_params: bool = False, **kwargs):
+    """request of the API client; measures latency and weight of every request and retries failed requests
+    (see resilience module); the weight is shared with other processes on the host (see weightledger module)"""
+    from urllib.parse import urlparse
+    from binance.client import Client
+
+    endpoint = urlparse(uri).path.lstrip('/')
+    parts = endpoint.split('/')
+    area = parts[0]
+    weight = endpoint_weights.get((area, '/'.join(parts[2:])), 1)
+
+    def send():
+        # the client adds timestamp and signature to the parameters; every attempt gets fresh ones
+        attempt_kwargs = {key: dict(value) if isinstance(value, dict) else value for key, value in kwargs.items()}
+        if area in rate_limits:
+            weightledger.admit(area, weight, rate_limits[area])
+        previous_response = self.response
+        start = time.perf_counter()
+        try:
+            with tracing.span(endpoint, 'request'):
+                return Client._request(self, method, uri, signed, force_params, **attempt_kwargs)
+        finally:
+            response = self.response if self.response is not previous_response else None
+            if response is not None and area in rate_limits:
+                header = 'x-sapi-used-ip-weight-1m' if area == 'sapi' else 'x-mbx-used-weight-1m'
+                if header in response.headers:
+                    weightledger.update(area, int(response.headers[header]))
+            metrics.record_request(
+                endpoint,
+                response.status_code if response is not None else 0,
+                time.perf_counter() - start,
+                response.headers if response is not None else None,
+                area)
+
+    return resilience.execute(area, endpoint, send)
+
+
+def _handle_response(self, response):
+    """response of the API client: raw body, if requested by the calling thread (e.g. klines), otherwise parsed json
+    (see decoding module)"""
+    from binance.exceptions import BinanceAPIException, BinanceRequestException
+    try:
+        from binance_reporting import decoding
+    except:
+        import decoding
+
+    if not (200 <= response.status_code < 300):
+        raise BinanceAPIException(response, response.status_code, response.text)
+    if decoding.raw_active():
+        return response.content
+    try:
+        return decoding.loads(response.content)
+    except ValueError:
+        raise BinanceRequestException('Invalid Response: %s' % response.text)
+
+
+def get_all_tickers(client):
+    """get current prices of all trading pairs; re-used within the market data ttl if caches are active
+    and shared with other processes if the shared cache is active (see sharedcache)
+
+    :param object client: required
+
+    :returns: list of dicts with symbol and price
+    """
+    if cache_active and 'tickers' in _market_data:
+        timestamp, tickers = _market_data['tickers']
+        if time.time() - timestamp < market_data_ttl:
+            logging.debug("re-using tickers downloaded %s sec ago", str(round(time.time() - timestamp)))
+            return tickers
+    tickers = sharedcache.get('tickers', sharedcache.ttl['tickers'], client.get_all_tickers)
+    if cache_active:
+        _market_data['tickers'] = (time.time(), tickers)
+    return tickers
+
+
+def read_csv(filename: str):
+    """read a csv file into a dataframe; re-used as long as the file is unchanged if caches are active
+
+    :param str filename: required; must include the complete absolute path to the file
+
+    :returns: dataframe with content of the file
+    """
+    import pandas as pd
+
+    metrics.record_csv('read', filename)
+    if not cache_active:
+        with tracing.span(os.path.basename(filename), 'csv', direction='read'):
+            return pd.read_csv(filename)
+    stat = os.stat(filename)
+    if filename in _files:
+        mtime, size, data = _files[filename]
+        if mtime == stat.st_mtime_ns and size == stat.st_size:
+            logging.debug("re-using unchanged file %s", filename)
+            return data.copy()
+    with tracing.span(os.path.basename(filename), 'csv', direction='read'):
+        data = pd.read_csv(filename)
+    _files[filename] = (stat.st_mtime_ns, stat.st_size, data)
+    return data.copy()
+
+
+def to_csv(data, filename: str, **kwargs):
+    """write a dataframe into a csv file and record rows and bytes written (see metrics module)
+
+    :param data: required; data to be written
+    :type data: pandas DataFrame
+    :param str filename: required; must include the complete absolute path to the file
+    :param kwargs: optional; parameters for DataFrame.to_csv, e.g. index=False
+    """
+    size = os.path.getsize(filename) if kwargs.get('mode') == 'a' and os.path.isfile(filename) else 0
+    with tracing.span(os.path.basename(filename), 'csv', direction='write', rows=len(data)):
+        data.to_csv(filename, **kwargs)
+    metrics.record_rows('written', len(data))
+    metrics.count('csv_bytes_written', os.path.getsize(filename) - size, 'bytes of csv files written')
 
 
 def API_weight_check(client):
@@ -211,6 +690,7 @@ def API_weight_check(client):
         )
         logging.debug("Payload = " + str(client.response.headers[api_header_used]))
         time.sleep(int_loop_counter * 60)
+        metrics.record_sleep(int_loop_counter * 60)
         # make sure the api connection stays alive during the cool-off period
         try:
             logging.debug("   ... sending keepalive signal to exchange.")
@@ -272,13 +752,17 @@ def file_remove_blanks(filename):
 
     :returns: written csv file without empty rows
     """
+    import pandas as pd
+
     logging.info(" - removing blank rows from %s", filename)
     data = pd.read_csv(filename, skip_blank_lines=True, low_memory=False)
     data.dropna(how="all", inplace=True)
-    data.to_csv(filename, header=True)
+    to_csv(data, filename, header=True)
     logging.info(" - blank rows removed from %s", filename)
 
 
+@metrics.timed
+@tracing.traced
 def merge_files(files_src: list, file_trgt: str):
     """merging all given files into one file
 
@@ -297,17 +781,21 @@ def merge_files(files_src: list, file_trgt: str):
 
     :returns: csv file with all the merged info
     """
+    import pandas as pd
 
     data = pd.DataFrame()
     data_new = pd.DataFrame()
     for file_src in files_src:
         if os.path.isfile(file_src):
+            metrics.record_csv('read', file_src)
             data_new = pd.read_csv(file_src)
             data = pd.concat([data, data_new])
             #data = data.append(data_new, ignore_index=True)
-    data.to_csv(file_trgt, index=False)
+    to_csv(data, file_trgt, index=False)
 
 
+@metrics.timed
+@tracing.traced
 def merge_klines(klines_dir_src : str, klines_dir_trgt : str, filename_trgt : str):
     """merging all klines files of a given directory into one file
 
@@ -317,7 +805,7 @@ def merge_klines(klines_dir_src : str, klines_dir_trgt : str, filename_trgt : st
 
     **Procedure**
         - get the source directory with all the kline csv files
-        - loop through all files and append to target filename
+        - loop through all kline files (history_*_klines_*.csv) and append them to target filename
 
     :param str klines_dir_src: required; provides complete path to source directory with all klines csv files
     :param str klines_dir_trgt: required; provides complete path to target directory for the merged csv files
@@ -326,9 +814,15 @@ def merge_klines(klines_dir_src : str, klines_dir_trgt : str, filename_trgt : st
     :returns: csv file with all the merged klines
     """
 
+    import pandas as pd
+
     logging.info("--- START --- Merging klines into one file ---")
 
-    files = os.listdir(klines_dir_src)
+    # only kline files; the directory may hold other files as well (e.g. known_gaps.json of klinegaps)
+    files = sorted(
+        f for f in os.listdir(klines_dir_src)
+        if f.startswith('history_') and '_klines_' in f and f.endswith('.csv')
+        and os.path.isfile(klines_dir_src + "/" + f))
     klines = pd.DataFrame()
     writemode = 'a'
 
@@ -340,14 +834,16 @@ def merge_klines(klines_dir_src : str, klines_dir_trgt : str, filename_trgt : st
             writemode = 'w'
             headermode = True
         logging.debug("..... adding filename: " + f)
+        metrics.record_csv('read', klines_dir_src + "/" + f)
         klines = pd.read_csv(klines_dir_src + "/" + f, skip_blank_lines=True, header=0 , usecols=[0,1,2,3,4,5], engine='python')
         klines['pair'] = f[f.rfind('_')+1:f.rfind('.')]
         logging.debug("... writing file ...")
-        klines.to_csv(klines_dir_trgt + "/" + filename_trgt, header = headermode, index=False, mode = writemode)
+        to_csv(klines, klines_dir_trgt + "/" + filename_trgt, header = headermode, index=False, mode = writemode)
         logging.debug("..... finished adding filename: " + f)
     logging.info("..... removing duplicates in target file, sort it and write ---")
+    metrics.record_csv('read', klines_dir_trgt + "/" + filename_trgt)
     klines = pd.read_csv(klines_dir_trgt + "/" + filename_trgt)
     klines.drop_duplicates(subset=["open time", "pair"], keep="last", inplace=True)
     klines.sort_values(by=["pair", "open time"], inplace=True)
-    klines.to_csv(klines_dir_trgt + "/" + filename_trgt, header = True, index = False, mode = 'w')
+    to_csv(klines, klines_dir_trgt + "/" + filename_trgt, header = True, index = False, mode = 'w')
     logging.info("--- FINISHED --- Merging klines into one file ---")
@@ -0,0 +1,261 @@
+"""detection and repair of gaps in downloaded klines
+
+**Goal**
+    - find candles missing in the middle of the kline history (e.g. exchange outages or failed runs);
+      downloader.klines only continues after the last stored candle and never notices them
+    - download only the missing candles instead of deleting the files and downloading everything again
+
+**Procedure**
+    - scan: the open times of every pair are compared with the length of the interval (numpy, vectorized);
+      every step larger than the interval is a gap
+    - repair: the missing ranges of all pairs are downloaded at the same time and merged into the
+      kline files (or the warehouse)
+    - gaps, for which the exchange has no candles at all (e.g. trading was halted), are remembered in
+      <dir>/<interval>/known_gaps.json and skipped next time
+    - technical indicators are computed again for the whole history of a repaired pair (the candles after a gap
+      were computed over the hole); kline files with indicators are skipped, if no indicators are provided
+"""
+import os
+import json
+import logging
+import threading
+import concurrent.futures
+import numpy as np
+import pandas as pd
+try:
+    from binance_reporting import helper as hlp
+    from binance_reporting import warehouse as wh
+    from binance_reporting import metrics
+    from binance_reporting import tracing
+    from binance_reporting import decoding
+    from binance_reporting import downloader
+except:
+    import helper as hlp
+    import warehouse as wh
+    import metrics
+    import tracing
+    import decoding
+    import downloader
+
+gap_columns = ['pair', 'interval', 'gap start', 'gap end', 'missing candles']
+
+
+def find_gaps(open_times, interval: str):
+    """missing ranges in a series of open times
+
+    :param open_times: required; open times of the candles in ms (any order, duplicates allowed)
+    :param str interval: required; kline interval, e.g. '1h'
+
+    :returns: array with one line per gap: open time of the first and of the last missing candle (ms)
+    """
+    step = hlp.kline_intervals_ms[interval]
+    open_times = np.unique(np.asarray(open_times, dtype=np.int64))
+    if len(open_times) < 2:
+        return np.empty((0, 2), dtype=np.int64)
+    steps = np.diff(open_times)
+    if interval == '1M':
+        # months have different lengths; only more than one month between two candles is a gap
+        holes = np.flatnonzero(steps > 31 * 86400000)
+        return np.column_stack([open_times[holes] + 28 * 86400000, open_times[holes + 1] - 28 * 86400000])
+    holes = np.flatnonzero(steps > step)
+    return np.column_stack([open_times[holes] + step, open_times[holes + 1] - step])
+
+
+def _klines_file(dir, interval, pair):
+    return dir + '/' + interval + '/history_' + interval + '_klines_' + pair + '.csv'
+
+
+def _pairs(dir, interval, db=None):
+    """pairs with downloaded klines of an interval"""
+    if db is not None:
+        if not wh._columns(db, 'klines'):
+            return []
+        return [row[0] for row in db.execute('SELECT DISTINCT pair FROM klines WHERE interval = ?', [interval])]
+    prefix = 'history_' + interval + '_klines_'
+    interval_dir = dir + '/' + interval
+    if not os.path.isdir(interval_dir):
+        return []
+    return sorted(
+        filename[len(prefix):-4] for filename in os.listdir(interval_dir)
+        if filename.startswith(prefix) and filename.endswith('.csv'))
+
+
+def _open_times(dir, interval, pair, db=None):
+    if db is not None:
+        return wh.read(db, 'klines', ['open time ux'], interval=interval, pair=pair)['open time ux'].to_numpy()
+    filename = _klines_file(dir, interval, pair)
+    metrics.record_csv('read', filename)
+    return pd.read_csv(filename, usecols=['open time ux'])['open time ux'].dropna().to_numpy()
+
+
+def _known_gaps_file(dir, interval):
+    return dir + '/' + interval + '/known_gaps.json'
+
+
+def _read_known_gaps(dir, interval):
+    filename = _known_gaps_file(dir, interval)
+    if not os.path.isfile(filename):
+        return {}
+    with open(filename) as file:
+        return json.load(file)
+
+
+@metrics.timed
+@tracing.traced
+def scan(dir, intervals, symbols=None, db=None, include_known=False):
+    """find gaps in the downloaded klines
+
+    :param str dir: required; directory of the kline files (as provided to downloader.klines)
+    :param list intervals: required; kline intervals to be scanned, e.g. ['1h', '1d']
+    :param list symbols: optional; trading pairs to be scanned (default: all downloaded pairs)
+    :param object db: optional; warehouse connection; if provided, the klines of the warehouse are scanned
+    :param bool include_known: optional; include gaps, for which the exchange has no candles
+
+    :returns: dataframe with one line per gap (pair, interval, gap start, gap end, missing candles)
+    """
+    gaps = []
+    for interval in intervals:
+        known = {} if include_known else _read_known_gaps(dir, interval)
+        pairs = _pairs(dir, interval, db)
+        if symbols is not None:
+            pairs = [pair for pair in pairs if pair in symbols]
+        for pair in tracing.iterate(pairs, 'symbol'):
+            pair_gaps = find_gaps(_open_times(dir, interval, pair, db), interval)
+            known_pair = {tuple(gap) for gap in known.get(pair, [])}
+            for start, end in pair_gaps.tolist():
+                if (start, end) in known_pair:
+                    continue
+                missing = (end - start) // hlp.kline_intervals_ms[interval] + 1 if interval != '1M' else 1
+                gaps.append([pair, interval, start, end, missing])
+    gaps = pd.DataFrame(gaps, columns=gap_columns)
+    logging.info(" - %s gaps with %s missing candles found -", str(len(gaps)), str(gaps['missing candles'].sum()))
+    return gaps
+
+
+_clients = threading.local()
+
+
+def _client():
+    """one API client per worker thread (clients keep the last response for the weight check)"""
+    if not hasattr(_clients, 'client'):
+        _clients.client = hlp.get_client("", "", {"timeout": 30}, cached=False)
+    return _clients.client
+
+
+def _download_gap(pair, interval, start, end):
+    """download the candles of one gap
+
+    :returns: dataframe in the format of the kline files
+    """
+    client = _client()
+    pages = [np.empty((0, 6))]
+    start_time = int(start)
+    while start_time <= end:
+        hlp.API_weight_check(client)
+        # parsed straight into a numpy array (see decoding)
+        page = decoding.get_klines(client, symbol=pair, interval=interval, startTime=start_time, endTime=int(end), limit=1000)
+        if not len(page):
+            break
+        pages.append(page)
+        start_time = int(page[-1, 0]) + 1
+    rows = np.concatenate(pages)
+    metrics.record_rows('downloaded', len(rows))
+    klines = pd.DataFrame(rows, columns=['open time ux', 'open', 'high', 'low', 'close', 'volume'])
+    klines['open time ux'] = klines['open time ux'].astype('int64')
+    klines.insert(0, 'open time', pd.to_datetime(klines['open time ux'], unit='ms'))
+    return klines[['open time', 'open', 'high', 'low', 'close', 'volume', 'open time ux']]
+
+
+def _combine(klines, new_klines, indicators, indicators_config):
+    """candles of the history and of the gaps in order; indicators computed again (see downloader._add_indicators)"""
+    klines = pd.concat([klines[downloader.kline_columns], new_klines], ignore_index=True)
+    klines = klines.drop_duplicates(subset=['open time ux'], keep='first').sort_values(by=['open time ux'])
+    klines['open time'] = pd.to_datetime(klines['open time ux'], unit='ms')
+    return downloader._add_indicators(klines.reset_index(drop=True), indicators or [], indicators_config)
+
+
+def _merge(dir, interval, pair, new_klines, db=None, indicators=None, indicators_config=None):
+    """merge downloaded candles into the kline file (or the warehouse)
+
+    :returns: True, if the candles have been merged
+    """
+    computed = bool(indicators)
+    if db is not None:
+        new_klines = new_klines.copy()
+        if computed:
+            klines = wh.read(db, 'klines', downloader.kline_columns, interval=interval, pair=pair)
+            new_klines = _combine(klines, new_klines, indicators, indicators_config)
+        new_klines['interval'] = interval
+        new_klines['pair'] = pair
+        wh.upsert(db, 'klines', new_klines)
+        return True
+    filename = _klines_file(dir, interval, pair)
+    klines = pd.read_csv(filename)
+    if len(klines.columns) > len(downloader.kline_columns) and not computed:
+        logging.warning("%s has indicators, but no indicators are configured; gaps not merged", filename)
+        return False
+    hlp.to_csv(_combine(klines, new_klines, indicators, indicators_config), filename, index=False)
+    return True
+
+
+@metrics.timed
+@tracing.traced
+def repair(dir, intervals, symbols=None, db=None, workers=4, indicators=None, indicators_config=None):
+    """download the missing candles of all gaps and merge them into the kline files (or the warehouse)
+
+    **Procedure**
+        - scan for gaps (see scan)
+        - download the missing ranges of all gaps at the same time (workers)
+        - merge the candles of a pair into its kline file as soon as all gaps of the pair are downloaded
+          and compute the indicators of the pair again
+        - remember gaps, for which the exchange has no candles (known_gaps.json)
+
+    :param str dir: required; directory of the kline files (as provided to downloader.klines)
+    :param list intervals: required; kline intervals to be repaired, e.g. ['1h', '1d']
+    :param list symbols: optional; trading pairs to be repaired (default: all downloaded pairs)
+    :param object db: optional; warehouse connection; if provided, the klines of the warehouse are repaired
+    :param int workers: optional; amount of gaps downloaded at the same time
+    :param list indicators: optional; finta indicators of the kline files (as provided to downloader.klines)
+    :param dict indicators_config: optional; parameters for the indicators (as provided to downloader.klines)
+
+    :returns: dataframe with the gaps and the amount of candles repaired per gap
+    """
+    gaps = scan(dir, intervals, symbols, db)
+    if gaps.empty:
+        return gaps.assign(repaired=[])
+    logging.info(" - Repairing %s gaps with %s workers -", str(len(gaps)), str(workers))
+
+    downloaded = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(_download_gap, gap['pair'], gap['interval'], gap['gap start'], gap['gap end']): index
+            for index, gap in gaps.iterrows()}
+        for future in concurrent.futures.as_completed(futures):
+            index = futures[future]
+            try:
+                downloaded[index] = future.result()
+            except Exception as e:
+                logging.warning("Exception occured: ", exc_info=True)
+                downloaded[index] = None
+
+    gaps['repaired'] = [len(downloaded[index]) if downloaded[index] is not None else 0 for index in gaps.index]
+    for (interval, pair), pair_gaps in gaps.groupby(['interval', 'pair']):
+        new_klines = [downloaded[index] for index in pair_gaps.index if downloaded[index] is not None]
+        new_klines = [klines for klines in new_klines if not klines.empty]
+        if new_klines and not _merge(
+                dir, interval, pair, pd.concat(new_klines, ignore_index=True), db, indicators, indicators_config):
+            gaps.loc[pair_gaps.index, 'repaired'] = 0
+
+    # gaps without any candle at the exchange are not tried again
+    empty = gaps[gaps.index.map(lambda index: downloaded[index] is not None and downloaded[index].empty)]
+    for interval, interval_gaps in empty.groupby('interval'):
+        known = _read_known_gaps(dir, interval)
+        for pair, start, end in interval_gaps[['pair', 'gap start', 'gap end']].itertuples(index=False):
+            known.setdefault(pair, []).append([int(start), int(end)])
+        if not os.path.exists(dir + '/' + interval):
+            os.makedirs(dir + '/' + interval)
+        with open(_known_gaps_file(dir, interval), 'w') as file:
+            json.dump(known, file)
+    logging.info(" - Repaired %s candles; %s gaps without candles at the exchange -",
+        str(gaps['repaired'].sum()), str(len(empty)))
+    return gaps
@@ -0,0 +1,231 @@
+"""time-aligned kline matrix of many trading pairs for backtesting
+
+**Goal**
+    - one array with the klines of all pairs of an interval (pair x time x OHLCV),
+      instead of opening hundreds of history_<interval>_klines_<pair>.csv files and aligning them by hand
+    - repeated loads do not read or copy any data
+
+**Procedure**
+    - build: all kline files of an interval (or the warehouse table 'klines') are read once and written into
+      a binary store (numpy .npy files) next to the kline files: <dir>/matrix/<interval>/
+    - the store is re-built automatically, as soon as a kline file (or the warehouse) has been changed
+    - load: the store is memory-mapped; the requested date range is a view on the mapped file (zero-copy)
+    - missing candles (e.g. before the listing of a pair or gaps at the exchange) are masked
+
+**Usage**
+
+    .. code:: python
+
+        from binance_reporting import klinematrix
+        matrix = klinematrix.load('klines_data', '1h', start='2022-01-01', end='2022-06-30')
+        close = matrix.data[:, :, klinematrix.fields.index('close')]     # masked array pair x time
+        matrix.pairs    # names of the pairs (first axis)
+        matrix.times    # open times in ms (second axis)
+"""
+import os
+import json
+import shutil
+import logging
+import collections
+import numpy as np
+import pandas as pd
+try:
+    from binance_reporting import helper as hlp
+    from binance_reporting import warehouse as wh
+    from binance_reporting import metrics
+    from binance_reporting import tracing
+except:
+    import helper as hlp
+    import warehouse as wh
+    import metrics
+    import tracing
+
+fields = ['open', 'high', 'low', 'close', 'volume']
+
+store_dir_name = 'matrix'
+
+KlineMatrix = collections.namedtuple('KlineMatrix', ['data', 'pairs', 'times', 'interval'])
+KlineMatrix.__doc__ = """klines of many pairs aligned by time
+
+:data: masked array pair x time x field (see fields); masked = no candle
+:pairs: list of trading pairs (first axis)
+:times: open times in ms (second axis)
+:interval: kline interval, e.g. '1h'
+"""
+
+
+def _step_ms(interval):
+    if interval not in hlp.kline_intervals_ms or interval == '1M':
+        raise ValueError("interval " + str(interval) + " has no fixed length and can not be aligned")
+    return hlp.kline_intervals_ms[interval]
+
+
+def _to_ms(value):
+    """ms since epoch out of int (ms), string or timestamp (UTC)"""
+    if value is None:
+        return None
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    timestamp = pd.Timestamp(value)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.tz_localize('UTC')
+    return int(timestamp.value // 1000000)
+
+
+def _csv_files(dir, interval):
+    """kline files of an interval: pair => filename"""
+    interval_dir = dir + '/' + interval
+    prefix = 'history_' + interval + '_klines_'
+    if not os.path.isdir(interval_dir):
+        return {}
+    return {
+        filename[len(prefix):-4]: interval_dir + '/' + filename
+        for filename in sorted(os.listdir(interval_dir))
+        if filename.startswith(prefix) and filename.endswith('.csv')}
+
+
+def _sources(dir, interval, db=None):
+    """fingerprint of the data the store is built from (changes whenever new klines are downloaded)"""
+    if db is not None:
+        if not wh._columns(db, 'klines'):
+            return {}
+        rows = db.execute(
+            'SELECT pair, COUNT(*), MAX("open time ux") FROM klines WHERE interval = ? GROUP BY pair', [interval])
+        return {pair: [count, last] for pair, count, last in rows}
+    sources = {}
+    for pair, filename in _csv_files(dir, interval).items():
+        stat = os.stat(filename)
+        sources[pair] = [stat.st_mtime_ns, stat.st_size]
+    return sources
+
+
+def _read_pair(dir, interval, pair, db=None):
+    """open time (ms) and OHLCV of one pair"""
+    if db is not None:
+        klines = wh.read(db, 'klines', ['open time ux'] + fields, interval=interval, pair=pair)
+    else:
+        filename = _csv_files(dir, interval)[pair]
+        metrics.record_csv('read', filename)
+        klines = pd.read_csv(filename, usecols=['open time ux'] + fields)
+    klines = klines.dropna(subset=['open time ux']).drop_duplicates(subset=['open time ux'], keep='last')
+    return klines['open time ux'].to_numpy(dtype=np.int64), klines[fields].to_numpy(dtype=np.float64)
+
+
+def store_path(dir, interval):
+    """directory of the binary store of an interval"""
+    # not within the directory of the kline files, which only holds kline files (see helper.merge_klines)
+    return dir + '/' + store_dir_name + '/' + interval
+
+
+def _read_index(path):
+    if not os.path.isfile(path + '/index.json'):
+        return None
+    with open(path + '/index.json') as file:
+        return json.load(file)
+
+
+@metrics.timed
+@tracing.traced
+def build(dir, interval, db=None, force=False):
+    """build the binary store of an interval, if the klines have changed since the last build
+
+    :param str dir: required; directory of the kline files (as provided to downloader.klines)
+    :param str interval: required; kline interval, e.g. '1h'
+    :param object db: optional; warehouse connection; if provided, the klines are read from the warehouse
+    :param bool force: optional; build even if nothing has changed
+
+    :returns: directory of the store
+    """
+    step = _step_ms(interval)
+    path = store_path(dir, interval)
+    sources = _sources(dir, interval, db)
+    index = _read_index(path)
+    if not force and index is not None and index['sources'] == sources:
+        logging.debug("kline matrix %s is up-to-date", path)
+        return path
+
+    logging.info(" - Building kline matrix for %s pairs of interval %s -", str(len(sources)), interval)
+    pairs = sorted(sources)
+    klines = {}
+    for pair in tracing.iterate(pairs, 'symbol'):
+        klines[pair] = _read_pair(dir, interval, pair, db)
+    times = [open_times for open_times, values in klines.values() if len(open_times)]
+    start = min(int(open_times.min()) for open_times in times) if times else 0
+    end = max(int(open_times.max()) for open_times in times) if times else -step
+    length = (end - start) // step + 1
+
+    # new store is written next to the old one and replaces it when complete
+    tmp_path = path + '.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    data = np.lib.format.open_memmap(
+        tmp_path + '/data.npy', mode='w+', dtype=np.float64, shape=(len(pairs), length, len(fields)))
+    mask = np.lib.format.open_memmap(
+        tmp_path + '/mask.npy', mode='w+', dtype=np.bool_, shape=(len(pairs), length))
+    data[:] = np.nan
+    mask[:] = True
+    for nbr, pair in enumerate(pairs):
+        open_times, values = klines.pop(pair)
+        # candles not starting at the grid of the interval are dropped
+        aligned = (open_times - start) % step == 0
+        positions = (open_times[aligned] - start) // step
+        data[nbr, positions] = values[aligned]
+        mask[nbr, positions] = False
+    data.flush()
+    mask.flush()
+    del data, mask
+    with open(tmp_path + '/index.json', 'w') as file:
+        json.dump({
+            'interval': interval, 'pairs': pairs, 'start': start, 'step': step, 'length': length,
+            'fields': fields, 'sources': sources}, file)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    logging.info(" - Finished building kline matrix %s (%s candles per pair) -", path, str(length))
+    return path
+
+
+def load(dir, interval, start=None, end=None, pairs=None, db=None):
+    """time-aligned klines of many pairs out of the binary store (built or updated if needed)
+
+    the data is memory-mapped; a date range is a view on the store (no copy).
+    Selecting pairs copies the selected pairs of the date range only.
+
+    :param str dir: required; directory of the kline files (as provided to downloader.klines)
+    :param str interval: required; kline interval, e.g. '1h'
+    :param start: optional; first open time (ms, string or timestamp; UTC), e.g. '2022-01-01'
+    :param end: optional; last open time (ms, string or timestamp; UTC)
+    :param list pairs: optional; trading pairs (default: all pairs of the interval)
+    :param object db: optional; warehouse connection; if provided, the klines are read from the warehouse
+
+    :returns: KlineMatrix
+    """
+    path = build(dir, interval, db)
+    index = _read_index(path)
+    data = np.load(path + '/data.npy', mmap_mode='r')
+    mask = np.load(path + '/mask.npy', mmap_mode='r')
+
+    step = index['step']
+    first = 0
+    last = index['length']
+    start_ms = _to_ms(start)
+    end_ms = _to_ms(end)
+    if start_ms is not None:
+        first = min(max(-(-(start_ms - index['start']) // step), 0), index['length'])
+    if end_ms is not None:
+        last = min(max((end_ms - index['start']) // step + 1, first), index['length'])
+    data = data[:, first:last]
+    mask = mask[:, first:last]
+
+    selected = index['pairs']
+    if pairs is not None:
+        missing = [pair for pair in pairs if pair not in index['pairs']]
+        if missing:
+            raise KeyError("no klines of interval " + interval + " for " + ', '.join(missing))
+        rows = [index['pairs'].index(pair) for pair in pairs]
+        data = data[rows]
+        mask = mask[rows]
+        selected = list(pairs)
+
+    times = index['start'] + np.arange(first, last, dtype=np.int64) * step
+    masked = np.ma.MaskedArray(data, mask=np.broadcast_to(mask[:, :, np.newaxis], data.shape), copy=False)
+    return KlineMatrix(masked, selected, times, interval)
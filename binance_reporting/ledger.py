@@ -0,0 +1,270 @@
+"""daily balances of an account out of its trades, deposits and withdrawals (ledger replay)
+
+**Goal**
+    - daily balances per asset for the whole lifetime of an account; the exchange provides daily snapshots for
+      the last 180 days only and the snapshot download is the heaviest user of the sapi weight
+      (see downloader.daily_account_snapshots)
+    - no snapshot requests: once an anchor is known, only the locally stored trades, deposits and withdrawals are used
+
+**Procedure**
+    - every trade, deposit and withdrawal is turned into balance changes per asset: buys add the base asset and
+      take the quote asset (sells vice versa), commissions are taken, deposits are added, withdrawals and
+      their fees are taken (see changes)
+    - the changes are summed per day and asset and accumulated (cumulative sum over a day x asset matrix, numpy)
+    - anchor: the balances of one snapshot day (latest local snapshot; otherwise downloaded once and kept in
+      ledger_<account>_anchor.json); the balance at the end of a day is the anchor balance plus the changes
+      between the anchor and the end of that day (days before the anchor: minus the changes in between)
+    - days with a local snapshot are compared with the replayed balances (column 'snapshot'); differences are logged
+
+.. note::
+    - only SPOT accounts
+    - balance changes without trade, deposit or withdrawal (e.g. trades of pairs, which have not been downloaded,
+      dust conversion, staking, savings, transfers between own accounts) are unknown to the ledger; they show up
+      as differences to the snapshots on the days before the anchor
+"""
+import os
+import json
+import time
+import logging
+import numpy as np
+import pandas as pd
+try:
+    from binance_reporting import helper as hlp
+    from binance_reporting import warehouse as wh
+    from binance_reporting import metrics
+    from binance_reporting import tracing
+    from binance_reporting import costbasis
+except:
+    import helper as hlp
+    import warehouse as wh
+    import metrics
+    import tracing
+    import costbasis
+
+daily_ms = 86400000
+
+# balances below this are treated as zero (rounding of the exchange)
+eps = 1e-8
+
+# status of deposits, which have been credited to the account (1 = success, 6 = credited but cannot withdraw)
+deposit_credited = [1, 6]
+# status of withdrawals, which have not been taken from the account (1 = cancelled, 3 = rejected, 5 = failure)
+withdrawal_not_taken = [1, 3, 5]
+
+ledger_columns = ['asset', 'balance', 'snapshot', 'updateTime', 'UTCTime', 'account', 'type']
+
+
+def changes(trades=None, deposits=None, withdrawals=None):
+    """balance changes per asset out of trades, deposits and withdrawals
+
+    :param trades: optional; trades as downloaded by downloader.trades
+    :param deposits: optional; deposits as downloaded by downloader.deposits
+    :param withdrawals: optional; withdrawals as downloaded by downloader.withdrawals
+    :type trades, deposits, withdrawals: pandas DataFrame
+
+    :returns: dataframe with the columns time (ms), asset and change
+    """
+    frames = [pd.DataFrame({'time': pd.Series(dtype='int64'), 'asset': pd.Series(dtype=object),
+                            'change': pd.Series(dtype=float)})]
+
+    if trades is not None and not trades.empty:
+        trades = trades.drop_duplicates(subset=['symbol', 'id'])
+        # base and quote asset per symbol; delisted symbols are not in the catalog anymore
+        catalog = hlp.get_catalog()
+        symbols = trades['symbol'].drop_duplicates()
+        split = pd.DataFrame([catalog.split(symbol) or costbasis.split_symbol(symbol) for symbol in symbols],
+            index=symbols, columns=['base', 'quote'])
+        base = trades['symbol'].map(split['base'])
+        quote = trades['symbol'].map(split['quote'])
+        sign = np.where(trades['isBuyer'].astype(str).str.lower().isin(['true', '1']), 1.0, -1.0)
+        time_ms = trades['time'].astype('int64')
+        frames.append(pd.DataFrame({'time': time_ms, 'asset': base, 'change': sign * trades['qty'].astype(float)}))
+        frames.append(pd.DataFrame({'time': time_ms, 'asset': quote, 'change': -sign * trades['quoteQty'].astype(float)}))
+        frames.append(pd.DataFrame({'time': time_ms, 'asset': trades['commissionAsset'],
+                                    'change': -trades['commission'].astype(float)}))
+
+    if deposits is not None and not deposits.empty:
+        deposits = deposits.drop_duplicates(subset=['txId'])
+        deposits = deposits[deposits['status'].astype(int).isin(deposit_credited)]
+        frames.append(pd.DataFrame({'time': deposits['insertTime'].astype('int64'), 'asset': deposits['coin'],
+                                    'change': deposits['amount'].astype(float)}))
+
+    if withdrawals is not None and not withdrawals.empty:
+        withdrawals = withdrawals.drop_duplicates(subset=['id'])
+        withdrawals = withdrawals[~withdrawals['status'].astype(int).isin(withdrawal_not_taken)]
+        frames.append(pd.DataFrame({'time': withdrawals['insertTime'].astype('int64'), 'asset': withdrawals['coin'],
+                                    'change': -(withdrawals['amount'].astype(float)
+                                                + withdrawals['transactionFee'].fillna(0).astype(float))}))
+
+    changes = pd.concat(frames, ignore_index=True)
+    return changes[changes['asset'].notna() & (changes['asset'] != '') & (changes['change'] != 0)]
+
+
+def replay(changes, anchor: dict, anchor_time: int, end_time: int = None):
+    """daily balances per asset, replayed from an anchor
+
+    :param changes: required; balance changes as returned by changes
+    :type changes: pandas DataFrame
+    :param dict anchor: required; balances per asset at the anchor, e.g. {'BTC': 0.5, 'USDT': 100.0}
+    :param int anchor_time: required; time of the anchor in ms (end of a snapshot day)
+    :param int end_time: optional; time in ms of the last day to be replayed (default: now)
+
+    :returns: dataframe with one line per day and one column per asset (index: day number since 1970)
+    """
+    end_time = int(time.time() * 1000) if end_time is None else int(end_time)
+    anchor_day = int(anchor_time) // daily_ms
+    days = changes['time'] // daily_ms
+    first, last = anchor_day, max(anchor_day, end_time // daily_ms)
+    if not changes.empty:
+        first, last = min(first, int(days.min())), max(last, int(days.max()))
+
+    assets = sorted(set(changes['asset']) | set(anchor))
+    daily = changes.groupby([days, changes['asset']])['change'].sum().unstack(fill_value=0.0)
+    daily = daily.reindex(index=np.arange(first, last + 1), columns=assets, fill_value=0.0)
+
+    # balance at the end of a day = anchor + changes up to the end of the day - changes up to the end of the anchor day
+    cumulative = daily.to_numpy(dtype=np.float64).cumsum(axis=0)
+    start = np.array([anchor.get(asset, 0.0) for asset in assets], dtype=np.float64)
+    balances = start + cumulative - cumulative[anchor_day - first]
+    balances = np.round(balances, 8)
+    balances[np.abs(balances) < eps] = 0.0
+    return pd.DataFrame(balances, index=pd.Index(daily.index, name='day'), columns=pd.Index(assets, name='asset'))
+
+
+def _snapshots(account_name, snapshots_assets_file, db=None):
+    """balances per asset and day of the local snapshots (free + locked)
+
+    :returns: dataframe with the columns updateTime, asset and snapshot
+    """
+    if db is not None:
+        snapshots = wh.read(db, 'snapshot_daily_assets', account=account_name)
+    elif snapshots_assets_file != '' and os.path.isfile(snapshots_assets_file):
+        snapshots = hlp.read_csv(snapshots_assets_file)
+    else:
+        snapshots = pd.DataFrame()
+    if snapshots.empty or 'free' not in snapshots:
+        return pd.DataFrame(columns=['updateTime', 'asset', 'snapshot'])
+    snapshots = snapshots[snapshots['asset'] != 'PortVal']
+    snapshots = snapshots.assign(
+        updateTime=snapshots['updateTime'].astype('int64'),
+        snapshot=snapshots['free'].astype(float) + snapshots['locked'].astype(float))
+    return snapshots[['updateTime', 'asset', 'snapshot']]
+
+
+def _anchor(account_name, PUBLIC, SECRET, snapshots, anchor_file):
+    """balances of the anchor day: latest local snapshot, anchor of a previous run or one downloaded snapshot
+
+    :returns: time of the anchor (ms) and balances per asset
+    """
+    stored = None
+    if anchor_file != '' and os.path.isfile(anchor_file):
+        with open(anchor_file) as file:
+            stored = json.load(file)
+    if not snapshots.empty and (stored is None or snapshots['updateTime'].max() >= stored['updateTime']):
+        anchor_time = int(snapshots['updateTime'].max())
+        anchor = snapshots[snapshots['updateTime'] == anchor_time].groupby('asset')['snapshot'].sum().to_dict()
+        logging.debug("anchor: local snapshot of %s", str(pd.to_datetime(anchor_time, unit='ms', utc=True)))
+    elif stored is not None:
+        anchor_time, anchor = stored['updateTime'], stored['balances']
+        logging.debug("anchor: stored anchor of %s", str(pd.to_datetime(anchor_time, unit='ms', utc=True)))
+    else:
+        # no local snapshot yet; the latest snapshot is downloaded once (the exchange returns at least 7 days)
+        logging.info(" . downloading the latest snapshot of account %s as anchor", account_name)
+        client = hlp.get_client(PUBLIC, SECRET)
+        client.REQUEST_TIMEOUT = 30
+        hlp.API_weight_check(client)
+        snaps = client.get_account_snapshot(type='SPOT', limit=7)['snapshotVos']
+        hlp.API_close_connection(client)
+        if not snaps:
+            raise ValueError("no snapshot of account " + account_name + " available as anchor")
+        snap = max(snaps, key=lambda snap: snap['updateTime'])
+        anchor_time = int(snap['updateTime'])
+        anchor = {balance['asset']: float(balance['free']) + float(balance['locked'])
+                  for balance in snap['data']['balances']}
+    anchor = {asset: float(amount) for asset, amount in anchor.items() if abs(float(amount)) >= eps}
+    if anchor_file != '':
+        with open(anchor_file + '.tmp', 'w') as file:
+            json.dump({'updateTime': int(anchor_time), 'balances': anchor}, file)
+        os.replace(anchor_file + '.tmp', anchor_file)
+    return int(anchor_time), anchor
+
+
+@metrics.timed
+@tracing.traced
+def daily_balances(
+    account_name,
+    PUBLIC,
+    SECRET,
+    trades_file,
+    deposits_file,
+    withdrawals_file,
+    snapshots_assets_file,
+    ledger_file,
+    anchor_file = '',
+    db = None
+    ):
+    """daily balances per asset for the whole lifetime of an account, replayed from trades, deposits and withdrawals
+
+    **Procedure**
+        - read trades, deposits, withdrawals and snapshots of the account (csv files or warehouse)
+        - determine the anchor (see _anchor) and replay the balance changes (see changes and replay)
+        - compare with the local snapshots and write the daily balances to a csv file (or the warehouse)
+
+    :param str account_name: required; added to the csv file for easier tracking
+    :param str PUBLIC: required; public key of the account (only needed, if there is no anchor yet)
+    :param str SECRET: required; secret key of the account (only needed, if there is no anchor yet)
+    :param str trades_file: required; csv file with the trades (see downloader.trades)
+    :param str deposits_file: required; csv file with the deposits (see downloader.deposits)
+    :param str withdrawals_file: required; csv file with the withdrawals (see downloader.withdrawals)
+    :param str snapshots_assets_file: required; csv file with the daily snapshots (see downloader.daily_account_snapshots)
+    :param str ledger_file: required; name and location of the csv file for the daily balances
+    :param str anchor_file: optional; json file keeping the anchor, so that no snapshot is downloaded again
+    :param object db: optional; warehouse connection; if provided, data is read from and written to the warehouse
+
+    :returns: dataframe with one line per day and asset (balance, snapshot balance if available)
+    """
+    logging.info(" - Start replaying daily balances for account %s -", account_name)
+
+    def read(table, filename):
+        if db is not None:
+            return wh.read(db, table, account=account_name)
+        if os.path.isfile(filename):
+            return hlp.read_csv(filename)
+        return pd.DataFrame()
+
+    balance_changes = changes(
+        read('trades', trades_file), read('deposits', deposits_file), read('withdrawals', withdrawals_file))
+    snapshots = _snapshots(account_name, snapshots_assets_file, db)
+    anchor_time, anchor = _anchor(account_name, PUBLIC, SECRET, snapshots, anchor_file)
+
+    balances = replay(balance_changes, anchor, anchor_time)
+    ledger = balances.stack().rename('balance').reset_index()
+    ledger = ledger[ledger['balance'] != 0]
+
+    # snapshot balances of the same day, for comparison
+    snapshots = snapshots.assign(day=snapshots['updateTime'] // daily_ms)
+    ledger = ledger.merge(snapshots[['day', 'asset', 'snapshot']], on=['day', 'asset'], how='outer')
+    ledger['balance'] = ledger['balance'].fillna(0.0)
+    ledger['updateTime'] = (ledger['day'] + 1) * daily_ms - 1
+    ledger['UTCTime'] = pd.to_datetime(ledger['day'] * daily_ms, unit='ms').dt.strftime('%Y-%m-%d')
+    ledger['account'] = account_name
+    ledger['type'] = 'SPOT'
+    ledger = ledger.sort_values(by=['day', 'asset'], kind='mergesort')[ledger_columns].reset_index(drop=True)
+
+    compared = ledger[ledger['snapshot'].notna()]
+    differences = compared[(compared['balance'] - compared['snapshot']).abs() > eps * 100]
+    if not differences.empty:
+        logging.warning(" . replayed balances differ from %s snapshot balances on %s days (e.g. %s on %s); "
+            "balance changes without trade, deposit or withdrawal?", str(len(differences)),
+            str(differences['UTCTime'].nunique()), differences['asset'].iloc[-1], differences['UTCTime'].iloc[-1])
+    metrics.gauge('ledger_snapshot_differences', len(differences),
+        'replayed balances differing from the snapshot balances of the same day', account=account_name)
+
+    if db is not None:
+        wh.replace(db, 'ledger_daily_balances', ledger, account=account_name)
+    else:
+        hlp.to_csv(ledger, ledger_file, index=False)
+
+    logging.info(" - Finished replaying %s days of balances for account %s (anchor %s) -",
+        str(ledger['UTCTime'].nunique()), account_name, str(pd.to_datetime(anchor_time, unit='ms').date()))
+    return ledger
@@ -0,0 +1,221 @@
+"""metrics about requests and modules of a run
+
+**Goal**
+    - see where the time of a run actually goes: requests per endpoint, latency, weight, cool-off, rows and csv i/o
+
+**Procedure**
+    - API clients created by helper.get_client record every request (endpoint, status, latency, weight consumed)
+    - downloader functions are wrapped with 'timed' and record their runtime; everything recorded while
+      a function runs is labelled with its name (module)
+    - cool-off periods, rows downloaded / written and bytes of csv files read / written are counted
+    - at the end of a run, all metrics are written into a Prometheus textfile or a json report
+
+metrics are kept in memory of the process only; nothing is sent anywhere.
+"""
+import os
+import json
+import time
+import logging
+import threading
+import functools
+import contextvars
+
+# upper bounds of the latency histogram buckets in seconds
+latency_buckets = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+prefix = 'binance_reporting_'
+
+_lock = threading.Lock()
+_counters = {}      # (name, labels) => value
+_gauges = {}        # (name, labels) => value
+_histograms = {}    # (name, labels) => [bucket counts..., sum, count]
+_help = {}          # name => (type, description)
+_last_weight = {}   # (area, header) => last used weight seen
+
+# name of the module (downloader function) currently running
+current_module = contextvars.ContextVar('current_module', default='')
+
+
+def _labels(labels: dict):
+    """labels as sorted tuple, so they can be used as dict key; module is added automatically"""
+    labels = dict(labels)
+    labels.setdefault('module', current_module.get())
+    return tuple(sorted(labels.items()))
+
+
+def count(name: str, value: float = 1, description: str = '', **labels):
+    """add a value to a counter
+
+    :param str name: required; name of the counter, e.g. 'rows_written'
+    :param float value: optional; value to be added
+    :param str description: optional; description used in the Prometheus textfile
+    :param labels: optional; labels of the counter, e.g. endpoint='api/v3/klines'
+    """
+    with _lock:
+        _help.setdefault(name, ('counter', description))
+        key = (name, _labels(labels))
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def gauge(name: str, value: float, description: str = '', **labels):
+    """set a gauge to a value"""
+    with _lock:
+        _help.setdefault(name, ('gauge', description))
+        _gauges[(name, _labels(labels))] = value
+
+
+def observe(name: str, value: float, description: str = '', **labels):
+    """add an observation to a histogram (buckets see latency_buckets)"""
+    with _lock:
+        _help.setdefault(name, ('histogram', description))
+        key = (name, _labels(labels))
+        histogram = _histograms.setdefault(key, [0] * len(latency_buckets) + [0, 0])
+        for nbr, bound in enumerate(latency_buckets):
+            if value <= bound:
+                histogram[nbr] += 1
+        histogram[-2] += value
+        histogram[-1] += 1
+
+
+def reset():
+    """remove all recorded metrics"""
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
+        _last_weight.clear()
+
+
+def record_request(endpoint: str, status: int, seconds: float, headers: dict, area: str = ''):
+    """record one request to the exchange
+
+    the consumed weight is derived from the used-weight headers of the exchange (difference to the last response
+    of the same area; api and fapi report the same header, but have limits of their own)
+
+    :param str area: optional; area of the exchange, e.g. 'api' (default: first part of the endpoint)
+    """
+    area = area or endpoint.split('/')[0]
+    count('requests_total', 1, 'requests sent to the exchange', endpoint=endpoint, status=str(status))
+    observe('request_seconds', seconds, 'latency of requests to the exchange', endpoint=endpoint)
+    for header in ['x-mbx-used-weight-1m', 'x-sapi-used-ip-weight-1m']:
+        if headers is None or header not in headers:
+            continue
+        used = int(headers[header])
+        with _lock:
+            last = _last_weight.get((area, header), 0)
+            _last_weight[(area, header)] = used
+        # the exchange resets the weight every minute; a lower value means a new window
+        consumed = used - last if used >= last else used
+        count('weight_consumed', consumed, 'API weight consumed (derived from used-weight headers)', endpoint=endpoint)
+        gauge('weight_used', used, 'API weight used in the current minute', area=area, header=header)
+
+
+def record_sleep(seconds: float, reason: str = 'cool-off'):
+    """record time spent sleeping, e.g. waiting for the API to cool-off"""
+    count('sleep_seconds', seconds, 'seconds spent sleeping', reason=reason)
+
+
+def record_rows(kind: str, rows: int):
+    """record rows downloaded from the exchange or written to csv files / warehouse
+
+    :param str kind: required; 'downloaded' or 'written'
+    :param int rows: required; amount of rows
+    """
+    count('rows_' + kind, rows, 'rows ' + kind)
+
+
+def record_csv(direction: str, filename: str):
+    """record bytes of a csv file read or written
+
+    :param str direction: required; 'read' or 'written'
+    :param str filename: required; file read or written
+    """
+    if os.path.isfile(filename):
+        count('csv_bytes_' + direction, os.path.getsize(filename), 'bytes of csv files ' + direction)
+
+
+def timed(function):
+    """decorator recording runtime and runs of a module (e.g. downloader.trades)
+
+    everything recorded while the function runs is labelled with its name
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        token = current_module.set(function.__name__)
+        start = time.perf_counter()
+        status = 'ok'
+        try:
+            return function(*args, **kwargs)
+        except BaseException:
+            status = 'error'
+            raise
+        finally:
+            count('module_seconds', time.perf_counter() - start, 'runtime of modules in seconds')
+            count('module_runs_total', 1, 'runs of modules', status=status)
+            current_module.reset(token)
+    return wrapper
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        key + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"' for key, value in labels) + '}'
+
+
+def prometheus():
+    """all metrics in the Prometheus text format
+
+    :returns: str
+    """
+    lines = []
+    with _lock:
+        for name, (kind, description) in sorted(_help.items()):
+            lines.append('# HELP ' + prefix + name + ' ' + description)
+            lines.append('# TYPE ' + prefix + name + ' ' + kind)
+            for (key, labels), value in sorted(_counters.items()) + sorted(_gauges.items()):
+                if key == name:
+                    lines.append(prefix + name + _format_labels(labels) + ' ' + repr(float(value)))
+            for (key, labels), histogram in sorted(_histograms.items()):
+                if key != name:
+                    continue
+                for bound, value in zip(latency_buckets, histogram):
+                    lines.append(prefix + name + '_bucket' + _format_labels(labels + (('le', str(bound)),)) + ' ' + str(value))
+                lines.append(prefix + name + '_bucket' + _format_labels(labels + (('le', '+Inf'),)) + ' ' + str(histogram[-1]))
+                lines.append(prefix + name + '_sum' + _format_labels(labels) + ' ' + repr(float(histogram[-2])))
+                lines.append(prefix + name + '_count' + _format_labels(labels) + ' ' + str(histogram[-1]))
+    return '\n'.join(lines) + '\n'
+
+
+def report():
+    """all metrics as dictionary (used for the json report)
+
+    :returns: dict with counters, gauges and histograms
+    """
+    with _lock:
+        return {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'counters': [dict(labels, name=name, value=value) for (name, labels), value in sorted(_counters.items())],
+            'gauges': [dict(labels, name=name, value=value) for (name, labels), value in sorted(_gauges.items())],
+            'histograms': [
+                dict(labels, name=name, buckets=dict(zip([str(bound) for bound in latency_buckets], histogram[:-2])),
+                     sum=histogram[-2], count=histogram[-1])
+                for (name, labels), histogram in sorted(_histograms.items())]}
+
+
+def write(filename: str, format: str = 'prometheus'):
+    """write all metrics into a file
+
+    the file is replaced atomically, so a Prometheus node exporter never reads half-written files
+
+    :param str filename: required; name and location of the file
+    :param str format: optional; 'prometheus' (textfile) or 'json'
+    """
+    logging.debug("writing metrics to %s", filename)
+    if format == 'json':
+        content = json.dumps(report(), indent=2)
+    else:
+        content = prometheus()
+    with open(filename + '.tmp', 'w') as file:
+        file.write(content)
+    os.replace(filename + '.tmp', filename)
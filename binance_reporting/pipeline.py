@@ -0,0 +1,236 @@
+"""producer / consumer pipeline with bounded queues for downloads
+
+**Goal**
+    - network requests, pandas transformations and writing of files overlap, instead of running strictly in
+      sequence per trading pair or snapshot (while a big file is written, no request is in flight and vice versa)
+    - memory stays bounded: a slow stage blocks the stages before it (backpressure)
+    - see which stage limits a download (utilization and backpressure per stage)
+
+**Procedure**
+    - source (own thread): produces the items, e.g. downloads one trading pair after the other
+    - stages (own threads; several workers per stage possible): transform an item; None drops the item
+    - sink (thread calling run): consumes the items in order, e.g. writes files or the warehouse
+      (sqlite connections can only be used by the thread which created them)
+    - stages are connected by queues with a max. size; the first error stops the whole pipeline and is raised by run
+    - per stage: items, busy seconds, seconds blocked by the next stage (backpressure) and seconds waiting for
+      the previous stage; logged and recorded as metrics at the end
+
+.. note:: the size of the queues is taken from the section 'pipeline' of the config file (see configure)
+
+**Usage**
+
+    .. code:: python
+
+        line = pipeline.Pipeline('klines')
+        line.stage('process', process_pair, workers=4)
+        line.run(download_pairs(), write_pair)
+"""
+import time
+import queue
+import logging
+import threading
+import contextvars
+try:
+    from binance_reporting import metrics
+except:
+    import metrics
+
+queue_size = 4      # max. items waiting between two stages
+
+_end = object()     # marks the end of the items of a queue
+
+
+def configure(settings: dict):
+    """take over the settings of the config file (section 'pipeline')
+
+    :param dict settings: required; e.g. {'queue_size': 4}
+    """
+    global queue_size
+    queue_size = settings.get('queue_size', queue_size)
+
+
+class _Stats:
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.busy = 0.0         # seconds working on items
+        self.blocked = 0.0      # seconds waiting for space in the next queue (backpressure)
+        self.starved = 0.0      # seconds waiting for items of the previous stage
+        self.lock = threading.Lock()
+
+    def add(self, items=0, busy=0.0, blocked=0.0, starved=0.0):
+        with self.lock:
+            self.items += items
+            self.busy += busy
+            self.blocked += blocked
+            self.starved += starved
+
+
+class Pipeline:
+    """stages connected by bounded queues
+
+    :param str name: required; name used in logs and metrics, e.g. 'klines'
+    :param int maxsize: optional; max. items waiting between two stages (default: queue_size)
+    """
+
+    def __init__(self, name: str, maxsize: int = None):
+        self.name = name
+        self.maxsize = max(int(maxsize or queue_size), 1)
+        self.stages = []        # (name, function, workers)
+        self.stats = {}
+        self._stop = threading.Event()
+        self._error = None
+
+    def stage(self, name: str, function, workers: int = 1):
+        """add a stage between source and sink
+
+        :param str name: required; name of the stage, e.g. 'process'
+        :param function function: required; transforms one item; returns the item for the next stage (None = drop)
+        :param int workers: optional; threads of this stage (the order of the items is kept with one worker only)
+
+        :returns: the pipeline, so stages can be chained
+        """
+        self.stages.append((name, function, max(int(workers), 1)))
+        return self
+
+    def _fail(self, error):
+        if self._error is None:
+            self._error = error
+        self._stop.set()
+
+    def _put(self, target, item, stats):
+        """put an item into a queue; waits while the queue is full (backpressure), unless the pipeline stops"""
+        start = time.perf_counter()
+        while not self._stop.is_set():
+            try:
+                target.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        stats.add(blocked=time.perf_counter() - start)
+
+    def _get(self, source, stats):
+        """next item of a queue; None if the pipeline stops"""
+        start = time.perf_counter()
+        while not self._stop.is_set():
+            try:
+                item = source.get(timeout=0.1)
+                break
+            except queue.Empty:
+                continue
+        else:
+            item = None
+        stats.add(starved=time.perf_counter() - start)
+        return item
+
+    def _produce(self, source, target, consumers, stats):
+        try:
+            iterator = iter(source)
+            while not self._stop.is_set():
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    stats.add(busy=time.perf_counter() - start)
+                    break
+                stats.add(items=1, busy=time.perf_counter() - start)
+                self._put(target, item, stats)
+        except Exception as e:
+            logging.warning("pipeline %s: source failed: %s", self.name, str(e))
+            self._fail(e)
+        finally:
+            for nbr in range(consumers):
+                self._put(target, _end, stats)
+
+    def _work(self, function, source, target, stats, finished, consumers):
+        try:
+            while True:
+                item = self._get(source, stats)
+                if item is None or item is _end:
+                    break
+                start = time.perf_counter()
+                result = function(item)
+                stats.add(items=1, busy=time.perf_counter() - start)
+                if result is not None:
+                    self._put(target, result, stats)
+        except Exception as e:
+            logging.warning("pipeline %s: stage %s failed: %s", self.name, stats.name, str(e))
+            self._fail(e)
+        finally:
+            # the last worker of a stage passes the end on to the next stage
+            with stats.lock:
+                finished[0] += 1
+                last = finished[0] == stats.workers
+            if last:
+                for nbr in range(consumers):
+                    self._put(target, _end, stats)
+
+    def run(self, source, sink):
+        """run the pipeline until the source is exhausted and all items have reached the sink
+
+        :param iterable source: required; items to be processed, e.g. a generator downloading one pair after the other
+        :param function sink: required; consumes one item (runs in the thread calling run)
+
+        :returns: dict with the statistics per stage (items, busy, blocked, starved, utilization)
+        """
+        start = time.perf_counter()
+        self._stop.clear()
+        self._error = None
+        names = ['source'] + [name for name, function, workers in self.stages] + ['sink']
+        workers = [1] + [workers for name, function, workers in self.stages] + [1]
+        self.stats = {name: _Stats(name, count) for name, count in zip(names, workers)}
+        queues = [queue.Queue(maxsize=self.maxsize) for nbr in range(len(self.stages) + 1)]
+
+        threads = [threading.Thread(
+            target=contextvars.copy_context().run,
+            args=(self._produce, source, queues[0], workers[1], self.stats['source']),
+            name=self.name + '-source', daemon=True)]
+        for nbr, (name, function, count) in enumerate(self.stages):
+            finished = [0]
+            for worker in range(count):
+                threads.append(threading.Thread(
+                    target=contextvars.copy_context().run,
+                    args=(self._work, function, queues[nbr], queues[nbr + 1], self.stats[name], finished, workers[nbr + 2]),
+                    name=self.name + '-' + name + '-' + str(worker), daemon=True))
+        for thread in threads:
+            thread.start()
+
+        stats = self.stats['sink']
+        try:
+            while True:
+                item = self._get(queues[-1], stats)
+                if item is None or item is _end:
+                    break
+                item_start = time.perf_counter()
+                sink(item)
+                stats.add(items=1, busy=time.perf_counter() - item_start)
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            for thread in threads:
+                thread.join()
+
+        report = self._report(time.perf_counter() - start)
+        if self._error is not None:
+            raise self._error
+        return report
+
+    def _report(self, seconds):
+        """log and record the statistics of the stages"""
+        report = {}
+        for name, stats in self.stats.items():
+            utilization = stats.busy / (seconds * stats.workers) if seconds > 0 else 0.0
+            report[name] = {
+                'items': stats.items, 'busy': round(stats.busy, 3), 'blocked': round(stats.blocked, 3),
+                'starved': round(stats.starved, 3), 'utilization': round(utilization, 3)}
+            metrics.gauge('pipeline_utilization', utilization, 'share of time a pipeline stage was busy',
+                pipeline=self.name, stage=name)
+            metrics.count('pipeline_blocked_seconds', stats.blocked,
+                'seconds a pipeline stage waited for the next stage (backpressure)', pipeline=self.name, stage=name)
+            metrics.count('pipeline_items_total', stats.items, 'items processed by a pipeline stage',
+                pipeline=self.name, stage=name)
+        logging.info(" - pipeline %s finished in %s sec: %s -", self.name, str(round(seconds, 1)), ', '.join(
+            name + ' ' + str(round(100 * values['utilization'])) + '% busy / ' + str(values['blocked']) + ' sec blocked'
+            for name, values in report.items()))
+        return report
@@ -0,0 +1,484 @@
+"""request planner: API weight and duration of a run, estimated before the run is executed (dry-run)
+
+**Goal**
+    - know upfront how many requests, how much API weight and how much time a run needs
+      (e.g. the first download of 180 days of snapshots or of years of 1m klines), instead of finding out by cool-offs
+    - run the modules in an order, which keeps the cool-offs of the rate limits of the exchange short
+
+**Procedure**
+    - build: the work graph of a run is built out of the config and the local watermarks (last downloaded record per
+      account, module, trading pair and interval; csv files or warehouse): one task per
+      account x module x trading pair / time window, with the amount of requests, the API weight and the sleeps of the downloader
+    - estimate: the run is simulated against the rate limits of the exchange (weight per minute and area; cool-off as soon as
+      75% are used, as in helper.API_weight_check), which gives the duration including cool-offs
+    - order: modules using different rate limits (e.g. snapshots on sapi and trades on api) are interleaved,
+      so that one limit recovers while the other one is used (weight-optimal order)
+    - report: the plan is printed as table per account and module
+
+.. note:: the plan is an estimate. New trades, orders, deposits ... are not known before they are downloaded
+    (one page is assumed; bound 'min'); pairs without local klines are assumed to be traded since the start of the exchange
+    (bound 'max'). Only the lists of trading pairs (and the 24h tickers of the kline universe) are downloaded for planning.
+"""
+import os
+import json
+import math
+import time
+import logging
+import pandas as pd
+try:
+    from binance_reporting import helper as hlp
+    from binance_reporting import warehouse as wh
+    from binance_reporting import universe
+except:
+    import helper as hlp
+    import warehouse as wh
+    import universe
+
+exchange_start_ms = 1498870800000   # 1.July 2017 GMT; same start as downloader.deposits / withdrawals
+transfer_window_ms = 7776000000     # 90 days per request for deposits and withdrawals
+kline_page = 1000                   # klines per request (see downloader.klines)
+futures_start_ms = 1567900800000    # same as downloader.futures_start_ms
+futures_income_window_ms = 604800000    # 7 days per request for the futures income
+weight_threshold = 0.75             # cool-off threshold of helper.API_weight_check
+cool_off = 60                       # seconds of the first cool-off; the weight of the exchange is reset every minute
+
+task_columns = ['account', 'module', 'target', 'area', 'endpoint', 'requests', 'weight', 'sleep', 'bound']
+
+# order of the modules within a run (see start.run)
+module_order = [
+    'ticker', 'balances', 'trades', 'cost_basis', 'orders', 'open_orders', 'deposits', 'withdrawals',
+    'daily_account_snapshots', 'ledger', 'prices', 'klines']
+
+# modules, which need other modules of the same account to be finished first
+dependencies = {
+    'cost_basis': ['trades'],
+    'ledger': ['trades', 'deposits', 'withdrawals', 'daily_account_snapshots']}
+
+
+def _task(account, module, target, area, endpoint, requests, sleep=0, bound='exact'):
+    weight = requests * hlp.endpoint_weights.get((area, endpoint), 1)
+    return [account, module, target, area, endpoint, requests, weight, sleep, bound]
+
+
+def _connection(account, module):
+    """ping of a new client and closing of the connection (listen key)"""
+    return _task(account, module, 'connection', 'api', 'ping', 3)
+
+
+def _last_line(filename):
+    """last non-empty line of a text file, without reading the whole file"""
+    with open(filename, 'rb') as file:
+        file.seek(0, os.SEEK_END)
+        position = file.tell()
+        block = b''
+        while position > 0:
+            size = min(4096, position)
+            position -= size
+            file.seek(position)
+            block = file.read(size) + block
+            lines = [line for line in block.splitlines() if line.strip()]
+            if len(lines) > 1 or (lines and position == 0):
+                return lines[-1].decode()
+    return ''
+
+
+def _csv_watermarks(filename, column, group_by):
+    """last recorded value of column per group out of a csv file"""
+    if not os.path.isfile(filename):
+        return {}
+    data = hlp.read_csv(filename)
+    if data.empty or column not in data.columns:
+        return {}
+    return data.groupby(group_by)[column].max().to_dict()
+
+
+def _last_kline(dir, interval, pair, db=None):
+    """open time (ms) of the last downloaded candle of a pair or None"""
+    if db is not None:
+        return wh.watermark(db, 'klines', 'open time ux', interval=interval, pair=pair)
+    filename = dir + '/' + interval + '/history_' + interval + '_klines_' + pair + '.csv'
+    if not os.path.isfile(filename):
+        return None
+    try:
+        return int(float(_last_line(filename).split(',')[6]))
+    except (IndexError, ValueError):
+        return None
+
+
+def _symbols(patterns, fallback):
+    """trading pairs of the exchange; local pairs in case the exchange can not be reached"""
+    try:
+        return hlp.get_symbols(patterns)
+    except Exception as e:
+        logging.warning("list of trading pairs not available (%s); planning with local pairs only", str(e))
+        return sorted(fallback)
+
+
+def _futures_tasks(account, module, watermarks, symbols_file, now_ms):
+    """futures trades / orders: income since the last scan for the symbols (see downloader._futures_symbols),
+    one page per symbol"""
+    state = {'scanned_until': futures_start_ms, 'symbols': []}
+    if os.path.isfile(symbols_file):
+        with open(symbols_file) as file:
+            state = json.load(file)
+    endpoint = 'userTrades' if module == 'trades' else 'allOrders'
+    tasks = [_connection(account, module), _task(account, module, 'positions', 'fapi', 'account', 1)]
+    start_ms = state['scanned_until']
+    while start_ms < now_ms:
+        target = pd.to_datetime(start_ms, unit='ms').strftime('%Y-%m-%d')
+        tasks.append(_task(account, module, target, 'fapi', 'income', 1, 0, 'min'))
+        start_ms += futures_income_window_ms + 1
+    for symbol in sorted(set(state['symbols']) | set(watermarks)):
+        tasks.append(_task(account, module, symbol, 'fapi', endpoint, 1, 0, 'min'))
+    return tasks
+
+
+def _trades_tasks(account, module, account_type, pairs, watermarks):
+    """trades / orders: one request for the last record per pair and one page per pair with history"""
+    endpoint = 'myTrades' if module == 'trades' else 'allOrders'
+    tasks = [_connection(account, module)]
+    for pair in pairs:
+        if pair in watermarks:
+            tasks.append(_task(account, module, pair, 'api', endpoint, 2, 1, 'min'))
+        else:
+            tasks.append(_task(account, module, pair, 'api', endpoint, 1, 0, 'min'))
+    return tasks
+
+
+def _transfer_tasks(account, module, account_type, last_ms, now_ms):
+    """deposits / withdrawals: one request per 90 days since the last recorded transfer"""
+    if account_type == 'FUTURES':
+        return []
+    endpoint = 'capital/deposit/hisrec' if module == 'deposits' else 'capital/withdraw/history'
+    start_ms = exchange_start_ms if last_ms is None else int(last_ms) + 1
+    tasks = [_connection(account, module)]
+    while start_ms < now_ms:
+        target = pd.to_datetime(start_ms, unit='ms').strftime('%Y-%m-%d')
+        tasks.append(_task(account, module, target, 'sapi', endpoint, 1, 0, 'min'))
+        start_ms += transfer_window_ms
+    return tasks
+
+
+def _snapshot_tasks(account, last_ms, assets, now_ms, days_max=180, days_per_request=30):
+    """daily snapshots: one request per window of days, prices of the assets per day"""
+    daily_ms = 86400000
+    start_ms = now_ms - days_max * daily_ms if last_ms is None else int(last_ms) + 1
+    if now_ms - start_ms < daily_ms:
+        return []
+    tasks = [_connection(account, 'daily_account_snapshots')]
+    while start_ms < now_ms:
+        days = min(days_per_request, math.ceil((now_ms - start_ms) / daily_ms))
+        target = pd.to_datetime(start_ms, unit='ms').strftime('%Y-%m-%d')
+        tasks.append(_task(account, 'daily_account_snapshots', target, 'sapi', 'accountSnapshot', 1))
+        # USDT price of every asset of a snapshot day (one daily kline per pair; see valuation)
+        tasks.append(_task(
+            account, 'daily_account_snapshots', target, 'api', 'klines', days * assets, 0,
+            'exact' if assets else 'min'))
+        start_ms += days_per_request * daily_ms
+    return tasks
+
+
+def _kline_tasks(dir, intervals, pairs, now_ms, db=None):
+    """klines: pages of 1000 candles per pair and interval since the last downloaded candle"""
+    tasks = [_task('', 'klines', 'connection', 'api', 'ping', 1)]
+    for interval in intervals:
+        step = hlp.kline_intervals_ms[interval]
+        for pair in pairs:
+            last_ms = _last_kline(dir, interval, pair, db)
+            bound = 'max' if last_ms is None else 'exact'
+            start_ms = exchange_start_ms if last_ms is None else last_ms + 1
+            pages = max(now_ms - start_ms, 0) // step // kline_page + 1
+            tasks.append(_task('', 'klines', interval + ' ' + pair, 'api', 'klines', pages, 0, bound))
+    return tasks
+
+
+def build(config, modules, data_dir=None, db=None, now_ms=None):
+    """work graph of a run: one task per account x module x trading pair / time window
+
+    :param dict config: required; configuration as read by helper.read_config
+    :param dict modules: required; modules of the run, e.g. {'balances': True, 'klines': False}
+    :param str data_dir: optional; directory of the downloaded data (default: current directory)
+    :param object db: optional; warehouse connection; if provided, the watermarks are read from the warehouse
+    :param int now_ms: optional; time of the run in ms (default: now)
+
+    :returns: dataframe with one line per task (see task_columns)
+    """
+    data_dir = data_dir or os.getcwd()
+    now_ms = now_ms or int(time.time() * 1000)
+    accounts = config['accounts']
+    snapshot_config = config.get('daily_account_snapshots', {})
+    tasks = []
+
+    if modules.get('ticker', False):
+        # the ticker sends the balances of all accounts at once
+        for account, account_details in accounts.items():
+            area = 'fapi' if account_details['type'] == 'FUTURES' else 'api'
+            tasks.append(_task('', 'ticker', account, 'api', 'ping', 3))
+            tasks.append(_task('', 'ticker', account, 'api', 'ticker/price', 1))
+            tasks.append(_task('', 'ticker', account, area, 'account', 1))
+
+    trading_pairs = []
+    if modules.get('trades', False) or modules.get('orders', False):
+        local_pairs = set()
+        for account, account_details in accounts.items():
+            file_directory = data_dir + "/" + account_details['dir'] + "/"
+            local_pairs.update(_csv_watermarks(file_directory + "trades_" + account + ".csv", 'time', 'symbol'))
+        trading_pairs = _symbols('USDT', local_pairs)
+
+    for account, account_details in accounts.items():
+        account_type = account_details['type']
+        file_directory = data_dir + "/" + account_details['dir'] + "/"
+
+        if modules.get('balances', False):
+            area = 'fapi' if account_type == 'FUTURES' else 'api'
+            tasks.append(_connection(account, 'balances'))
+            tasks.append(_task(account, 'balances', 'prices', 'api', 'ticker/price', 1))
+            tasks.append(_task(account, 'balances', 'balances', area, 'account', 1))
+
+        for module, table, column in [('trades', 'trades', 'time'), ('orders', 'orders', 'time')]:
+            if not modules.get(module, False):
+                continue
+            if db is not None:
+                watermarks = wh.watermarks(db, table, column, 'symbol', account=account)
+                watermarks = dict(zip(watermarks['symbol'], watermarks[column]))
+            else:
+                watermarks = _csv_watermarks(file_directory + module + "_" + account + ".csv", column, 'symbol')
+            if account_type == 'FUTURES':
+                tasks.extend(_futures_tasks(
+                    account, module, watermarks, file_directory + 'futures_symbols_' + account + '.json', now_ms))
+            else:
+                tasks.extend(_trades_tasks(account, module, account_type, trading_pairs, watermarks))
+
+        if modules.get('cost_basis', False) and account_type != 'FUTURES':
+            # current prices for the valuation of the open positions
+            tasks.append(_task(account, 'cost_basis', 'prices', 'api', 'ticker/price', 1))
+
+        if modules.get('open_orders', False):
+            tasks.append(_connection(account, 'open_orders'))
+            area = 'fapi' if account_type == 'FUTURES' else 'api'
+            tasks.append(_task(account, 'open_orders', 'open orders', area, 'openOrders', 1))
+
+        for module in ['deposits', 'withdrawals']:
+            if not modules.get(module, False):
+                continue
+            last_ms = None
+            filename = file_directory + module + "_" + account + ".csv"
+            if db is not None:
+                last_ms = wh.watermark(db, module, 'insertTime', account=account)
+            elif os.path.isfile(filename):
+                transfers = hlp.read_csv(filename)
+                if not transfers.empty and 'insertTime' in transfers.columns:
+                    last_ms = transfers['insertTime'].max()
+            if isinstance(last_ms, str):
+                # insertTime of withdrawals is a date string
+                last_ms = int(pd.Timestamp(last_ms).value // 1000000)
+            tasks.extend(_transfer_tasks(account, module, account_type, last_ms, now_ms))
+
+        if modules.get('daily_account_snapshots', False):
+            last_ms = None
+            assets = 0
+            filename = file_directory + "snapshot_daily_" + account + "_balances.csv"
+            if db is not None:
+                last_ms = wh.watermark(db, 'snapshot_daily_balances', 'updateTime', account=account)
+                if last_ms is not None:
+                    assets = len(wh.read(db, 'snapshot_daily_balances', ['asset'], account=account, updateTime=last_ms))
+            elif os.path.isfile(filename):
+                snapshots = hlp.read_csv(filename)
+                if not snapshots.empty:
+                    last_ms = snapshots['updateTime'].max()
+                    assets = int((snapshots['updateTime'] == last_ms).sum())
+            tasks.extend(_snapshot_tasks(
+                account, last_ms, assets, now_ms,
+                snapshot_config.get('snapshot_days_max', 180), snapshot_config.get('snapshot_days_per_request', 30)))
+
+        if modules.get('ledger', False) and account_type != 'FUTURES':
+            # one snapshot is downloaded as anchor, as long as there is neither a local snapshot nor a stored anchor
+            if db is not None:
+                anchored = wh.watermark(db, 'snapshot_daily_assets', 'updateTime', account=account) is not None
+            else:
+                anchored = os.path.isfile(file_directory + "snapshot_daily_" + account + "_assets.csv")
+            anchored = anchored or os.path.isfile(file_directory + "ledger_" + account + "_anchor.json")
+            if not anchored and not modules.get('daily_account_snapshots', False):
+                tasks.append(_connection(account, 'ledger'))
+                tasks.append(_task(account, 'ledger', 'anchor', 'sapi', 'accountSnapshot', 1))
+            else:
+                # replay of the local data only
+                tasks.append(_task(account, 'ledger', 'replay', 'api', 'none', 0))
+
+    if modules.get('prices', False):
+        tasks.append(_connection('', 'prices'))
+        tasks.append(_task('', 'prices', 'prices', 'api', 'ticker/price', 1))
+
+    if modules.get('klines', False):
+        klines_config = config['klines']
+        klines_dir = data_dir + '/' + klines_config['dir']
+        local_pairs = set()
+        for interval in klines_config['intervals']:
+            prefix = 'history_' + interval + '_klines_'
+            if os.path.isdir(klines_dir + '/' + interval):
+                local_pairs.update(
+                    filename[len(prefix):-4] for filename in os.listdir(klines_dir + '/' + interval)
+                    if filename.startswith(prefix) and filename.endswith('.csv'))
+        pairs = _symbols(klines_config['symbols'], local_pairs)
+        universe_config = klines_config.get('universe', {})
+        if universe_config.get('activate', False):
+            selected = universe.load(klines_dir + '/universe.json', universe_config)
+            if selected is None:
+                # the selection is re-evaluated in the run; planned with the pairs selected now
+                tasks.append(_task('', 'klines', 'universe', 'api', 'ticker/24hr', 1))
+                try:
+                    selected = universe.rank(hlp.get_client().get_ticker(), hlp.get_catalog(), pairs, universe_config)
+                except Exception as e:
+                    logging.warning("24h tickers not available (%s); planning with local pairs only", str(e))
+                    selected = sorted(local_pairs)
+            pairs = [pair for pair in pairs if pair in set(selected)] if pairs else selected
+        tasks.extend(_kline_tasks(klines_dir, klines_config['intervals'], pairs, now_ms, db))
+
+    plan = pd.DataFrame(tasks, columns=task_columns)
+    # tasks of every account and module in the order of a run
+    plan['order'] = plan['module'].map(module_order.index)
+    plan = plan.sort_values(by=['order'], kind='stable').drop(columns=['order']).reset_index(drop=True)
+    logging.info(" - Plan with %s tasks and %s requests -", str(len(plan)), str(plan['requests'].sum()))
+    return plan
+
+
+def units(plan):
+    """modules of the plan, which are executed as a whole: list of (account, module) in the order of the plan"""
+    return list(dict.fromkeys(zip(plan['account'], plan['module'])))
+
+
+def _new_state():
+    return {'clock': 0.0, 'window_end': 60.0, 'used': {}, 'requests': 0.0, 'sleep': 0.0, 'cool_off': 0.0, 'cool_offs': 0}
+
+
+def _simulate(state, tasks, latency):
+    """execute tasks [(area, requests, weight, sleep), ...] on a simulated clock with per minute rate limits"""
+    for area, requests, weight, sleep in tasks:
+        if requests <= 0:
+            continue
+        threshold = hlp.rate_limits[area] * weight_threshold
+        weight_per_request = weight / requests
+        duration = latency + sleep / requests
+        remaining = requests
+        while remaining > 0:
+            used = state['used'].get(area, 0.0)
+            if used > threshold:
+                # cool-off until the weight of the exchange is reset
+                state['clock'] += cool_off
+                state['cool_off'] += cool_off
+                state['cool_offs'] += 1
+            if state['clock'] >= state['window_end']:
+                state['used'] = {}
+                state['window_end'] += math.ceil((state['clock'] - state['window_end'] + 1e-9) / 60) * 60
+                continue
+            by_time = max(math.ceil((state['window_end'] - state['clock']) / duration), 1)
+            by_weight = max(math.floor((threshold - used) / weight_per_request) + 1, 1)
+            amount = min(remaining, by_time, by_weight)
+            state['used'][area] = used + amount * weight_per_request
+            state['clock'] += amount * duration
+            state['requests'] += amount * latency
+            state['sleep'] += amount * (duration - latency)
+            remaining -= amount
+    return state
+
+
+def _unit_tasks(plan):
+    """tasks per unit as tuples (area, requests, weight, sleep), aggregated per area"""
+    grouped = plan.groupby(['account', 'module', 'area'], sort=False)[['requests', 'weight', 'sleep']].sum()
+    unit_tasks = {}
+    for (account, module, area), row in grouped.iterrows():
+        unit_tasks.setdefault((account, module), []).append((area, row['requests'], row['weight'], row['sleep']))
+    return unit_tasks
+
+
+def estimate(plan, order=None, latency=0.3):
+    """duration of a plan, simulated against the rate limits of the exchange
+
+    :param dataframe plan: required; plan as built by build
+    :param list order: optional; order of the units (account, module); default: order of the plan
+    :param float latency: optional; seconds per request
+
+    :returns: dict with requests, weight per area and the seconds for requests, sleeps, cool-offs and in total
+    """
+    unit_tasks = _unit_tasks(plan)
+    state = _new_state()
+    for unit in (order or units(plan)):
+        _simulate(state, unit_tasks[unit], latency)
+    return {
+        'requests': int(plan['requests'].sum()),
+        'weight': {area: int(weight) for area, weight in plan.groupby('area')['weight'].sum().items()},
+        'request_sec': round(state['requests'], 1),
+        'sleep_sec': round(state['sleep'], 1),
+        'cool_off_sec': round(state['cool_off'], 1),
+        'cool_offs': state['cool_offs'],
+        'total_sec': round(state['clock'], 1)}
+
+
+def order(plan, latency=0.3):
+    """weight-optimal order of the units (account, module) of a plan
+
+    **Procedure**
+        - greedy: next unit is the one adding the least cool-off time, given the weight used so far
+          (ties are kept in the order of the plan)
+        - units using a rate limit, which is exhausted, are postponed until the other units gave it time to recover
+        - dependencies are respected (e.g. cost_basis after the trades of the same account)
+
+    :param dataframe plan: required; plan as built by build
+    :param float latency: optional; seconds per request
+
+    :returns: list of (account, module)
+    """
+    unit_tasks = _unit_tasks(plan)
+    pending = units(plan)
+    done = []
+    state = _new_state()
+    while pending:
+        best = None
+        for unit in pending:
+            account, module = unit
+            if any((account, required) in pending for required in dependencies.get(module, [])):
+                continue
+            trial = _simulate({**state, 'used': dict(state['used'])}, unit_tasks[unit], latency)
+            if best is None or trial['cool_off'] < best[1]['cool_off']:
+                best = (unit, trial)
+        pending.remove(best[0])
+        done.append(best[0])
+        state = best[1]
+    return done
+
+
+def report(plan, order=None, latency=0.3):
+    """plan as text table: requests, weight per area, sleeps and bound per account and module, and the totals
+
+    :param dataframe plan: required; plan as built by build
+    :param list order: optional; order of the units (account, module); default: order of the plan
+    :param float latency: optional; seconds per request
+
+    :returns: str
+    """
+    order = order or units(plan)
+    summary = estimate(plan, order, latency)
+    table = plan.pivot_table(
+        index=['account', 'module'], columns='area', values='weight', aggfunc='sum', fill_value=0)
+    table.columns = ['weight ' + area for area in table.columns]
+    grouped = plan.groupby(['account', 'module'])
+    table.insert(0, 'tasks', grouped.size())
+    table.insert(1, 'requests', grouped['requests'].sum())
+    table['sleep sec'] = grouped['sleep'].sum()
+    table['bound'] = grouped['bound'].agg(lambda bounds: ','.join(sorted(set(bounds) - {'exact'})) or 'exact')
+    table = table.reindex(order)
+    table.index = [(account or '-') + ' ' + module for account, module in table.index]
+    lines = [
+        table.to_string(),
+        '',
+        'requests: ' + str(summary['requests']) + '; weight: '
+        + ', '.join(area + ' ' + str(weight) for area, weight in summary['weight'].items()),
+        'estimated duration: ' + _duration(summary['total_sec'])
+        + ' (requests ' + _duration(summary['request_sec']) + ', sleeps ' + _duration(summary['sleep_sec'])
+        + ', ' + str(summary['cool_offs']) + ' cool-offs ' + _duration(summary['cool_off_sec']) + ')']
+    return '\n'.join(lines)
+
+
+def _duration(seconds):
+    seconds = int(round(seconds))
+    return '%d:%02d:%02d' % (seconds // 3600, seconds % 3600 // 60, seconds % 60)
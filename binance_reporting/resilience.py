@@ -0,0 +1,250 @@
+"""resilient execution of requests to the exchange
+
+**Goal**
+    - one consistent handling of failed requests for all downloads, instead of endless loops, stale data or silently
+      skipped trading pairs
+    - transient failures (timeouts, lost connections, 5xx, rate limits) are retried and the run continues at full speed
+    - no retry storms: retries are limited per endpoint and a failing area of the exchange is not hammered any further
+
+**Procedure**
+    - every request of the API clients (see helper.get_client) is executed by execute
+    - transient failures are retried with exponential backoff and full jitter (max_retries, base_delay, max_delay)
+    - 429 (too many requests) and 418 (IP banned): all requests of the area (api, sapi, fapi) wait until the time given
+      in the header Retry-After, instead of every thread hitting the limit again
+    - retry budget per endpoint: retries are limited to a share of the requests of the endpoint (budget_ratio)
+      plus a minimum (budget_min); once the budget is used up, failures are raised without retry
+    - circuit breaker per area: after failure_threshold failed requests in a row, requests of this area fail
+      immediately (CircuitOpenError) for reset_timeout seconds; afterwards one trial request decides, whether
+      the circuit is closed again
+    - permanent errors (e.g. invalid symbol or API key) are raised immediately and do not open the circuit
+
+.. note:: the settings are taken from the section 'resilience' of the config file (see configure)
+"""
+import time
+import random
+import logging
+import threading
+try:
+    from binance_reporting import metrics
+except:
+    import metrics
+
+max_retries = 5             # retries per request
+base_delay = 0.5            # seconds before the first retry; doubled for every further retry
+max_delay = 30              # max. seconds between two retries
+budget_ratio = 0.1          # retries per endpoint: share of its requests ...
+budget_min = 10             # ... plus this amount
+failure_threshold = 5       # failed requests in a row opening the circuit of an area
+reset_timeout = 30          # seconds an open circuit fails requests before a trial request is let through
+
+# error codes of the exchange, which are worth a retry
+transient_codes = {
+    -1000,  # unknown error
+    -1001,  # internal error; unable to process the request
+    -1003,  # too many requests
+    -1006,  # unexpected response from the message bus
+    -1007,  # timeout waiting for response from the backend server
+    -1021,  # timestamp outside of the recvWindow
+}
+
+_lock = threading.Lock()
+_breakers = {}          # area => CircuitBreaker
+_blocked_until = {}     # area => time until requests have to wait (Retry-After)
+_budgets = {}           # endpoint => [requests, retries]
+
+
+class CircuitOpenError(Exception):
+    """requests of an area are not sent, because its circuit is open"""
+
+    def __init__(self, area, seconds):
+        self.area = area
+        self.seconds = seconds
+        super().__init__("circuit of area " + area + " is open for another " + str(round(seconds, 1)) + " sec")
+
+
+class CircuitBreaker:
+    """circuit breaker of one area of the exchange (closed => open => half-open => closed)
+
+    :param str area: required; e.g. 'api', 'sapi' or 'fapi'
+    """
+
+    def __init__(self, area):
+        self.area = area
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial = False      # a trial request is running (half-open)
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """raise CircuitOpenError, if the request must not be sent"""
+        with self.lock:
+            if self.state == 'closed':
+                return
+            remaining = self.opened_at + reset_timeout - time.monotonic()
+            if self.state == 'open' and remaining <= 0:
+                self.state = 'half-open'
+                self.trial = False
+            if self.state == 'half-open' and not self.trial:
+                self.trial = True
+                logging.info("circuit of area %s half-open; sending trial request", self.area)
+                return
+            raise CircuitOpenError(self.area, max(remaining, 0))
+
+    def success(self):
+        with self.lock:
+            if self.state != 'closed':
+                logging.info("circuit of area %s closed again", self.area)
+                metrics.gauge('circuit_open', 0, 'circuit breaker of an area open (1) or closed (0)', area=self.area)
+            self.state = 'closed'
+            self.failures = 0
+            self.trial = False
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == 'half-open' or (self.state == 'closed' and self.failures >= failure_threshold):
+                logging.warning(
+                    "circuit of area %s opened after %s failed requests in a row; requests fail for %s sec",
+                    self.area, str(self.failures), str(reset_timeout))
+                metrics.count('circuit_opened_total', 1, 'circuit breaker of an area opened', area=self.area)
+                metrics.gauge('circuit_open', 1, 'circuit breaker of an area open (1) or closed (0)', area=self.area)
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+                self.trial = False
+
+
+def configure(settings: dict):
+    """take over the settings of the config file (section 'resilience')
+
+    :param dict settings: required; e.g. {'max_retries': 5, 'base_delay': 0.5}
+    """
+    global max_retries, base_delay, max_delay, budget_ratio, budget_min, failure_threshold, reset_timeout
+    max_retries = settings.get('max_retries', max_retries)
+    base_delay = settings.get('base_delay', base_delay)
+    max_delay = settings.get('max_delay', max_delay)
+    budget_ratio = settings.get('budget_ratio', budget_ratio)
+    budget_min = settings.get('budget_min', budget_min)
+    failure_threshold = settings.get('failure_threshold', failure_threshold)
+    reset_timeout = settings.get('reset_timeout', reset_timeout)
+
+
+def reset():
+    """close all circuits and forget blocks and budgets"""
+    with _lock:
+        _breakers.clear()
+        _blocked_until.clear()
+        _budgets.clear()
+
+
+def breaker(area):
+    """circuit breaker of an area"""
+    with _lock:
+        if area not in _breakers:
+            _breakers[area] = CircuitBreaker(area)
+        return _breakers[area]
+
+
+def classify(error):
+    """kind of a failed request: 'rate_limit', 'transient' or 'permanent'"""
+    import requests
+    from binance.exceptions import BinanceAPIException, BinanceRequestException
+
+    if isinstance(error, BinanceAPIException):
+        if error.status_code in (418, 429) or error.code == -1003:
+            return 'rate_limit'
+        if error.status_code >= 500 or error.code in transient_codes:
+            return 'transient'
+        return 'permanent'
+    if isinstance(error, BinanceRequestException):
+        # invalid (e.g. truncated) response
+        return 'transient'
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                          requests.exceptions.ChunkedEncodingError)):
+        return 'transient'
+    return 'permanent'
+
+
+def _retry_after(error):
+    """seconds to wait according to the header Retry-After (default: until the next minute)"""
+    response = getattr(error, 'response', None)
+    try:
+        return float(response.headers['Retry-After'])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return 60 - time.time() % 60 + 1
+
+
+def _wait_blocked(area):
+    """wait until a rate limit block of the area is over"""
+    with _lock:
+        seconds = _blocked_until.get(area, 0) - time.monotonic()
+    if seconds > 0:
+        logging.warning("rate limit of area %s reached; waiting %s sec (Retry-After)", area, str(round(seconds, 1)))
+        time.sleep(seconds)
+        metrics.record_sleep(seconds, 'retry-after')
+
+
+def _block(area, seconds):
+    with _lock:
+        _blocked_until[area] = max(_blocked_until.get(area, 0), time.monotonic() + seconds)
+
+
+def _take_retry(endpoint):
+    """use one retry of the budget of an endpoint; False if the budget is used up"""
+    with _lock:
+        requests, retries = _budgets.setdefault(endpoint, [0, 0])
+        if retries >= budget_min + budget_ratio * requests:
+            return False
+        _budgets[endpoint][1] += 1
+        return True
+
+
+def backoff(attempt):
+    """seconds before a retry: exponential backoff with full jitter"""
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+def execute(area, endpoint, send):
+    """send a request; retry transient failures
+
+    :param str area: required; area of the exchange with its own rate limit, e.g. 'api', 'sapi' or 'fapi'
+    :param str endpoint: required; e.g. 'api/v3/myTrades'
+    :param function send: required; sends the request once and returns the result (raises in case of a failure)
+
+    :returns: result of send
+    """
+    circuit = breaker(area)
+    attempt = 0
+    while True:
+        _wait_blocked(area)
+        circuit.allow()
+        with _lock:
+            _budgets.setdefault(endpoint, [0, 0])[0] += 1
+        try:
+            result = send()
+        except Exception as e:
+            kind = classify(e)
+            if kind == 'permanent':
+                # the exchange answered; the area is fine
+                circuit.success()
+                raise
+            if kind == 'rate_limit':
+                # the exchange answered; the area is fine, but all requests of the area have to wait
+                circuit.success()
+                _block(area, _retry_after(e))
+            else:
+                circuit.failure()
+            if attempt >= max_retries or not _take_retry(endpoint):
+                metrics.count('request_failures_total', 1, 'requests failed after all retries', endpoint=endpoint, reason=kind)
+                logging.warning("request %s failed after %s retries: %s", endpoint, str(attempt), str(e))
+                raise
+            delay = backoff(attempt) if kind == 'transient' else 0
+            attempt += 1
+            metrics.count('request_retries_total', 1, 'retries of failed requests', endpoint=endpoint, reason=kind)
+            logging.info("request %s failed (%s); retry %s in %s sec", endpoint, kind, str(attempt), str(round(delay, 2)))
+            if delay > 0:
+                time.sleep(delay)
+                metrics.record_sleep(delay, 'retry')
+            continue
+        circuit.success()
+        return result
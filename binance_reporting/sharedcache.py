@@ -0,0 +1,170 @@
+"""market data shared by all processes on a host (host-wide cache)
+
+**Goal**
+    - several runs at the same time (e.g. cron jobs with different configs) download the same market data:
+      current prices (tickers), exchange info and historical daily klines for the valuation; the in-memory caches
+      of the helper module only help within one process
+    - only one process downloads an item within its time to live; all others read it from the cache
+    - the cache does not grow without limit
+
+**Procedure**
+    - one sqlite file per host (default: binance_reporting_cache.sqlite in the temp directory), read and written
+      by all processes; sqlite locks the file, so processes never see half written items
+    - every item has a time to live (ttl); expired items are downloaded again
+    - the first process missing an item takes a lease on it and downloads it; other processes wait until the item
+      is in the cache (or until the lease expired, e.g. because the downloading process died)
+    - if the items take more than max_mb, the least recently used items are removed (expired items first)
+
+.. note:: the cache is activated in the section 'shared_cache' of the config file (see configure)
+
+**Usage**
+
+    .. code:: python
+
+        tickers = sharedcache.get('tickers', 10, client.get_all_tickers)
+"""
+import os
+import json
+import time
+import sqlite3
+import logging
+import tempfile
+import threading
+try:
+    from binance_reporting import metrics
+except:
+    import metrics
+
+active = False
+filename = os.path.join(tempfile.gettempdir(), 'binance_reporting_cache.sqlite')
+max_mb = 64             # max. size of all items; least recently used items are removed above
+lease = 30              # seconds other processes wait for a process downloading an item
+ttl = {                 # seconds items are re-used per kind of market data
+    'tickers': 10,
+    'exchange_info': 3600,
+    'klines': 2592000}  # klines of closed days do not change any more
+
+_local = threading.local()      # sqlite connections can only be used by the thread which created them
+
+
+def configure(settings: dict):
+    """take over the settings of the config file (section 'shared_cache')
+
+    :param dict settings: required; e.g. {'activate': True, 'max_mb': 64, 'ttl': {'tickers': 10}}
+    """
+    global active, filename, max_mb, lease
+    active = settings.get('activate', active)
+    filename = settings.get('file') or filename
+    max_mb = settings.get('max_mb', max_mb)
+    lease = settings.get('lease', lease)
+    ttl.update(settings.get('ttl') or {})
+
+
+def _connection():
+    """connection of the calling thread to the cache file; creates the tables if needed"""
+    connection = getattr(_local, 'connection', None)
+    # forked processes (e.g. process pools) open their own connection
+    if connection is not None and _local.key == (filename, os.getpid()):
+        return connection
+    connection = sqlite3.connect(filename, timeout=60, isolation_level=None)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("CREATE TABLE IF NOT EXISTS items "
+        "(key TEXT PRIMARY KEY, value BLOB, size INTEGER, expires REAL, accessed REAL)")
+    connection.execute("CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, owner TEXT, until REAL)")
+    _local.connection = connection
+    _local.key = (filename, os.getpid())
+    return connection
+
+
+def _lookup(connection, key, owner):
+    """cached value of an item; takes the lease, if the item is missing and nobody else downloads it
+
+    :returns: (found, value); found is None, if another process is downloading the item
+    """
+    now = time.time()
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        row = connection.execute("SELECT value, expires FROM items WHERE key = ?", (key,)).fetchone()
+        if row is not None and row[1] > now:
+            connection.execute("UPDATE items SET accessed = ? WHERE key = ?", (now, key))
+            return True, row[0]
+        row = connection.execute("SELECT owner, until FROM leases WHERE key = ?", (key,)).fetchone()
+        if row is not None and row[0] != owner and row[1] > now:
+            return None, None
+        connection.execute("INSERT OR REPLACE INTO leases VALUES (?, ?, ?)", (key, owner, now + lease))
+        return False, None
+    finally:
+        connection.execute("COMMIT")
+
+
+def _store(connection, key, value, seconds):
+    """write an item, release its lease and remove items above max_mb"""
+    now = time.time()
+    size = len(value)
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        connection.execute("INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?, ?)", (key, value, size, now + seconds, now))
+        connection.execute("DELETE FROM leases WHERE key = ?", (key,))
+        total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM items").fetchone()[0]
+        limit = max_mb * 1024 * 1024
+        if total > limit:
+            evicted = 0
+            for other, other_size in connection.execute(
+                    "SELECT key, size FROM items WHERE key != ? ORDER BY expires > ?, accessed", (key, now)).fetchall():
+                if total <= limit:
+                    break
+                connection.execute("DELETE FROM items WHERE key = ?", (other,))
+                total -= other_size
+                evicted += 1
+            metrics.count('shared_cache_evictions_total', evicted, 'items removed from the shared cache')
+    finally:
+        connection.execute("COMMIT")
+
+
+def _release(connection, key, owner):
+    connection.execute("DELETE FROM leases WHERE key = ? AND owner = ?", (key, owner))
+
+
+def get(key: str, seconds: float, download):
+    """item of the shared cache; downloaded by one process only, if it is missing or expired
+
+    :param str key: required; name of the item, e.g. 'tickers' or 'klines/BTCUSDT/1d/1640995200000'
+    :param float seconds: required; time to live of the item (0 = not cached)
+    :param function download: required; downloads the item, if it is not cached (result must be json serializable)
+
+    :returns: the item, as returned by download
+    :raises: the errors of download (nothing is cached then)
+    """
+    if not active or seconds <= 0:
+        return download()
+    owner = str(os.getpid()) + '-' + str(threading.get_ident())
+    connection = _connection()
+    waited = 0.0
+    while True:
+        found, value = _lookup(connection, key, owner)
+        if found:
+            if waited:
+                logging.debug("waited %.1f sec for %s downloaded by another process", waited, key)
+            metrics.count('shared_cache_total', 1, 'items requested from the shared cache',
+                result='hit' if waited == 0 else 'waited')
+            return json.loads(value)
+        if found is False:
+            break
+        # another process is downloading the item
+        time.sleep(0.05)
+        waited += 0.05
+    metrics.count('shared_cache_total', 1, 'items requested from the shared cache', result='miss')
+    try:
+        item = download()
+    except BaseException:
+        _release(connection, key, owner)
+        raise
+    _store(connection, key, json.dumps(item), seconds)
+    return item
+
+
+def clear():
+    """remove all items from the shared cache"""
+    connection = _connection()
+    connection.execute("DELETE FROM items")
+    connection.execute("DELETE FROM leases")
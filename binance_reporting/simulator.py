@@ -0,0 +1,681 @@
+"""local stand-in of the exchange for offline and deterministic performance tests
+
+**Goal**
+    - run downloader.trades, orders, klines, daily_account_snapshots etc. without a live exchange
+    - benchmark and regression-test throughput with reproducible data
+
+**Procedure**
+    - a synthetic market (trading pairs, klines, trades, orders, snapshots, deposits, withdrawals) is generated
+      deterministically from a seed; data is computed on request, so even years of 5m klines need no memory
+    - a local REST server implements the endpoints used by this library
+    - every response carries the weight headers of the exchange; exceeding the limits returns 429 (and 418 when ignored)
+    - optional: a share of the requests fails with 503 (error_rate), to test the handling of failed requests
+    - API clients are redirected to the server by setting helper.api_url or the environment variable BINANCE_REPORTING_API_URL
+    - optional websocket server with the miniTicker price stream and user data streams (see serve_stream);
+      the stream module is redirected by helper.ws_url or the environment variable BINANCE_REPORTING_WS_URL
+
+**Usage**
+
+    .. code:: bash
+
+        python -m binance_reporting.simulator --port 8080 --pairs 500 --days 1095
+        export BINANCE_REPORTING_API_URL=http://127.0.0.1:8080
+        python -m binance_reporting.start config.yaml
+
+or within python:
+
+    .. code:: python
+
+        server = simulator.serve(simulator.Market(pairs=50, days=365))
+        helper.api_url = server.url
+        ...
+        server.stop()
+
+.. note:: signatures are not verified; every API key gets its own account history
+"""
+import re
+import sys
+import json
+import time
+import zlib
+import logging
+import argparse
+import threading
+import functools
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qsl
+import numpy as np
+try:
+    from binance_reporting import helper as hlp
+except:
+    import helper as hlp
+
+daily_ms = 86400000
+
+# weight per endpoint (see helper.endpoint_weights); endpoints not listed have a weight of 1
+endpoint_weights = hlp.endpoint_weights
+
+# weight limits per minute and the headers reporting the used weight
+rate_limits = {
+    'api': (hlp.rate_limits['api'], ['x-mbx-used-weight', 'x-mbx-used-weight-1m']),
+    'sapi': (hlp.rate_limits['sapi'], ['x-sapi-used-ip-weight-1m']),
+    'fapi': (hlp.rate_limits['fapi'], ['x-mbx-used-weight', 'x-mbx-used-weight-1m']),
+}
+
+
+def _noise(*values):
+    """deterministic pseudo random numbers between 0 and 1 (vectorized)"""
+    x = np.zeros(np.broadcast(*values).shape) if len(values) > 1 else np.zeros(np.shape(values[0]))
+    for nbr, value in enumerate(values):
+        x = x + np.asarray(value, dtype=np.float64) * (12.9898 + 78.233 * nbr)
+    return np.modf(np.abs(np.sin(x % 1e6) * 43758.5453))[0]
+
+
+def _fmt(values, decimals=8):
+    """format numbers as strings, like the exchange does"""
+    return [format(value, '.' + str(decimals) + 'f') for value in values]
+
+
+class Market:
+    """synthetic market with deterministic history
+
+    :param int pairs: optional; amount of trading pairs (all quoted in USDT)
+    :param int days: optional; days of history up to the end of the market
+    :param int traded_pairs: optional; amount of pairs with trades per account
+    :param int trades_per_pair: optional; amount of trades per account and traded pair
+    :param int seed: optional; different seeds give different markets
+    :param int end_ms: optional; end of the history (default: today 00:00 UTC, so a market is stable for one day)
+    """
+
+    def __init__(self, pairs: int = 50, days: int = 365, traded_pairs: int = 10, trades_per_pair: int = 100,
+                 seed: int = 1, end_ms: int = None):
+        self.days = days
+        self.seed = seed
+        self.traded_pairs = min(traded_pairs, pairs)
+        self.trades_per_pair = trades_per_pair
+        self.end_ms = end_ms if end_ms is not None else int(time.time() * 1000) // daily_ms * daily_ms
+        self.start_ms = self.end_ms - days * daily_ms
+
+        named = ['BTC', 'ETH', 'BNB', 'ADA', 'XRP', 'SOL', 'DOT', 'DOGE', 'LTC', 'LINK']
+        self.assets = (named + ['C' + str(nbr).zfill(4) for nbr in range(max(pairs - len(named), 0))])[:pairs]
+        self.symbols = [asset + 'USDT' for asset in self.assets]
+        self.index = {symbol: nbr for nbr, symbol in enumerate(self.symbols)}
+        nbrs = np.arange(pairs)
+        self.base_price = 10 ** (_noise(nbrs, seed) * 5 - 1)        # 0.1 ... 10000 USDT
+        self.period_days = 20 + _noise(nbrs, seed, 1) * 200
+        # pairs are listed during the first half of the history; the first pairs from the start
+        self.listing_ms = self.start_ms + (
+            (_noise(nbrs, seed, 2) * days / 2).astype(np.int64) * daily_ms * (nbrs >= len(named)))
+
+    def price(self, pair: int, t_ms):
+        """price of a pair at the given time(s)"""
+        x = np.asarray(t_ms, dtype=np.float64) / daily_ms
+        wave = 1 + 0.3 * np.sin(2 * np.pi * x / self.period_days[pair] + pair)
+        return self.base_price[pair] * wave * (1 + 0.01 * (_noise(t_ms, pair, self.seed) - 0.5))
+
+    def prices(self, t_ms: int = None):
+        """prices of all pairs at a given time (default: end of market)"""
+        t_ms = self.end_ms if t_ms is None else t_ms
+        return [float(self.price(pair, t_ms)) for pair in range(len(self.symbols))]
+
+    def tickers_24hr(self):
+        """price change and volume of all pairs in the last 24 hours (daily kline before the end of the market)"""
+        tickers = []
+        for symbol in self.symbols:
+            # every pair is listed during the first half of the history, so the last day has a kline
+            kline = self.klines(symbol, '1d', self.end_ms - daily_ms, self.end_ms - daily_ms, 1)[0]
+            open_price, close = float(kline[1]), float(kline[4])
+            tickers.append({
+                'symbol': symbol, 'priceChange': _fmt([close - open_price])[0],
+                'priceChangePercent': _fmt([100 * (close / open_price - 1)], 3)[0], 'prevClosePrice': kline[1],
+                'lastPrice': kline[4], 'openPrice': kline[1], 'highPrice': kline[2], 'lowPrice': kline[3],
+                'volume': kline[5], 'quoteVolume': kline[7], 'openTime': kline[0], 'closeTime': kline[6],
+                'count': kline[8]})
+        return tickers
+
+    def klines(self, symbol: str, interval: str, start_ms: int = None, end_ms: int = None, limit: int = 500):
+        """klines of a pair in the format of the exchange (list of lists)"""
+        pair = self.index[symbol]
+        step = hlp.kline_intervals_ms[interval]
+        first = max(start_ms or 0, int(self.listing_ms[pair]))
+        first = -(-first // step) * step
+        last = min(end_ms if end_ms is not None else self.end_ms, self.end_ms)
+        if first > last:
+            return []
+        count = min(limit, (last - first) // step + 1)
+        open_time = first + np.arange(count, dtype=np.int64) * step
+        open_price = self.price(pair, open_time)
+        close_price = self.price(pair, open_time + step)
+        spread = 1 + 0.005 * _noise(open_time, pair, 3)
+        high = np.maximum(open_price, close_price) * spread
+        low = np.minimum(open_price, close_price) / spread
+        volume = 1000 * _noise(open_time, pair, 4) / np.sqrt(self.base_price[pair])
+        rows = zip(
+            open_time.tolist(), _fmt(open_price), _fmt(high), _fmt(low), _fmt(close_price), _fmt(volume),
+            (open_time + step - 1).tolist(), _fmt(volume * close_price),
+            (volume * 10).astype(np.int64).tolist(), _fmt(volume / 2), _fmt(volume * close_price / 2))
+        return [list(row) + ['0'] for row in rows]
+
+    @functools.lru_cache(maxsize=4096)
+    def trades(self, account: int, symbol: str):
+        """all trades of an account for a pair; empty for pairs not being traded by the account"""
+        pair = self.index[symbol]
+        if (pair + account) % max(len(self.symbols) // max(self.traded_pairs, 1), 1) != 0:
+            return []
+        nbrs = np.arange(self.trades_per_pair)
+        begin = int(self.listing_ms[pair])
+        times = begin + ((nbrs + _noise(nbrs, account, pair)) * (self.end_ms - begin) / self.trades_per_pair).astype(np.int64)
+        prices = self.price(pair, times)
+        qtys = np.round(100 * _noise(nbrs, account, pair, 5) / np.sqrt(self.base_price[pair]) + 0.001, 3)
+        buyer = (_noise(nbrs, account, pair, 6) > 0.4) | (nbrs == 0)
+        first_id = 1000 * pair + account * 10000000
+        return [{
+            'symbol': symbol, 'id': first_id + int(nbr), 'orderId': 2 * first_id + int(nbr), 'orderListId': -1,
+            'price': price, 'qty': qty, 'quoteQty': quote, 'commission': fee,
+            'commissionAsset': self.assets[pair], 'time': int(t), 'isBuyer': bool(is_buyer), 'isMaker': bool(nbr % 2),
+            'isBestMatch': True}
+            for nbr, t, price, qty, quote, fee, is_buyer in zip(
+                nbrs, times, _fmt(prices), _fmt(qtys), _fmt(prices * qtys), _fmt(qtys * 0.001), buyer)]
+
+    def orders(self, account: int, symbol: str):
+        """all orders of an account for a pair; one filled order per trade"""
+        return [{
+            'symbol': symbol, 'orderId': trade['orderId'], 'orderListId': -1, 'clientOrderId': 'sim' + str(trade['orderId']),
+            'price': trade['price'], 'origQty': trade['qty'], 'executedQty': trade['qty'],
+            'cummulativeQuoteQty': trade['quoteQty'], 'status': 'FILLED', 'timeInForce': 'GTC', 'type': 'LIMIT',
+            'side': 'BUY' if trade['isBuyer'] else 'SELL', 'stopPrice': '0.00000000', 'icebergQty': '0.00000000',
+            'time': trade['time'], 'updateTime': trade['time'], 'isWorking': True,
+            'origQuoteOrderQty': '0.00000000'}
+            for trade in self.trades(account, symbol)]
+
+    def balances(self, account: int, t_ms: int = None):
+        """spot balances of an account"""
+        t_ms = self.end_ms if t_ms is None else t_ms
+        day = t_ms // daily_ms
+        result = [{'asset': 'USDT', 'free': _fmt([1000 + 500 * float(_noise(day, account))])[0], 'locked': '0.00000000'}]
+        for pair in range(min(len(self.assets), 20)):
+            if (pair + account) % 3 == 0 and self.listing_ms[pair] <= t_ms:
+                qty = 100 * float(_noise(day, account, pair)) / float(np.sqrt(self.base_price[pair]))
+                result.append({'asset': self.assets[pair], 'free': _fmt([qty])[0], 'locked': '0.00000000'})
+        return result
+
+    def snapshots(self, account: int, account_type: str, start_ms: int, end_ms: int, limit: int = 7):
+        """daily account snapshots (updateTime is the last millisecond of a day)"""
+        first = max(start_ms, self.end_ms - 180 * daily_ms)
+        first_day = -(-(first + 1) // daily_ms)
+        last_day = (min(end_ms, self.end_ms) + 1) // daily_ms
+        snapshots = []
+        for day in range(first_day, last_day + 1)[-limit:]:
+            update_time = day * daily_ms - 1
+            if account_type == 'FUTURES':
+                wallet = 1000 + 500 * float(_noise(day, account))
+                data = {
+                    'assets': [{'asset': 'USDT', 'marginBalance': _fmt([wallet * 1.01])[0], 'walletBalance': _fmt([wallet])[0]}],
+                    'position': [{
+                        'symbol': 'BTCUSDT', 'entryPrice': '20000.0', 'markPrice': _fmt([float(self.price(0, update_time))])[0],
+                        'positionAmt': '0.010', 'unRealizedProfit': '1.0'}]}
+            else:
+                data = {'balances': self.balances(account, update_time), 'totalAssetOfBtc': '0'}
+            snapshots.append({'type': account_type.lower(), 'updateTime': update_time, 'data': data})
+        return {'code': 200, 'msg': '', 'snapshotVos': snapshots}
+
+    def transfers(self, account: int, kind: str, start_ms: int, end_ms: int):
+        """deposits or withdrawals (one every 30 days)"""
+        first = max(start_ms, self.start_ms)
+        result = []
+        offset = 1 if kind == 'withdrawals' else 0
+        for month in range(-(-(first - self.start_ms) // (30 * daily_ms)), (min(end_ms, self.end_ms) - self.start_ms) // (30 * daily_ms) + 1):
+            t = self.start_ms + month * 30 * daily_ms + offset * 15 * daily_ms
+            if t < first or t > end_ms or t > self.end_ms:
+                continue
+            pair = (month + account) % min(len(self.assets), 10)
+            amount = _fmt([10 * float(_noise(month, account, offset)) / float(np.sqrt(self.base_price[pair])) + 0.01])[0]
+            if kind == 'deposits':
+                result.append({
+                    'amount': amount, 'coin': self.assets[pair], 'network': self.assets[pair], 'status': 1,
+                    'address': 'sim', 'addressTag': '', 'txId': 'sim-d-' + str(account) + '-' + str(month),
+                    'insertTime': int(t), 'transferType': 0, 'confirmTimes': '1/1', 'unlockConfirm': 0, 'walletType': 0})
+            else:
+                result.append({
+                    'id': 'sim-w-' + str(account) + '-' + str(month), 'amount': amount, 'transactionFee': '0.0001',
+                    'coin': self.assets[pair], 'status': 6, 'address': 'sim', 'txId': 'sim-tx-' + str(month),
+                    'applyTime': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(t / 1000)),
+                    'network': self.assets[pair], 'transferType': 0})
+        return result
+
+    def exchange_info(self):
+        """trading pairs with base / quote asset, status and filters (in the format of exchangeInfo)"""
+        symbols = []
+        for pair, symbol in enumerate(self.symbols):
+            tick = float(10 ** np.floor(np.log10(self.base_price[pair]) - 4))
+            symbols.append({
+                'symbol': symbol, 'status': 'TRADING', 'baseAsset': self.assets[pair], 'quoteAsset': 'USDT',
+                'filters': [
+                    {'filterType': 'PRICE_FILTER', 'minPrice': _fmt([tick])[0], 'maxPrice': '1000000.00000000',
+                     'tickSize': _fmt([tick])[0]},
+                    {'filterType': 'LOT_SIZE', 'minQty': '0.00001000', 'maxQty': '9000.00000000',
+                     'stepSize': '0.00001000'}]})
+        return {
+            'timezone': 'UTC', 'serverTime': int(time.time() * 1000),
+            'rateLimits': [{'rateLimitType': 'REQUEST_WEIGHT', 'interval': 'MINUTE', 'intervalNum': 1,
+                            'limit': hlp.rate_limits['api']}],
+            'symbols': symbols}
+
+    def futures_trades(self, account: int, symbol: str):
+        """all futures trades of an account for a symbol (in the format of the futures API)"""
+        return [{
+            'symbol': symbol, 'id': trade['id'], 'orderId': trade['orderId'], 'side': 'BUY' if trade['isBuyer'] else 'SELL',
+            'price': trade['price'], 'qty': trade['qty'], 'realizedPnl': '0' if trade['isBuyer'] else _fmt([float(trade['quoteQty']) * 0.01])[0],
+            'marginAsset': 'USDT', 'quoteQty': trade['quoteQty'], 'commission': _fmt([float(trade['quoteQty']) * 0.0004])[0],
+            'commissionAsset': 'USDT', 'time': trade['time'], 'positionSide': 'BOTH', 'buyer': trade['isBuyer'],
+            'maker': trade['isMaker']}
+            for trade in self.trades(account + 500, symbol)]
+
+    def futures_orders(self, account: int, symbol: str):
+        """all futures orders of an account for a symbol; one filled order per trade"""
+        return [{
+            'symbol': symbol, 'orderId': trade['orderId'], 'clientOrderId': 'sim' + str(trade['orderId']),
+            'price': trade['price'], 'avgPrice': trade['price'], 'origQty': trade['qty'], 'executedQty': trade['qty'],
+            'cumQuote': trade['quoteQty'], 'status': 'FILLED', 'timeInForce': 'GTC', 'type': 'LIMIT',
+            'reduceOnly': False, 'side': trade['side'], 'positionSide': 'BOTH', 'stopPrice': '0',
+            'time': trade['time'], 'updateTime': trade['time']}
+            for trade in self.futures_trades(account, symbol)]
+
+    def income(self, account: int, start_ms: int, end_ms: int, limit: int = 100):
+        """income history of a futures account (commissions and realized PnL of the trades)"""
+        records = []
+        for symbol in self.symbols:
+            for trade in self.futures_trades(account, symbol):
+                if start_ms <= trade['time'] <= end_ms:
+                    records.append({
+                        'symbol': symbol, 'incomeType': 'COMMISSION', 'income': '-' + trade['commission'], 'asset': 'USDT',
+                        'info': '', 'time': trade['time'], 'tranId': trade['id'], 'tradeId': str(trade['id'])})
+        records.sort(key=lambda record: record['time'])
+        return records[:limit]
+
+    def futures_account(self, account: int):
+        """futures account information"""
+        wallet = 1000 + 500 * float(_noise(self.end_ms // daily_ms, account))
+        values = {
+            'totalInitialMargin': wallet * 0.1, 'totalMaintMargin': wallet * 0.01, 'totalWalletBalance': wallet,
+            'totalUnrealizedProfit': 1.0, 'totalMarginBalance': wallet + 1, 'totalPositionInitialMargin': wallet * 0.1,
+            'totalOpenOrderInitialMargin': 0.0, 'totalCrossWalletBalance': wallet, 'totalCrossUnPnl': 1.0,
+            'availableBalance': wallet * 0.9, 'maxWithdrawAmount': wallet * 0.9}
+        result = {key: _fmt([value])[0] for key, value in values.items()}
+        result['updateTime'] = self.end_ms
+        result['assets'] = [{'asset': 'USDT', 'walletBalance': result['totalWalletBalance'],
+                             'marginBalance': result['totalMarginBalance'], 'updateTime': self.end_ms}]
+        result['positions'] = [{'symbol': 'BTCUSDT', 'initialMargin': result['totalPositionInitialMargin'],
+                                'positionAmt': '0.010', 'entryPrice': '20000.0', 'updateTime': self.end_ms}]
+        return result
+
+
+class _Limiter:
+    """weight accounting per minute (like the exchange: fixed windows per minute)"""
+
+    def __init__(self, limits: dict):
+        self.limits = limits
+        self.lock = threading.Lock()
+        self.minute = 0
+        self.used = {area: 0 for area in limits}
+        self.banned_until = 0
+
+    def add(self, area: str, weight: int):
+        """account weight; returns status code, used weight and seconds until the limit resets"""
+        if self.limits[area] is None:
+            # no limit: nothing is accounted and 0 is reported, so clients never cool off
+            return 200, 0, 0
+        with self.lock:
+            now = time.time()
+            minute = int(now // 60)
+            if minute != self.minute:
+                self.minute = minute
+                self.used = {key: 0 for key in self.used}
+            retry_after = int((minute + 1) * 60 - now) + 1
+            if now < self.banned_until:
+                return 418, self.used[area], int(self.banned_until - now) + 1
+            if self.used[area] >= self.limits[area]:
+                # requests after a 429 are answered with a ban (418), like the exchange does
+                self.banned_until = now + 120
+                return 418, self.used[area], 120
+            self.used[area] += weight
+            if self.used[area] > self.limits[area]:
+                return 429, self.used[area], retry_after
+            return 200, self.used[area], retry_after
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """request handler of the stand-in; routing on '/<area>/<version>/<endpoint>'"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        logging.debug("simulator: " + format, *args)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+    def _handle(self, method):
+        server = self.server
+        url = urlparse(self.path)
+        params = dict(parse_qsl(url.query))
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            params.update(parse_qsl(self.rfile.read(length).decode()))
+        match = re.match(r'^/(api|sapi|fapi)/v\d+/(.+)$', url.path)
+        if not match:
+            return self._send(404, {'code': -1, 'msg': 'Unknown endpoint ' + url.path}, {})
+        area, endpoint = match.groups()
+        weight = endpoint_weights.get((area, endpoint), 1)
+        if (area, endpoint) in (('api', 'ticker/price'), ('api', 'ticker/24hr')) and 'symbol' in params:
+            weight = 1
+        status, used, retry_after = server.limiter.add(area, weight)
+        headers = {name: str(used) for name in rate_limits[area][1]}
+        server.requests += 1
+        if status != 200:
+            headers['Retry-After'] = str(retry_after)
+            return self._send(status, {'code': -1003, 'msg': 'Too much request weight used.'}, headers)
+        if server.latency:
+            time.sleep(server.latency)
+        if server.error_rate and float(_noise(server.requests, server.market.seed, 3)) < server.error_rate:
+            server.errors += 1
+            return self._send(503, {'code': -1001, 'msg': 'Internal error; unable to process your request.'}, headers)
+        try:
+            body = server.route(method, area, endpoint, params, self.headers.get('X-MBX-APIKEY', ''))
+        except KeyError as e:
+            return self._send(400, {'code': -1121, 'msg': 'Invalid symbol or parameter: ' + str(e)}, headers)
+        if body is None:
+            return self._send(404, {'code': -1, 'msg': 'Unknown endpoint ' + url.path}, headers)
+        self._send(200, body, headers)
+
+    def _send(self, status, body, headers):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class Server(ThreadingHTTPServer):
+    """REST server of the stand-in; use serve() to start it"""
+
+    daemon_threads = True
+
+    def __init__(self, market: Market, host: str = '127.0.0.1', port: int = 0, latency: float = 0, limits: dict = None,
+                 error_rate: float = 0):
+        super().__init__((host, port), _Handler)
+        self.market = market
+        self.latency = latency
+        self.error_rate = error_rate
+        self.errors = 0
+        self.requests = 0
+        self.limiter = _Limiter(limits or {area: limit for area, (limit, headers) in rate_limits.items()})
+        self.url = 'http://' + host + ':' + str(self.server_address[1])
+        self.thread = None
+
+    def account(self, api_key: str):
+        """every API key is an account of its own"""
+        return zlib.crc32(api_key.encode()) % 1000
+
+    def route(self, method, area, endpoint, params, api_key):
+        """answer of the market for an endpoint; None for unknown endpoints"""
+        market = self.market
+        account = self.account(api_key)
+        limit = int(params.get('limit', 500))
+        start = int(params['startTime']) if 'startTime' in params else None
+        end = int(params['endTime']) if 'endTime' in params else None
+        if area == 'api':
+            if endpoint in ('ping', 'userDataStream') and method in ('PUT', 'DELETE'):
+                return {}
+            if endpoint == 'ping':
+                return {}
+            if endpoint == 'time':
+                return {'serverTime': int(time.time() * 1000)}
+            if endpoint == 'userDataStream':
+                return {'listenKey': 'sim' + str(account)}
+            if endpoint == 'exchangeInfo':
+                return market.exchange_info()
+            if endpoint == 'ticker/price':
+                prices = dict(zip(market.symbols, _fmt(market.prices())))
+                if 'symbol' in params:
+                    return {'symbol': params['symbol'], 'price': prices[params['symbol']]}
+                return [{'symbol': symbol, 'price': price} for symbol, price in prices.items()]
+            if endpoint == 'ticker/24hr':
+                tickers = market.tickers_24hr()
+                if 'symbol' in params:
+                    return tickers[market.index[params['symbol']]]
+                return tickers
+            if endpoint == 'klines':
+                return market.klines(params['symbol'], params['interval'], start, end, min(limit, 1000))
+            if endpoint in ('myTrades', 'allOrders'):
+                rows = market.trades(account, params['symbol']) if endpoint == 'myTrades' else market.orders(account, params['symbol'])
+                limit = min(limit, 1000)
+                if start is None and 'fromId' not in params:
+                    return rows[-limit:]
+                if 'fromId' in params:
+                    rows = [row for row in rows if row['id' if endpoint == 'myTrades' else 'orderId'] >= int(params['fromId'])]
+                if start is not None:
+                    rows = [row for row in rows if row['time'] >= start and (end is None or row['time'] <= end)]
+                return rows[:limit]
+            if endpoint == 'openOrders':
+                return []
+            if endpoint == 'account':
+                return {'makerCommission': 10, 'takerCommission': 10, 'canTrade': True, 'accountType': 'SPOT',
+                        'updateTime': market.end_ms, 'balances': market.balances(account), 'permissions': ['SPOT']}
+        if area == 'sapi':
+            if endpoint == 'accountSnapshot':
+                return market.snapshots(account, params.get('type', 'SPOT'), start or 0, end or market.end_ms,
+                                        max(7, min(int(params.get('limit', 7)), 30)))
+            if endpoint == 'capital/deposit/hisrec':
+                return market.transfers(account, 'deposits', start or 0, end or market.end_ms)
+            if endpoint == 'capital/withdraw/history':
+                return market.transfers(account, 'withdrawals', start or 0, end or market.end_ms)
+        if area == 'fapi':
+            if endpoint == 'account':
+                return market.futures_account(account)
+            if endpoint in ('userTrades', 'allOrders'):
+                limit = min(limit, 1000)
+                if endpoint == 'userTrades':
+                    rows = market.futures_trades(account, params['symbol'])
+                    first_id = int(params.get('fromId', 0))
+                    rows = [row for row in rows if row['id'] >= first_id]
+                else:
+                    rows = market.futures_orders(account, params['symbol'])
+                    first_id = int(params.get('orderId', 0))
+                    rows = [row for row in rows if row['orderId'] >= first_id]
+                if 'fromId' not in params and 'orderId' not in params:
+                    return rows[-limit:]
+                return rows[:limit]
+            if endpoint == 'openOrders':
+                return []
+            if endpoint == 'income':
+                return market.income(account, start or 0, end or market.end_ms, min(limit, 1000))
+        return None
+
+    def start(self):
+        """serve requests in a background thread"""
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        logging.info(" - exchange stand-in listening on %s -", self.url)
+        return self
+
+    def stop(self):
+        """stop serving requests"""
+        self.shutdown()
+        self.server_close()
+
+
+def serve(market: Market = None, host: str = '127.0.0.1', port: int = 0, latency: float = 0, limits: dict = None,
+          error_rate: float = 0):
+    """start the stand-in in a background thread
+
+    :param object market: optional; synthetic market (default: Market())
+    :param str host: optional; interface to listen on
+    :param int port: optional; port to listen on (default: any free port)
+    :param float latency: optional; seconds every request is delayed to emulate network latency
+    :param dict limits: optional; weight limit per minute per area, e.g. {'api': 1200, 'sapi': 12000, 'fapi': 2400};
+        None disables the limit of an area (no 429 and the used-weight headers report 0)
+    :param float error_rate: optional; share of the requests failing with 503 (0.1 = 10%; 1 = exchange down)
+
+    :returns: running server; server.url is the base url for helper.api_url
+    """
+    return Server(market or Market(), host, port, latency, limits, error_rate).start()
+
+
+class StreamServer:
+    """websocket server of the stand-in; use serve_stream() to start it
+
+    - '/stream?streams=!miniTicker@arr' sends the prices of all pairs every tick
+    - '/ws/<listen key>' sends the balances of the account (outboundAccountPosition) every account_ticks ticks
+
+    the market time runs 'speed' times faster than the wall clock, so prices and balances change visibly
+    """
+
+    def __init__(self, market: Market, host: str = '127.0.0.1', port: int = 0, tick: float = 1.0,
+                 speed: float = 3600, account_ticks: int = 5):
+        self.market = market
+        self.host = host
+        self.port = port
+        self.tick = tick
+        self.speed = speed
+        self.account_ticks = account_ticks
+        self.url = None
+        self.started = time.time()
+        self.thread = None
+        self._loop = None
+        self._stop = None
+        self._ready = threading.Event()
+
+    def market_time(self):
+        """current time of the market in ms"""
+        return int(self.market.end_ms + (time.time() - self.started) * self.speed * 1000)
+
+    def mini_tickers(self):
+        t_ms = self.market_time()
+        return [
+            {'e': '24hrMiniTicker', 'E': t_ms, 's': symbol, 'c': price}
+            for symbol, price in zip(self.market.symbols, _fmt(self.market.prices(t_ms)))]
+
+    def account_position(self, listen_key: str):
+        t_ms = self.market_time()
+        account = int(listen_key[3:]) if listen_key.startswith('sim') and listen_key[3:].isdigit() else 0
+        return {
+            'e': 'outboundAccountPosition', 'E': t_ms, 'u': t_ms,
+            'B': [{'a': balance['asset'], 'f': balance['free'], 'l': balance['locked']}
+                  for balance in self.market.balances(account, t_ms)]}
+
+    async def _handler(self, websocket, path=None):
+        import asyncio
+        import websockets
+        if path is None:
+            request = getattr(websocket, 'request', None)
+            path = request.path if request is not None else websocket.path
+        parsed = urlparse(path)
+        if parsed.path == '/stream':
+            streams = dict(parse_qsl(parsed.query)).get('streams', '').split('/')
+        else:
+            streams = [parsed.path.rsplit('/', 1)[-1]]
+        combined = parsed.path == '/stream'
+        nbr = 0
+        try:
+            while True:
+                for stream in streams:
+                    if stream == '!miniTicker@arr':
+                        data = self.mini_tickers()
+                    elif nbr % self.account_ticks == 0:
+                        data = self.account_position(stream)
+                    else:
+                        continue
+                    await websocket.send(json.dumps({'stream': stream, 'data': data} if combined else data))
+                nbr += 1
+                await asyncio.sleep(self.tick)
+        except websockets.exceptions.ConnectionClosed:
+            return
+
+    def _serve(self):
+        import asyncio
+        import websockets
+
+        async def serve():
+            self._loop = asyncio.get_running_loop()
+            self._stop = asyncio.Event()
+            async with websockets.serve(self._handler, self.host, self.port) as server:
+                sockets = server.sockets if hasattr(server, 'sockets') else server.server.sockets
+                self.port = list(sockets)[0].getsockname()[1]
+                self.url = 'ws://' + self.host + ':' + str(self.port)
+                self._ready.set()
+                await self._stop.wait()
+        asyncio.run(serve())
+
+    def start(self):
+        """serve websockets in a background thread"""
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+        self._ready.wait(10)
+        logging.info(" - exchange stream stand-in listening on %s -", self.url)
+        return self
+
+    def stop(self):
+        """stop serving websockets"""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
+            self.thread.join(10)
+
+
+def serve_stream(market: Market = None, host: str = '127.0.0.1', port: int = 0, tick: float = 1.0,
+                 speed: float = 3600, account_ticks: int = 5):
+    """start the websocket stand-in in a background thread (needs the package websockets)
+
+    :param object market: optional; synthetic market (default: Market())
+    :param str host: optional; interface to listen on
+    :param int port: optional; port to listen on (default: any free port)
+    :param float tick: optional; seconds between two price events
+    :param float speed: optional; market seconds per wall clock second
+    :param int account_ticks: optional; ticks between two balance events of an account
+
+    :returns: running server; server.url is the base url for helper.ws_url
+    """
+    return StreamServer(market or Market(), host, port, tick, speed, account_ticks).start()
+
+
+def main():
+    """run the stand-in from the command line"""
+    parser = argparse.ArgumentParser(description="local stand-in of the exchange for offline tests")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--pairs', type=int, default=50)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--traded-pairs', type=int, default=10)
+    parser.add_argument('--trades-per-pair', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0, help="share of the requests failing with 503")
+    parser.add_argument('--ws-port', type=int, default=0, help="port of the websocket stand-in (default: no websockets)")
+    args = parser.parse_args()
+    logging.basicConfig(level='INFO')
+    market = Market(args.pairs, args.days, args.traded_pairs, args.trades_per_pair, args.seed)
+    if args.ws_port:
+        serve_stream(market, args.host, args.ws_port)
+    server = Server(market, args.host, args.port, args.latency, error_rate=args.error_rate)
+    logging.info(" - exchange stand-in listening on %s -", server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+        sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
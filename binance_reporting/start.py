@@ -1,15 +1,32 @@
+import time
+start_time = time.perf_counter()    # used to report the cold-start time
+cold_start = True
+
 import os
 import sys
+import json
 import logging
+import importlib
 
+# only the lightweight helper module is imported upfront
+# downloader (pandas, python-binance, finta), ticker (python-telegram-bot) and warehouse
+# are imported later, in case the enabled modules need them
 try:
     from binance_reporting import helper
-    from binance_reporting import downloader
-    from binance_reporting import ticker
+    from binance_reporting import metrics
+    from binance_reporting import tracing
+    from binance_reporting import resilience
+    from binance_reporting import pipeline
+    from binance_reporting import weightledger
+    from binance_reporting import sharedcache
 except:
     import helper
-    import downloader
-    import ticker
+    import metrics
+    import tracing
+    import resilience
+    import pipeline
+    import weightledger
+    import sharedcache
 
 # logging will start with default settings and on console
 # after config is read, these will overwrite the default settings
@@ -24,6 +41,30 @@ logging.basicConfig(
     format=log_format, datefmt=log_date_format
     )
 
+# modules, whose files are merged for all accounts at the end of a run
+merged_modules = ['daily_account_snapshots', 'balances', 'deposits', 'withdrawals']
+
+# modules of the config file, which need the downloader module
+downloader_modules = [
+    'balances', 'daily_account_snapshots', 'trades', 'orders', 'open_orders',
+    'deposits', 'withdrawals', 'prices', 'klines']
+
+
+def load_module(module_name):
+    """import a module of binance_reporting only when it is needed
+
+    :param str module_name: required; name of the module, e.g. 'downloader'
+
+    :returns: the imported module
+    """
+    logging.debug("importing module %s", module_name)
+    try:
+        return importlib.import_module('binance_reporting.' + module_name)
+    except ModuleNotFoundError as e:
+        if e.name != 'binance_reporting':
+            raise
+        return importlib.import_module(module_name)
+
 
 def main():
     """main module, which brings the diifferent binance_reporting modules together
@@ -42,6 +83,12 @@ def main():
         - daily snapshots
         - klines
 
+    In case the daemon mode is activated in the config file, the modules are run in a long running
+    scheduler, every module on its own interval (see daemon).
+    In case the stream mode is activated, balances and prices are streamed and telegram messages are sent
+    on significant changes of the portfolio values (see stream.run).
+    In case the planner is activated, API weight and duration of the run are estimated and printed first;
+    the run is executed afterwards, unless in dry-run mode (see plan).
     """
 
     logging.info(" --- Start downloading data from Exchange ---")
@@ -69,6 +116,54 @@ def main():
             format=log_format, datefmt=log_date_format, force = True
             )
 
+    # retries, backoff and circuit breakers for failed requests
+    resilience.configure(config.get('resilience', {}))
+    # size of the queues between download, processing and write stages
+    pipeline.configure(config.get('pipeline', {}))
+    # API weight shared by all processes on this host (e.g. overlapping cron jobs)
+    weightledger.configure(config.get('weight_ledger', {}))
+    # market data shared by all processes on this host (tickers, exchange info, daily klines of the valuation)
+    sharedcache.configure(config.get('shared_cache', {}))
+
+    # profiling mode: nested timing spans and optional cProfile / tracemalloc per module
+    if config['logging'].get('profile', False):
+        tracing.activate(
+            config['logging'].get('trace_file', 'binance_reporting_trace.json'),
+            config['logging'].get('cprofile', False),
+            config['logging'].get('tracemalloc', 0))
+
+    stream_config = config.get('stream', {})
+    daemon_config = config.get('daemon', {})
+    if stream_config.get('activate', False):
+        # real-time ticker; balances and prices are streamed instead of downloaded
+        stream = load_module('stream')
+        stream.run(
+            config['accounts'], config['account_groups'], config['telegram']['token'],
+            stream_config.get('threshold', 0.01), stream_config.get('min_interval', 60),
+            stream_config.get('ws_url', ''), config['telegram'].get('last_sent_file', ''),
+            stream_config.get('check_interval', 5))
+    elif daemon_config.get('activate', False):
+        daemon(config)
+    elif config.get('planner', {}).get('activate', False):
+        with tracing.span('run', 'run'):
+            plan(config, config['modules'])
+        tracing.write()
+    else:
+        with tracing.span('run', 'run'):
+            run(config, config['modules'])
+        tracing.write()
+
+
+def run(config, modules, account_names=None, merge=True):
+    """one download run for the given modules
+
+    :param dict config: required; configuration as read by helper.read_config
+    :param dict modules: required; modules to be run in this run, e.g. {'balances': True, 'klines': False}
+    :param list account_names: optional; accounts to be downloaded (default: all accounts of the config)
+    :param bool merge: optional; merge the files of all accounts (or create the views of the warehouse) and write the metrics
+    """
+    global cold_start
+
     logging.info(" --- Downloading all account information from Exchange ---")
 
     data_dir = os.getcwd()
@@ -76,15 +171,46 @@ def main():
 
     accounts = config['accounts']
     account_groups = config['account_groups']
-    modules = config['modules']
-
-
-    if modules['ticker']:
-        ticker.send_bal(accounts, account_groups, telegram_token)
-
-    list_of_trading_pairs = helper.get_symbols('USDT')
 
-    for account in accounts:
+    # import only what the enabled modules need
+    if any(modules.get(module, False) for module in downloader_modules):
+        downloader = load_module('downloader')
+    if modules.get('ticker', False):
+        ticker = load_module('ticker')
+    if modules.get('cost_basis', False):
+        costbasis = load_module('costbasis')
+    if modules.get('ledger', False):
+        ledger = load_module('ledger')
+
+    # optional warehouse; if activated, all downloads are stored in one database instead of csv files
+    db = None
+    warehouse_config = config.get('warehouse', {})
+    if warehouse_config.get('activate', False):
+        warehouse = load_module('warehouse')
+        db_file = data_dir + "/" + warehouse_config.get('db_file', 'binance_reporting.db')
+        logging.info(" ---- Using warehouse %s.", db_file)
+        db = warehouse.connect(db_file)
+
+    if cold_start:
+        logging.info(" ---- Cold start finished after %.3f sec.", time.perf_counter() - start_time)
+        cold_start = False
+
+    # balances are downloaded once per account and run; shared by ticker, account groups and balances files
+    store = helper.ResultStore(config.get('result_store', {}).get('max_age', 300))
+
+    if modules.get('ticker', False):
+        ticker.send_bal(
+            accounts, account_groups, telegram_token, store,
+            config['telegram'].get('last_sent_file', ''), config['telegram'].get('workers', 8))
+
+    # list of trading pairs is only needed for trades and orders; avoid the download otherwise
+    list_of_trading_pairs = []
+    if modules.get('trades', False) or modules.get('orders', False):
+        list_of_trading_pairs = helper.get_symbols('USDT')
+
+    prices = None   # current prices for the cost basis; downloaded once per run
+    selected = [account for account in accounts if account_names is None or account in account_names]
+    for account in tracing.iterate(selected, 'account'):
         logging.info(" -- start downloading data for account %s --", account)
 
         account_details = accounts[account]
@@ -108,27 +234,42 @@ def main():
 
         writetype = "w"
 
-        if modules['balances']: 
+        if modules.get('balances', False): 
             downloader.balances(
-                account, account_details['type'], PUBLIC, SECRET, balances_file, bal_fut_positions_file, bal_fut_assets_file, writetype)
+                account, account_details['type'], PUBLIC, SECRET, balances_file, bal_fut_positions_file, bal_fut_assets_file, writetype, db, store)
 
-        if modules['trades']:
+        if modules.get('trades', False):
             downloader.trades(
-                account, account_details['type'], PUBLIC, SECRET, list_of_trading_pairs, trades_file)
-
-        if modules['orders']:
-            downloader.orders(account, account_details['type'], PUBLIC, SECRET, list_of_trading_pairs, orders_file)
-
-        if modules['open_orders']:
-            downloader.open_orders(account, account_details['type'], PUBLIC, SECRET, open_orders_file)
-
-        if modules['deposits']:
-            downloader.deposits(account, account_details['type'], PUBLIC, SECRET, deposits_file)
-
-        if modules['withdrawals']:
-            downloader.withdrawals(account, account_details['type'], PUBLIC, SECRET, withdrawals_file)
-
-        if modules['daily_account_snapshots']:
+                account, account_details['type'], PUBLIC, SECRET, list_of_trading_pairs, trades_file, db,
+                config.get('futures', {}).get('workers', 4))
+
+        # cost basis of futures (leverage, short positions) is not supported
+        if modules.get('cost_basis', False) and account_details['type'] == 'FUTURES':
+            logging.info(" - cost basis is not calculated for FUTURES account %s -", account)
+        elif modules.get('cost_basis', False):
+            if prices is None:
+                prices = {ticker_price['symbol']: float(ticker_price['price'])
+                          for ticker_price in helper.get_all_tickers(helper.get_client())}
+            costbasis.cost_basis(
+                account, trades_file, file_directory + "cost_basis_" + account + ".csv",
+                file_directory + "cost_basis_" + account + "_state.json",
+                config.get('cost_basis', {}).get('method', 'fifo'), prices, db)
+
+        if modules.get('orders', False):
+            downloader.orders(
+                account, account_details['type'], PUBLIC, SECRET, list_of_trading_pairs, orders_file, db,
+                config.get('futures', {}).get('workers', 4))
+
+        if modules.get('open_orders', False):
+            downloader.open_orders(account, account_details['type'], PUBLIC, SECRET, open_orders_file, db)
+
+        if modules.get('deposits', False):
+            downloader.deposits(account, account_details['type'], PUBLIC, SECRET, deposits_file, db)
+
+        if modules.get('withdrawals', False):
+            downloader.withdrawals(account, account_details['type'], PUBLIC, SECRET, withdrawals_file, db)
+
+        if modules.get('daily_account_snapshots', False):
             downloader.daily_account_snapshots(
                 account,
                 account_details['type'],
@@ -136,16 +277,71 @@ def main():
                 SECRET,
                 snapshots_balances_file,
                 snapshots_positions_file,
-                snapshots_assets_file
+                snapshots_assets_file,
+                db
             )
 
+        # daily balances for the whole lifetime of the account out of trades, deposits and withdrawals
+        if modules.get('ledger', False) and account_details['type'] == 'FUTURES':
+            logging.info(" - daily balances are not replayed for FUTURES account %s -", account)
+        elif modules.get('ledger', False):
+            ledger.daily_balances(
+                account, PUBLIC, SECRET, trades_file, deposits_file, withdrawals_file, snapshots_assets_file,
+                file_directory + "ledger_daily_" + account + ".csv",
+                file_directory + "ledger_" + account + "_anchor.json", db)
+
         logging.info(" -- Finished downloading all data for account %s --", account)
 
-    if modules['prices']:
+    if modules.get('prices', False):
         prices_file = data_dir + "/prices.csv"
-        downloader.prices(prices_file)
+        downloader.prices(prices_file, db)
 
-    if modules['daily_account_snapshots']:
+    if modules.get('klines', False):
+        klines_config = config['klines']
+        klines_dir = data_dir + '/' + klines_config['dir']
+        klines_symbols = helper.get_symbols(klines_config['symbols'])
+        klines_intervals = klines_config['intervals']
+        klines_indicators = klines_config.get('indicators', [])
+        klines_indicators_config = klines_config.get('indicators_config', {})
+        if not os.path.exists(klines_dir):
+            os.makedirs(klines_dir)
+
+        # only the most traded pairs plus the pinned pairs (see universe)
+        universe_config = klines_config.get('universe', {})
+        if universe_config.get('activate', False):
+            universe = load_module('universe')
+            klines_symbols = universe.select(
+                None, klines_symbols, universe_config, klines_dir + '/universe.json')
+
+        downloader.klines(
+            klines_dir, klines_symbols, klines_intervals, klines_indicators, klines_indicators_config, db,
+            klines_config.get('workers', 0))
+
+        # download candles missing in the middle of the history (see klinegaps)
+        if klines_config.get('repair_gaps', False):
+            klinegaps = load_module('klinegaps')
+            klinegaps.repair(
+                klines_dir, klines_intervals, klines_symbols, db, klines_config.get('repair_workers', 4),
+                klines_indicators, klines_indicators_config)
+
+        # time-aligned matrix of all pairs for backtesting (see klinematrix)
+        if klines_config.get('matrix', False):
+            klinematrix = load_module('klinematrix')
+            for interval in klines_intervals:
+                if interval != '1M':
+                    klinematrix.build(klines_dir, interval, db)
+
+    if not merge:
+        if db is not None:
+            db.close()
+        return
+
+    if db is not None:
+        # *_all_accounts are views in the warehouse; no need to merge any files
+        logging.info(" -- Creating views for all accounts in warehouse. --")
+        warehouse.create_views(db)
+
+    if db is None and modules.get('daily_account_snapshots', False):
         logging.info(" -- Merging snapshot files from different accounts. --")
         targetfile = (data_dir + "/snapshots_daily_all_accounts.csv")
         sourcefiles = []
@@ -163,7 +359,7 @@ def main():
         helper.merge_files(sourcefiles, targetfile)
         logging.info(" -- Merging snapshot files finished. --")
 
-    if modules['balances']:
+    if db is None and modules.get('balances', False):
         logging.info(" -- Merging balances files from different accounts. --")            
         targetfile = (data_dir + "/balances_all_accounts.csv")
         sourcefiles = []
@@ -180,7 +376,7 @@ def main():
         helper.merge_files(sourcefiles, targetfile)
         logging.info(" -- Merging snapshot files finished. --")
 
-    if modules['deposits']:
+    if db is None and modules.get('deposits', False):
         logging.info(" -- Merging deposit files from different accounts. --")            
         targetfile = (data_dir + "/deposits_all_accounts.csv")
         sourcefiles = []
@@ -200,7 +396,7 @@ def main():
         helper.merge_files(sourcefiles, targetfile)
         logging.info(" -- Merging deposit files finished. --")
 
-    if modules['withdrawals']:
+    if db is None and modules.get('withdrawals', False):
         logging.info(" -- Merging withdrawal files from different accounts. --")            
         targetfile = (data_dir + "/withdrawals_all_accounts.csv")
         sourcefiles = []
@@ -220,17 +416,141 @@ def main():
         helper.merge_files(sourcefiles, targetfile)
         logging.info(" -- Merging withdrawal files finished. --")
 
-    if modules['klines']:
-        klines_config = config['klines']
-        klines_dir = data_dir + '/' + klines_config['dir']
-        klines_symbols = helper.get_symbols(klines_config['symbols'])
-        klines_intervals = klines_config['intervals']
-        klines_indicators = klines_config['indicators']
-        klines_indicators_config = klines_config['indicators_config']
-        if not os.path.exists(klines_dir):
-            os.makedirs(klines_dir)
+    if db is not None:
+        db.close()
+
+    # metrics of all runs so far (requests, latency, weight, cool-off, rows, csv i/o)
+    metrics_config = config.get('metrics', {})
+    if metrics_config.get('activate', False):
+        metrics_file = data_dir + "/" + metrics_config.get('file', 'binance_reporting.prom')
+        logging.info(" -- Writing metrics to %s. --", metrics_file)
+        metrics.write(metrics_file, metrics_config.get('format', 'prometheus'))
+
+
+def plan(config, modules):
+    """estimate API weight and duration of a run, print the plan and execute it (see planner)
+
+    **Procedure**
+        - build the work graph out of the config and the local watermarks (accounts x modules x trading pairs / windows)
+        - print requests, weight and estimated duration per account and module
+        - dry-run: stop after printing the plan
+        - otherwise execute the run; if 'optimize' is set, module by module in weight-optimal order
+          (clients and market data are shared between the modules), the files of all accounts are merged at the end
+
+    :param dict config: required; configuration as read by helper.read_config
+    :param dict modules: required; modules to be run, e.g. {'balances': True, 'klines': False}
+    """
+    planner = load_module('planner')
+    planner_config = config.get('planner', {})
+    latency = planner_config.get('latency', 0.3)
+
+    db = None
+    warehouse_config = config.get('warehouse', {})
+    if warehouse_config.get('activate', False):
+        warehouse = load_module('warehouse')
+        db = warehouse.connect(os.getcwd() + "/" + warehouse_config.get('db_file', 'binance_reporting.db'))
+    work = planner.build(config, modules, os.getcwd(), db)
+    if db is not None:
+        db.close()
+
+    optimize = planner_config.get('optimize', False)
+    order = planner.order(work, latency) if optimize else planner.units(work)
+    print(planner.report(work, order, latency))
+
+    if planner_config.get('dry_run', True):
+        logging.info(" --- Dry-run finished; nothing downloaded. ---")
+        return
+    if not optimize:
+        run(config, modules)
+        return
+
+    logging.info(" --- Running %s modules in weight-optimal order ---", str(len(order)))
+    helper.cache_activate(config.get('daemon', {}).get('market_data_ttl', 60))
+    for account, module in order:
+        run(config, {module: True}, [account], merge=False)
+    # merge the files of all accounts once at the end (no account and no download left)
+    run(config, {module: modules[module] for module in merged_modules if module in modules}, [])
+
+
+def daemon(config):
+    """long running scheduler, which runs every module on its own interval
+
+    **Goal**
+        - avoid paying python start-up, config parsing, client creation and market data downloads for every scheduled run
+        - replaces several cron jobs with different config files (e.g. hourly balances and daily klines)
+
+    **Procedure**
+        - activate in-memory caches for API clients, market data and csv files (see helper.cache_activate)
+        - every enabled module gets its own interval (section 'daemon' in the config file)
+        - all modules being due at the same time are run together in one run (sharing clients and market data)
+        - in case a run takes longer than an interval, the missed runs are coalesced into one run instead of catching up
+        - latency of every cycle and the backlog (modules overdue and their delay) are logged and written to the status file
+
+    :param dict config: required; configuration as read by helper.read_config
+    """
+    daemon_config = config['daemon']
+    tick = daemon_config.get('tick', 60)
+    default_interval = daemon_config.get('default_interval', 3600)
+    intervals = daemon_config.get('intervals', {})
+    status_file = daemon_config.get('status_file', '')
+
+    helper.cache_activate(daemon_config.get('market_data_ttl', 60))
+
+    enabled = [module for module in config['modules'] if config['modules'][module]]
+    if len(enabled) == 0:
+        sys.exit("No modules activated. Aborting daemon.")
+    now = time.time()
+    status = {
+        'cycles': 0,
+        'modules': {
+            module: {
+                'interval': intervals.get(module, default_interval),
+                'next_run': now,
+                'last_run': None,
+                'runs': 0,
+                'coalesced': 0}
+            for module in enabled}}
+    logging.info(" --- Starting daemon for modules %s ---", ', '.join(enabled))
+
+    while True:
+        now = time.time()
+        due = [module for module in enabled if status['modules'][module]['next_run'] <= now]
+        if due:
+            backlog = {module: round(now - status['modules'][module]['next_run'], 1) for module in due}
+            logging.info(" --- Cycle %s: running %s; backlog (sec overdue): %s ---",
+                str(status['cycles'] + 1), ', '.join(due), str(backlog))
+            cycle_start = time.perf_counter()
+            try:
+                with tracing.span('run', 'run', cycle=status['cycles'] + 1):
+                    run(config, {module: module in due for module in enabled})
+            except Exception as e:
+                logging.warning("Exception occured: ", exc_info=True)
+            tracing.write()
+            latency = time.perf_counter() - cycle_start
+            finished = time.time()
+
+            # schedule next runs; missed intervals are coalesced into the next run
+            for module in due:
+                module_status = status['modules'][module]
+                interval = module_status['interval']
+                missed = int((finished - module_status['next_run']) // interval)
+                module_status['coalesced'] += missed
+                module_status['next_run'] += (missed + 1) * interval
+                module_status['last_run'] = finished
+                module_status['runs'] += 1
+
+            status['cycles'] += 1
+            status['last_cycle'] = {'modules': due, 'latency': round(latency, 3), 'backlog': backlog, 'finished': finished}
+            status['backlog'] = [module for module in enabled if status['modules'][module]['next_run'] <= finished]
+            logging.info(" --- Cycle %s finished after %.1f sec; modules overdue: %s ---",
+                str(status['cycles']), latency, str(len(status['backlog'])))
+            if status_file != '':
+                with open(status_file, 'w') as file:
+                    json.dump(status, file, indent=2)
+
+        next_run = min(status['modules'][module]['next_run'] for module in enabled)
+        time.sleep(min(max(next_run - time.time(), 0), tick))
 
-        downloader.klines(klines_dir, klines_symbols, klines_intervals, klines_indicators, klines_indicators_config)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,329 @@
+"""real-time balance ticker driven by websocket streams of the exchange
+
+**Goal**
+    - up-to-date portfolio values without polling the account and all prices via REST on every run
+    - telegram updates as soon as the value of an account changes significantly, instead of on a fixed schedule
+
+**Procedure**
+    - download balances and prices once via REST (start values)
+    - subscribe to the user data stream of every account (changed balances) and to the miniTicker stream
+      of all trading pairs (changed prices)
+    - every event updates the valuation of the portfolio incrementally (only the changed asset is re-valued);
+      assets without USDT pair are valued along their path in the conversion graph (see valuation)
+    - a telegram message is sent, when the value of an account or account group changed by more than the
+      threshold since the last message (see ticker.deliver)
+    - listen keys are kept alive (a new listen key is requested, if the keepalive fails) and lost connections
+      are re-established; failing events are logged and skipped
+
+.. note:: only SPOT accounts are streamed. For tests without a live exchange, the websocket stand-in of
+    binance_reporting.simulator can be used (see simulator.serve_stream)
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+try:
+    from binance_reporting import helper as hlp
+    from binance_reporting import metrics
+    from binance_reporting import ticker
+    from binance_reporting import valuation
+except:
+    import helper as hlp
+    import metrics
+    import ticker
+    import valuation
+
+ws_url_default = 'wss://stream.binance.com:9443'
+price_stream = '!miniTicker@arr'
+keepalive_interval = 1800   # listen keys expire after 60 min without keepalive
+
+
+class Portfolio:
+    """valuation of one account, updated incrementally by balance and price events
+
+    :param dict balances: optional; asset => quantity (free + locked)
+    :param dict prices: optional; asset => USDT price
+    """
+
+    def __init__(self, balances: dict = None, prices: dict = None):
+        self.balances = {}
+        self.prices = {'USDT': 1.0}
+        self.values = {}
+        self.portval = 0.0
+        for asset, price in (prices or {}).items():
+            self.prices[asset] = price
+        for asset, quantity in (balances or {}).items():
+            self.update_balance(asset, quantity)
+
+    def _revalue(self, asset):
+        value = self.balances.get(asset, 0.0) * self.prices.get(asset, 0.0)
+        self.portval += value - self.values.get(asset, 0.0)
+        self.values[asset] = value
+
+    def update_balance(self, asset: str, quantity: float):
+        """new quantity of an asset (e.g. after a trade)"""
+        if quantity == 0:
+            self.balances.pop(asset, None)
+        else:
+            self.balances[asset] = quantity
+        self._revalue(asset)
+        if quantity == 0:
+            self.values.pop(asset, None)
+
+    def update_price(self, asset: str, price: float):
+        """new USDT price of an asset; only assets in the balance change the value"""
+        if asset == 'USDT':
+            return
+        self.prices[asset] = price
+        if asset in self.balances:
+            self._revalue(asset)
+
+    @property
+    def cash(self):
+        return self.balances.get('USDT', 0.0)
+
+
+def _text(cash, portval, investment, chat_pseudo, decimals=1):
+    """ticker message in the format of ticker.send_bal"""
+    profit = round((portval - investment) / investment * 100, 2) if investment != 0 else 0
+    return ('C=' + str(round(cash, decimals)) + ' B=' + str(round(portval, decimals))
+            + ' P=' + str(profit) + '% ' + chat_pseudo).lower()
+
+
+class Streamer:
+    """portfolios of all streamed accounts and the telegram pushes
+
+    :param dict accounts: required; provided as in config yaml file
+    :param dict account_groups: required; provided as in config yaml file
+    :param str telegram_token: required; token of telegram account, which will send the messages
+    :param float threshold: optional; relative change of the portfolio value triggering a message (0.01 = 1%)
+    :param int min_interval: optional; min. seconds between two messages of the same account / group
+    :param str last_sent_file: optional; see ticker.deliver
+    """
+
+    def __init__(self, accounts, account_groups, telegram_token, threshold=0.01, min_interval=60, last_sent_file=''):
+        self.accounts = accounts
+        self.account_groups = account_groups
+        self.telegram_token = telegram_token
+        self.threshold = threshold
+        self.min_interval = min_interval
+        self.last_sent_file = last_sent_file
+        self.portfolios = {}        # account => Portfolio
+        self.pushed = {}            # account / group => (time, portval) of last message
+        self.listen_keys = {}       # account => listen key
+        self.clients = {}           # account => API client
+        self.graph = None           # conversion graph of the start prices (see valuation)
+        self.symbol_prices = {}     # trading pair => latest price
+        self.dependents = {}        # trading pair => assets with this pair on their path to USDT
+
+    def start_values(self):
+        """download balances and prices once via REST and request the listen keys"""
+        prices = None
+        for account, account_details in self.accounts.items():
+            if account_details['type'] != 'SPOT':
+                logging.warning("account %s is not a SPOT account and will not be streamed", account)
+                continue
+            client = hlp.get_client(
+                os.environ.get(account_details['osvar_api_public']), os.environ.get(account_details['osvar_api_secret']))
+            if prices is None:
+                tickers = hlp.get_all_tickers(client)
+                self.graph = valuation.graph(client, tickers)
+                self.symbol_prices = {ticker_price['symbol']: float(ticker_price['price']) for ticker_price in tickers}
+                self.dependents = {}
+                for asset, path in self.graph.paths.items():
+                    for symbol, invert in path:
+                        self.dependents.setdefault(symbol, []).append(asset)
+                prices = {asset: rate for asset, rate in self.graph.rates.items() if rate}
+            balances = {
+                balance['asset']: float(balance['free']) + float(balance['locked'])
+                for balance in client.get_account()['balances']}
+            self.portfolios[account] = Portfolio(balances, prices)
+            self.listen_keys[account] = client.stream_get_listen_key()
+            self.clients[account] = client
+            logging.info(" . start value of account %s: %s", account, str(round(self.portfolios[account].portval, 2)))
+
+    def on_prices(self, tickers):
+        """miniTicker event with the latest prices of all changed trading pairs"""
+        for item in tickers:
+            symbol = item['s']
+            if symbol not in self.dependents:
+                continue
+            self.symbol_prices[symbol] = float(item['c'])
+            # every asset with this pair on its path to USDT gets a new rate
+            for asset in self.dependents[symbol]:
+                rate = self.graph._rate(self.graph.paths[asset], self.symbol_prices)
+                if rate:
+                    for portfolio in self.portfolios.values():
+                        portfolio.update_price(asset, rate)
+        metrics.count('stream_events_total', 1, 'events received from websocket streams', stream='prices')
+
+    def on_account(self, account, event):
+        """user data event of an account; balance changes are taken over"""
+        if event.get('e') == 'outboundAccountPosition':
+            portfolio = self.portfolios[account]
+            for balance in event['B']:
+                portfolio.update_balance(balance['a'], float(balance['f']) + float(balance['l']))
+        metrics.count('stream_events_total', 1, 'events received from websocket streams', stream='account')
+
+    def _due(self, key, portval, now):
+        last = self.pushed.get(key)
+        if last is None:
+            return True
+        last_time, last_portval = last
+        if now - last_time < self.min_interval:
+            return False
+        if last_portval == 0:
+            return portval != 0
+        return abs(portval - last_portval) / abs(last_portval) >= self.threshold
+
+    def messages(self, now=None):
+        """messages of all accounts and groups, whose value changed by more than the threshold"""
+        now = time.time() if now is None else now
+        messages = []
+        for account, portfolio in self.portfolios.items():
+            account_details = self.accounts[account]
+            if 'chat_id' in account_details and self._due(account, portfolio.portval, now):
+                messages.append((account_details['chat_id'], _text(
+                    portfolio.cash, portfolio.portval, account_details.get('investment', 0), account_details['chat_pseudo'])))
+                self.pushed[account] = (now, portfolio.portval)
+        for group_name, account_group in self.account_groups.items():
+            streamed = [account for account in account_group['accounts'] if account in self.portfolios]
+            if not streamed:
+                continue
+            portval = sum(self.portfolios[account].portval for account in streamed)
+            if self._due('group:' + group_name, portval, now):
+                cash = sum(self.portfolios[account].cash for account in streamed)
+                investment = sum(self.accounts[account].get('investment', 0) for account in streamed)
+                messages.append((account_group['chat_id'], _text(cash, portval, investment, account_group['chat_pseudo'], 0)))
+                self.pushed['group:' + group_name] = (now, portval)
+        return messages
+
+    async def push(self):
+        """send messages for all significant changes"""
+        messages = self.messages()
+        if messages:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(
+                None, ticker.deliver, self.telegram_token, messages, self.last_sent_file)
+
+
+async def _listen(address, handler, stop):
+    """receive events of a websocket stream; reconnect if the connection is lost or the address changed
+
+    :param function address: required; returns the url of the stream (e.g. with the current listen key)
+    """
+    import websockets
+    delay = 1
+    while not stop.is_set():
+        url = address()
+        try:
+            async with websockets.connect(url) as websocket:
+                logging.debug("connected to %s", url)
+                delay = 1
+                while not stop.is_set() and address() == url:
+                    try:
+                        message = await asyncio.wait_for(websocket.recv(), timeout=1)
+                    except asyncio.TimeoutError:
+                        continue
+                    try:
+                        handler(json.loads(message))
+                    except Exception as e:
+                        # e.g. an unexpected event; the stream goes on with the next event
+                        logging.warning("event of stream %s skipped: ", url, exc_info=True)
+                        metrics.count('stream_errors_total', 1, 'events of websocket streams, which failed')
+        except (OSError, websockets.exceptions.WebSocketException) as e:
+            if stop.is_set():
+                return
+            logging.warning("stream %s lost (%s); reconnecting in %s sec", url, str(e), str(delay))
+            metrics.count('stream_reconnects_total', 1, 'reconnects of websocket streams')
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60)
+
+
+async def _keepalive(streamer, stop):
+    """keep the listen keys alive"""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=keepalive_interval)
+        except asyncio.TimeoutError:
+            for account, listen_key in list(streamer.listen_keys.items()):
+                logging.debug("sending keepalive for listen key of account %s", account)
+                client = streamer.clients[account]
+                try:
+                    await loop.run_in_executor(None, client.stream_keepalive, listen_key)
+                except Exception as e:
+                    # the listen key may have expired; the stream of the account reconnects with a new one
+                    logging.warning("keepalive for account %s failed (%s); requesting a new listen key", account, str(e))
+                    try:
+                        streamer.listen_keys[account] = await loop.run_in_executor(None, client.stream_get_listen_key)
+                    except Exception as e:
+                        logging.warning("Exception occured: ", exc_info=True)
+
+
+async def _pusher(streamer, stop, check_interval):
+    """check for significant changes and send telegram messages"""
+    while not stop.is_set():
+        try:
+            await streamer.push()
+        except Exception as e:
+            logging.warning("Exception occured: ", exc_info=True)
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=check_interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def _run(streamer, ws_url, duration, check_interval):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, streamer.start_values)
+    if not streamer.portfolios:
+        logging.warning("no SPOT accounts to be streamed")
+        return streamer
+
+    def on_account(account):
+        return lambda message: streamer.on_account(account, message.get('data', message))
+
+    def account_url(account):
+        return lambda: ws_url + '/ws/' + streamer.listen_keys[account]
+
+    tasks = [asyncio.ensure_future(_listen(
+        lambda: ws_url + '/stream?streams=' + price_stream,
+        lambda message: streamer.on_prices(message.get('data', message)), stop))]
+    for account in streamer.listen_keys:
+        tasks.append(asyncio.ensure_future(_listen(account_url(account), on_account(account), stop)))
+    tasks.append(asyncio.ensure_future(_keepalive(streamer, stop)))
+    tasks.append(asyncio.ensure_future(_pusher(streamer, stop, check_interval)))
+    try:
+        if duration is None:
+            await asyncio.gather(*tasks)
+        else:
+            await asyncio.sleep(duration)
+    finally:
+        stop.set()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return streamer
+
+
+def run(accounts, account_groups, telegram_token, threshold=0.01, min_interval=60, ws_url='',
+        last_sent_file='', check_interval=5, duration=None):
+    """stream balances and prices and send telegram messages on significant changes
+
+    :param dict accounts: required; provided as in config yaml file
+    :param dict account_groups: required; provided as in config yaml file
+    :param str telegram_token: required; token of telegram account, which will send the messages
+    :param float threshold: optional; relative change of the portfolio value triggering a message (0.01 = 1%)
+    :param int min_interval: optional; min. seconds between two messages of the same account / group
+    :param str ws_url: optional; base url of the websocket streams (default: helper.ws_url or the exchange)
+    :param str last_sent_file: optional; see ticker.deliver
+    :param float check_interval: optional; seconds between two checks for significant changes
+    :param float duration: optional; stop streaming after this amount of seconds (default: run forever)
+
+    :returns: Streamer with the latest portfolios
+    """
+    ws_url = ws_url or hlp.ws_url or ws_url_default
+    logging.info(" --- Streaming balances and prices from %s ---", ws_url)
+    streamer = Streamer(accounts, account_groups, telegram_token, threshold, min_interval, last_sent_file)
+    return asyncio.run(_run(streamer, ws_url, duration, check_interval))
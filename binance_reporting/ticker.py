@@ -3,20 +3,34 @@
 functions available for:
     - sending balance and PnL for given accounts
     - send summary msg of balances for group of accounts (e.g. all SPOT accounts or all FUTURES accounts etc.)
+    - delivering messages concurrently with one bot, respecting the rate limits of telegram and
+      suppressing messages, which have not changed since they have been sent last time
 
 :TODO: add function to ask ad-hoc account status
 :TODO: add function to send msg after every trade on given accounts
 """
 
 import os
+import json
+import time
 import logging
+import threading
+import concurrent.futures
 import telegram.ext     # sending balance information to telegram
 try:
     from binance_reporting.downloader import balances
+    from binance_reporting import helper as hlp
+    from binance_reporting import metrics
+    from binance_reporting import tracing
 except:
     from downloader import balances
+    import helper as hlp
+    import metrics
+    import tracing
 
-def send_bal(accounts, account_groups, telegram_token):
+@metrics.timed
+@tracing.traced
+def send_bal(accounts, account_groups, telegram_token, store=None, last_sent_file='', workers=8):
     """sending short balance status msg to telegram channels
 
     **Goal**
@@ -24,9 +38,10 @@ def send_bal(accounts, account_groups, telegram_token):
 
     **Procedure**
         - collect balances from account given by utilizing downloader.balances function
+          (balances already downloaded in this run are re-used from the result store)
         - calcuate cash, portfolio value and profit from given accounts
-        - send short messages to telegram channels as provided in the config file
-        - loop through account groups and send summary messages to telegram channel (if provided)
+        - loop through account groups and calculate summary messages (if provided)
+        - deliver all messages to the telegram channels as provided in the config file (see deliver)
 
         .. note:: Please make sure that the telegram token has access to the telegram channel and the telegram channel is public
 
@@ -39,16 +54,28 @@ def send_bal(accounts, account_groups, telegram_token):
     :param telegram_token: required; token of telegram account, which will send the messages
     :type telegram_token: string
 
+    :param store: optional; result store of the run, shared with the balances download
+    :type store: helper.ResultStore
+
+    :param last_sent_file: optional; json file with the messages sent last time per channel; unchanged messages are not sent again
+    :type last_sent_file: string
+
+    :param workers: optional; amount of messages sent at the same time
+    :type workers: int
+
     :returns: account status messages in telegram channels
     """
     logging.info(' - Sending balance tickers to telegram channels. -')
+    if store is None:
+        store = hlp.ResultStore()
+    messages = []
     for account in accounts:
 
         account_details = accounts[account]
         PUBLIC = os.environ.get(account_details['osvar_api_public'])
         SECRET = os.environ.get(account_details['osvar_api_secret'])
 
-        balance = balances(account, account_details['type'], PUBLIC, SECRET)
+        balance = balances(account, account_details['type'], PUBLIC, SECRET, store=store)
 
         account_details['cash'] = round(balance['cash'], 1)
         account_details['portval'] = round(balance['portval'], 1)
@@ -58,13 +85,10 @@ def send_bal(accounts, account_groups, telegram_token):
         strPortVal = 'B=' + str(account_details['portval'])
         strProfit = 'P=' + str(account_details['profit']) + '%'
 
-        bot = telegram.Bot(token = telegram_token)
         bot_text = (strCash + ' ' + strPortVal + ' ' + strProfit + ' ' + account_details['chat_pseudo']).lower()
-        bot.send_message(chat_id = account_details['chat_id'], text = bot_text)
+        messages.append((account_details['chat_id'], bot_text))
 
-    logging.info(' - Finished sending tickers for all listed accounts! -')
-
-    logging.info(' - Looping through different account groups and sending ticker messages to telegram for every group -')
+    logging.info(' - Looping through different account groups and calculating ticker messages for every group -')
 
     if len(account_groups) != 0:
         for account_group in account_groups:
@@ -75,18 +99,147 @@ def send_bal(accounts, account_groups, telegram_token):
             cash = 0
             portval = 0
 
-            # get details for every account and sum them up
+            # get details for every account out of the result store and sum them up
             for account in account_group['accounts']:
                 account_details = accounts[account]
+                balance = balances(
+                    account, account_details['type'],
+                    os.environ.get(account_details['osvar_api_public']),
+                    os.environ.get(account_details['osvar_api_secret']), store=store)
                 investment = investment + account_details['investment']
-                cash = cash + account_details['cash']
-                portval = portval + account_details['portval']
+                cash = cash + round(balance['cash'], 1)
+                portval = portval + round(balance['portval'], 1)
 
             strCash = 'C=' + str(round(cash, 0))
             strPortVal = 'B=' + str(round(portval, 0))
             strProfit = 'P=' + str(round((portval - investment) / investment * 100, 1)) + '%'
 
             bot_text = (strCash + ' ' + strPortVal + ' ' + strProfit + ' ' + chat_pseudo).lower()
-            bot.send_message(chat_id = chat_id, text = bot_text)
+            messages.append((chat_id, bot_text))
+
+    deliver(telegram_token, messages, last_sent_file, workers)
+
+    logging.info(' - Finished sending tickers for all listed accounts and groups! -')
+
+
+# rate limits of telegram: max. 1 msg per second into the same chat, max. 30 msg per second overall
+chat_interval = 1.0
+global_interval = 1 / 30
+
+
+class _Pacer:
+    """waits until the next message is allowed (min. interval between two messages)"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            time.sleep(wait)
 
-    logging.info(' - Finished sending Tickers to groups -')
+
+def _read_last_sent(last_sent_file):
+    """messages sent last time per chat; {} if there is no file"""
+    if last_sent_file == '' or not os.path.isfile(last_sent_file):
+        return {}
+    try:
+        with open(last_sent_file) as file:
+            return json.load(file)
+    except ValueError:
+        logging.warning("last sent messages in %s could not be read; sending all messages", last_sent_file)
+        return {}
+
+
+def _send_chat(bot, chat_id, texts, pacer, sent):
+    """send all messages of one chat one after another (per-chat rate limit)
+
+    :param list sent: required; messages sent are appended as soon as they are delivered
+        (in case of an error, it holds the messages sent before)
+
+    :returns: list of messages sent
+    """
+    for nbr, text in enumerate(texts):
+        if nbr > 0:
+            time.sleep(chat_interval)
+        pacer.wait()
+        try:
+            bot.send_message(chat_id = chat_id, text = text)
+        except telegram.error.RetryAfter as e:
+            logging.warning("telegram rate limit hit for %s; retrying after %s sec", chat_id, str(e.retry_after))
+            time.sleep(e.retry_after)
+            pacer.wait()
+            bot.send_message(chat_id = chat_id, text = text)
+        metrics.count('telegram_messages_total', 1, 'messages sent to telegram', status='sent')
+        sent.append(text)
+    return sent
+
+
+def deliver(telegram_token, messages, last_sent_file='', workers=8):
+    """send messages to telegram channels
+
+    **Goal**
+        - network latency of telegram must not add up for every account and group
+        - send only messages, which have changed since the last run
+
+    **Procedure**
+        - skip messages, which are equal to the messages sent last time into the same chat (if last_sent_file is provided)
+        - one bot for all messages; messages of different chats are sent at the same time
+        - messages of the same chat are sent one after another with at least 1 sec in between;
+          overall not more than 30 messages per second (rate limits of telegram)
+        - remember the messages sent per chat in last_sent_file
+
+    :param str telegram_token: required; token of telegram account, which will send the messages
+    :param list messages: required; list of (chat_id, text)
+    :param str last_sent_file: optional; json file with the messages sent last time per chat
+    :param int workers: optional; amount of chats served at the same time
+    """
+    last_sent = _read_last_sent(last_sent_file)
+    chats = {}
+    unchanged = {}
+    for chat_id, text in messages:
+        if text in last_sent.get(str(chat_id), []):
+            logging.debug("message to %s unchanged; not sent again", chat_id)
+            metrics.count('telegram_messages_total', 1, 'messages sent to telegram', status='unchanged')
+            unchanged.setdefault(str(chat_id), []).append(text)
+            continue
+        chats.setdefault(chat_id, []).append(text)
+    if not chats:
+        logging.info(' - No changed ticker messages to be sent. -')
+        return
+
+    try:
+        from telegram.utils.request import Request
+        bot = telegram.Bot(token = telegram_token, request = Request(con_pool_size = workers + 4))
+    except ImportError:
+        bot = telegram.Bot(token = telegram_token)
+    pacer = _Pacer(global_interval)
+
+    logging.info(' - Sending %s ticker messages to %s telegram channels. -',
+        str(sum(len(texts) for texts in chats.values())), str(len(chats)))
+    with concurrent.futures.ThreadPoolExecutor(max_workers = workers) as executor:
+        sent = {chat_id: [] for chat_id in chats}
+        futures = {
+            executor.submit(_send_chat, bot, chat_id, texts, pacer, sent[chat_id]): chat_id
+            for chat_id, texts in chats.items()}
+        for future in concurrent.futures.as_completed(futures):
+            chat_id = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                logging.warning("Sending message to %s failed: ", chat_id, exc_info=True)
+                metrics.count('telegram_messages_total', 1, 'messages sent to telegram', status='error')
+                if not sent[chat_id]:
+                    continue
+            # messages delivered before an error are remembered as well, so they are not sent again
+            last_sent[str(chat_id)] = unchanged.get(str(chat_id), []) + sent[chat_id]
+
+    if last_sent_file != '':
+        with open(last_sent_file + '.tmp', 'w') as file:
+            json.dump(last_sent, file, indent=2)
+        os.replace(last_sent_file + '.tmp', last_sent_file)
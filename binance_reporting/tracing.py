@@ -0,0 +1,193 @@
+"""tracing and profiling of runs (profiling mode)
+
+**Goal**
+    - find out where the time of a slow run went: network, pandas or csv files,
+      down to the account, module and trading pair / time window
+
+**Procedure**
+    - nested timing spans: run > account > module > symbol / window > request / csv
+    - spans are written as Chrome trace events (json), which can be loaded into a
+      flame graph viewer (e.g. https://ui.perfetto.dev, https://www.speedscope.app or chrome://tracing)
+    - optional: cProfile per module, written as .prof files next to the trace file (e.g. for snakeviz)
+    - optional: top memory allocators per module (tracemalloc), added to the module span and logged
+
+.. note:: the profiling mode is activated in the config file (section 'logging'); if not activated,
+    spans cost next to nothing
+"""
+import os
+import json
+import time
+import logging
+import threading
+import functools
+import contextlib
+
+active = False          # profiling mode activated
+trace_file = "binance_reporting_trace.json"
+cprofile = False        # cProfile per module
+tracemalloc_top = 0     # amount of top allocators per module; 0 = no memory tracing
+max_events = 100000     # oldest events are dropped (daemon mode)
+
+_lock = threading.Lock()
+_events = []
+_profiles = {}          # module => cProfile.Profile
+_module_depth = threading.local()
+_origin = time.perf_counter()
+
+
+def activate(filename: str = "binance_reporting_trace.json", profile_modules: bool = False, top_allocators: int = 0):
+    """activate the profiling mode
+
+    :param str filename: optional; trace file (Chrome trace event format)
+    :param bool profile_modules: optional; run cProfile for every module and write one .prof file per module
+    :param int top_allocators: optional; amount of top memory allocators recorded per module (0 = off)
+    """
+    global active, trace_file, cprofile, tracemalloc_top
+    active = True
+    trace_file = filename
+    cprofile = profile_modules
+    tracemalloc_top = top_allocators
+    if tracemalloc_top > 0:
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+    logging.info(" ---- Profiling mode activated; trace file: %s", trace_file)
+
+
+def _add_event(name, category, start, end, args):
+    event = {
+        'name': name,
+        'cat': category,
+        'ph': 'X',
+        'ts': round((start - _origin) * 1e6, 1),
+        'dur': round((end - start) * 1e6, 1),
+        'pid': os.getpid(),
+        'tid': threading.get_ident()}
+    if args:
+        event['args'] = {key: str(value) for key, value in args.items()}
+    with _lock:
+        _events.append(event)
+        if len(_events) > max_events:
+            del _events[:len(_events) - max_events]
+
+
+@contextlib.contextmanager
+def span(name: str, category: str = 'span', **args):
+    """timing span; spans opened within this span are nested
+
+    .. code:: python
+
+        with tracing.span('BTCUSDT', 'symbol'):
+            ...
+
+    :param str name: required; name of the span, e.g. account name or trading pair
+    :param str category: optional; e.g. 'run', 'account', 'module', 'symbol', 'window', 'request', 'csv'
+    :param args: optional; additional information shown with the span
+    """
+    if not active:
+        yield args
+        return
+    start = time.perf_counter()
+    try:
+        yield args
+    finally:
+        _add_event(name, category, start, time.perf_counter(), args)
+
+
+def iterate(items, category: str):
+    """iterate over items and trace every iteration as one span
+
+    .. code:: python
+
+        for pair in tracing.iterate(symbols, 'symbol'):
+            ...
+
+    :param items: required; e.g. list of trading pairs
+    :param str category: required; category of the spans, e.g. 'symbol'
+    """
+    if not active:
+        yield from items
+        return
+    for item in items:
+        with span(str(item), category):
+            yield item
+
+
+def traced(function):
+    """decorator tracing a module (e.g. downloader.trades) as span
+
+    in case cProfile or tracemalloc is activated, the outermost traced function is profiled
+    (e.g. merge_klines is part of the profile of klines)
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not active:
+            return function(*args, **kwargs)
+        depth = getattr(_module_depth, 'value', 0)
+        _module_depth.value = depth + 1
+        profile = None
+        snapshot = None
+        try:
+            with span(function.__name__, 'module') as span_args:
+                if depth == 0 and tracemalloc_top > 0:
+                    import tracemalloc
+                    snapshot = tracemalloc.take_snapshot()
+                if depth == 0 and cprofile:
+                    profile = _profile(function.__name__)
+                    profile.enable()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    if profile is not None:
+                        profile.disable()
+                    if snapshot is not None:
+                        span_args['top_allocators'] = _top_allocators(snapshot)
+                        logging.debug("top memory allocators of %s: %s", function.__name__, span_args['top_allocators'])
+        finally:
+            _module_depth.value = depth
+    return wrapper
+
+
+def _profile(module):
+    import cProfile
+    with _lock:
+        if module not in _profiles:
+            _profiles[module] = cProfile.Profile()
+        return _profiles[module]
+
+
+def _top_allocators(snapshot_before):
+    """memory allocated since snapshot_before, top allocators by source line"""
+    import tracemalloc
+    snapshot = tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__)])
+    statistics = snapshot.compare_to(snapshot_before, 'lineno')
+    return [str(statistic) for statistic in statistics[:tracemalloc_top] if statistic.size_diff > 0]
+
+
+def write(filename: str = None):
+    """write the trace file and the cProfile files (if any)
+
+    :param str filename: optional; trace file (default: file given to activate)
+    """
+    if not active:
+        return
+    filename = filename or trace_file
+    logging.info(" -- Writing trace to %s. --", filename)
+    with _lock:
+        trace = {'traceEvents': list(_events), 'displayTimeUnit': 'ms'}
+        profiles = dict(_profiles)
+    with open(filename + '.tmp', 'w') as file:
+        json.dump(trace, file)
+    os.replace(filename + '.tmp', filename)
+    for module, profile in profiles.items():
+        profile_file = os.path.splitext(filename)[0] + '_' + module + '.prof'
+        logging.debug("writing cProfile of %s to %s", module, profile_file)
+        profile.dump_stats(profile_file)
+
+
+def reset():
+    """remove all recorded spans and profiles"""
+    with _lock:
+        _events.clear()
+        _profiles.clear()
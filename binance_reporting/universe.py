@@ -0,0 +1,136 @@
+"""selection of the trading pairs for kline downloads by trading volume (kline universe)
+
+**Goal**
+    - download klines only for the pairs, which are actually traded: the symbols of the config (e.g. 'USDT') match
+      hundreds of illiquid or halted pairs, and every pair costs at least one request per interval and run
+    - download time scales with the amount of pairs used, not with the amount of pairs listed
+
+**Procedure**
+    - the 24h tickers of all pairs are downloaded with a single request (api/v3/ticker/24hr)
+    - pairs matching the symbols of the config, which are trading (status of the symbol catalog), are ranked
+      by their quote volume of the last 24 hours
+    - kept: the top pairs (top) with a quote volume of at least min_quote_volume, plus the pinned pairs
+      (always downloaded, e.g. pairs of the own portfolio)
+    - the selection is kept in universe.json in the klines directory and re-evaluated after refresh_hours;
+      runs in between need no request
+
+.. note:: the selection is configured in the section 'universe' of the klines config
+
+**Usage**
+
+    .. code:: python
+
+        pairs = universe.select(client, helper.get_symbols('USDT'), {'top': 50, 'pinned': ['BNBUSDT']}, state_file)
+"""
+import os
+import json
+import time
+import logging
+try:
+    from binance_reporting import helper as hlp
+    from binance_reporting import metrics
+except:
+    import helper as hlp
+    import metrics
+
+defaults = {
+    'top': 100,                 # pairs with the highest quote volume; 0 = no limit
+    'min_quote_volume': 0,      # min. quote volume of the last 24 hours
+    'pinned': [],               # pairs always kept
+    'refresh_hours': 24}        # hours until the selection is re-evaluated
+
+
+def _settings(settings):
+    values = dict(defaults)
+    values.update({key: value for key, value in (settings or {}).items() if key in defaults})
+    return values
+
+
+def rank(tickers, catalog, candidates, settings: dict = None):
+    """pairs of the universe out of the 24h tickers
+
+    :param list tickers: required; response of api/v3/ticker/24hr (client.get_ticker())
+    :param object catalog: required; symbol catalog of the exchange (see helper.get_catalog)
+    :param list candidates: required; pairs matching the symbols of the config (see helper.get_symbols)
+    :param dict settings: optional; top, min_quote_volume, pinned (see defaults)
+
+    :returns: sorted list of the selected pairs
+    """
+    settings = _settings(settings)
+    candidates = set(candidates)
+    volumes = {}
+    for ticker in tickers:
+        symbol = ticker['symbol']
+        info = catalog.get(symbol)
+        if symbol not in candidates or info is None or info['status'] != 'TRADING':
+            continue
+        volume = float(ticker.get('quoteVolume') or 0)
+        if volume >= settings['min_quote_volume']:
+            volumes[symbol] = volume
+    ranked = sorted(volumes, key=lambda symbol: (-volumes[symbol], symbol))
+    if settings['top']:
+        ranked = ranked[:settings['top']]
+    pinned = [symbol for symbol in settings['pinned'] if symbol in catalog]
+    for symbol in settings['pinned']:
+        if symbol not in catalog:
+            logging.warning("pinned pair %s is not a trading pair of the exchange", symbol)
+    return sorted(set(ranked) | set(pinned))
+
+
+def load(state_file: str, settings: dict = None, now: float = None):
+    """pairs of the last selection, if it is younger than refresh_hours and was made with the same settings
+
+    :param str state_file: required; json file with the last selection
+    :param dict settings: optional; settings of the selection (see defaults)
+    :param float now: optional; current time in seconds (default: now)
+
+    :returns: sorted list of pairs; None, if the selection needs to be re-evaluated
+    """
+    settings = _settings(settings)
+    if not os.path.isfile(state_file):
+        return None
+    try:
+        with open(state_file) as file:
+            state = json.load(file)
+    except ValueError:
+        logging.warning("universe file %s can not be read; selecting the pairs again", state_file)
+        return None
+    now = time.time() if now is None else now
+    if state.get('settings') != settings or now - state.get('time', 0) >= settings['refresh_hours'] * 3600:
+        return None
+    return state['pairs']
+
+
+def select(client, candidates, settings: dict = None, state_file: str = ''):
+    """pairs for the kline download: the most traded candidates plus the pinned pairs
+
+    **Procedure**
+        - the last selection is re-used within refresh_hours (see load)
+        - otherwise the 24h tickers are downloaded and ranked (see rank) and the selection is saved
+
+    :param object client: optional; API client (default: new client without API key)
+    :param list candidates: required; pairs matching the symbols of the config (see helper.get_symbols)
+    :param dict settings: optional; top, min_quote_volume, pinned, refresh_hours (see defaults)
+    :param str state_file: optional; json file keeping the selection between runs (empty: selected in every run)
+
+    :returns: sorted list of pairs
+    """
+    settings = _settings(settings)
+    pairs = load(state_file, settings) if state_file else None
+    if pairs is not None:
+        # delisted pairs are dropped; pinned pairs are kept as long as they are listed
+        candidates = set(candidates) | set(settings['pinned'])
+        pairs = [pair for pair in pairs if pair in candidates]
+        logging.info(" - kline universe: %s pairs selected before (re-evaluated every %s h) -",
+            str(len(pairs)), str(settings['refresh_hours']))
+    else:
+        client = client or hlp.get_client()
+        logging.debug("downloading 24h tickers to rank the trading pairs ...")
+        tickers = client.get_ticker()
+        pairs = rank(tickers, hlp.get_catalog(client), candidates, settings)
+        if state_file:
+            with open(state_file, 'w') as file:
+                json.dump({'time': time.time(), 'settings': settings, 'pairs': pairs}, file)
+        logging.info(" - kline universe: %s of %s pairs selected by quote volume -", str(len(pairs)), str(len(candidates)))
+    metrics.gauge('kline_universe_pairs', len(pairs), 'trading pairs selected for the kline download')
+    return pairs
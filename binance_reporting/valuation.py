@@ -0,0 +1,183 @@
+"""valuation of assets in USDT, including assets without a USDT trading pair
+
+**Goal**
+    - value every asset of balances, snapshots, deposits and withdrawals, not only assets with an <asset>USDT pair
+      (before, these assets got the USDT price 0 and the portfolio value was too low)
+    - one lookup per valuation instead of searching the tickers for every asset
+
+**Procedure**
+    - conversion graph: every trading pair of the symbol catalog (see helper.get_catalog) is an edge between its
+      base and its quote asset; the path of every asset to USDT is searched once (breadth-first, fewest conversions;
+      hubs like BTC, BNB, ETH preferred)
+    - current rates: the rates of all assets are computed once per price snapshot (tickers) and kept in a dict;
+      valuations of a run are a single vectorized lookup (see ConversionGraph.prices)
+    - historical rates: the daily closes of the pairs on the path are downloaded once per pair and day and kept
+      in a price cache, shared by snapshots, deposits and withdrawals of all accounts (and by other processes on
+      the host, if the shared cache is active)
+
+**Usage**
+
+    .. code:: python
+
+        from binance_reporting import valuation
+        graph = valuation.graph(client)
+        balances['USDT price'] = graph.prices(balances['asset'])
+        rates = graph.historical(client, ['BTC', 'XYZ'], time_ms)
+"""
+import time
+import logging
+import threading
+import collections
+import pandas as pd
+try:
+    from binance_reporting import helper as hlp
+    from binance_reporting import metrics
+    from binance_reporting import sharedcache
+except:
+    import helper as hlp
+    import metrics
+    import sharedcache
+
+quote = 'USDT'
+
+# assets preferred for conversions, if several paths with the same amount of conversions exist
+hubs = ['BTC', 'BNB', 'ETH', 'BUSD', 'FDUSD', 'USDC']
+
+daily_ms = 86400000
+
+_lock = threading.Lock()
+_graph = {}         # 'graph' => (tickers, ConversionGraph) of the last price snapshot
+_closes = {}        # (symbol, open time of the day in ms) => close of the daily kline (None: no kline)
+
+
+class ConversionGraph:
+    """conversion paths and rates of all assets into USDT
+
+    :param object catalog: required; symbol catalog (see helper.SymbolCatalog)
+    :param list tickers: required; current prices as returned by helper.get_all_tickers
+    """
+
+    def __init__(self, catalog, tickers):
+        ticker_prices = {ticker['symbol']: float(ticker['price']) for ticker in tickers}
+        edges = collections.defaultdict(list)     # asset => [(neighbour asset, symbol, neighbour is quote)]
+        for symbol, info in catalog.symbols.items():
+            if info['status'] not in ('TRADING', '') or not ticker_prices.get(symbol):
+                continue
+            edges[info['baseAsset']].append((info['quoteAsset'], symbol, True))
+            edges[info['quoteAsset']].append((info['baseAsset'], symbol, False))
+
+        def rank(edge):
+            asset = edge[0]
+            return (hubs.index(asset) if asset in hubs else len(hubs), asset)
+
+        # breadth-first search starting at USDT; path of an asset: [(symbol, invert)], from the asset to USDT
+        self.paths = {quote: []}
+        queue = collections.deque([quote])
+        while queue:
+            asset = queue.popleft()
+            for neighbour, symbol, neighbour_is_quote in sorted(edges[asset], key=rank):
+                if neighbour in self.paths:
+                    continue
+                # neighbour is the base asset of symbol: 1 neighbour = price asset; otherwise 1 neighbour = 1 / price
+                self.paths[neighbour] = [(symbol, neighbour_is_quote)] + self.paths[asset]
+                queue.append(neighbour)
+
+        self.rates = {asset: self._rate(path, ticker_prices) for asset, path in self.paths.items()}
+        logging.debug("conversion graph: %s assets with USDT rate, %s via other assets",
+            str(len(self.rates)), str(sum(1 for path in self.paths.values() if len(path) > 1)))
+
+    @staticmethod
+    def _rate(path, prices):
+        """USDT rate of an asset along its path; None if a price is missing"""
+        rate = 1.0
+        for symbol, invert in path:
+            price = prices.get(symbol)
+            if not price:
+                return None
+            rate = rate / price if invert else rate * price
+        return rate
+
+    def rate(self, asset: str):
+        """current USDT rate of an asset; 0 if the asset can not be converted into USDT"""
+        return self.rates.get(asset) or 0.0
+
+    def prices(self, assets):
+        """current USDT rates of many assets at once
+
+        :param assets: required; series or list of assets
+
+        :returns: series of USDT rates (0 for assets, which can not be converted into USDT)
+        """
+        return pd.Series(assets).map(self.rates).fillna(0).astype(float)
+
+    def historical(self, client, assets, time_ms: int):
+        """USDT rates of assets at a point in time, out of the daily closes of the pairs on their paths
+
+        the close of the first daily kline opening at or after time_ms is used (as before for <asset>USDT pairs);
+        for times of the current day, the current rates are used
+
+        :param object client: required; API client
+        :param list assets: required; assets to be valued
+        :param int time_ms: required; point in time in ms
+
+        :returns: dict asset => USDT rate (0 for assets, which can not be converted or had no price at that time)
+        """
+        day_ms = -(-int(time_ms) // daily_ms) * daily_ms
+        if day_ms >= int(time.time() * 1000) // daily_ms * daily_ms:
+            return {asset: self.rate(asset) for asset in assets}
+        symbols = {symbol for asset in assets for symbol, invert in self.paths.get(asset, [])}
+        closes = {symbol: _close(client, symbol, day_ms) for symbol in sorted(symbols)}
+        return {asset: (self._rate(self.paths[asset], closes) or 0.0) if asset in self.paths else 0.0
+                for asset in assets}
+
+
+def _close(client, symbol, day_ms):
+    """close of the daily kline of a symbol, opening at day_ms; cached per symbol and day"""
+    with _lock:
+        if (symbol, day_ms) in _closes:
+            metrics.count('price_cache_total', 1, 'historical prices served from the price cache', result='hit')
+            return _closes[(symbol, day_ms)]
+    metrics.count('price_cache_total', 1, 'historical prices served from the price cache', result='miss')
+
+    def download():
+        hlp.API_weight_check(client)
+        return client.get_klines(symbol=symbol, interval='1d', startTime=day_ms, endTime=day_ms, limit=1)
+
+    try:
+        # closes of past days are shared with other processes on the host (see sharedcache)
+        kline = sharedcache.get('klines/' + symbol + '/1d/' + str(day_ms), sharedcache.ttl['klines'], download)
+    except Exception as e:
+        # not cached; the next valuation tries again
+        logging.warning(" . price of %s from %s not available: %s",
+            symbol, str(pd.to_datetime(day_ms, unit='ms').date()), str(e))
+        return None
+    close = float(kline[0][4]) if kline else None
+    with _lock:
+        _closes[(symbol, day_ms)] = close
+    return close
+
+
+def graph(client=None, tickers=None):
+    """conversion graph of the current price snapshot; built once per tickers (see helper.get_all_tickers)
+
+    :param object client: optional; API client (default: new client without API key)
+    :param list tickers: optional; current prices, if already downloaded (default: downloaded by get_all_tickers)
+
+    :returns: ConversionGraph
+    """
+    client = client or hlp.get_client()
+    tickers = tickers if tickers is not None else hlp.get_all_tickers(client)
+    with _lock:
+        if 'graph' in _graph and _graph['graph'][0] is tickers:
+            return _graph['graph'][1]
+    conversion_graph = ConversionGraph(hlp.get_catalog(client), tickers)
+    with _lock:
+        _graph['graph'] = (tickers, conversion_graph)
+    return conversion_graph
+
+
+def clear():
+    """forget the conversion graph and the price cache"""
+    with _lock:
+        _graph.clear()
+        _closes.clear()
@@ -0,0 +1,318 @@
+"""local warehouse for all downloaded data (embedded SQLite database)
+
+instead of one csv file per dataset and account, every download can be stored
+in one indexed database file. Records are keyed by account / symbol / time,
+so new downloads are upserted and the csv read-concat-dedupe-rewrite cycle is not needed anymore.
+
+functions available for:
+    - open the warehouse database
+    - upsert downloaded records into a table
+    - replace all records of an account in a table (e.g. current balances)
+    - read records and watermarks (last recorded timestamps)
+    - create the *_all_accounts views
+    - small query API for reporting (portfolio history, latest balances, transfers)
+
+.. note:: the warehouse is optional and activated in the config file (section 'warehouse')
+"""
+import os
+import sqlite3
+import logging
+import pandas as pd
+try:
+    from binance_reporting import metrics
+except:
+    import metrics
+
+# unique keys per table; used for the unique index, which drives the upserts
+TABLE_KEYS = {
+    "balances": ["account", "asset"],
+    "balances_positions": ["account", "symbol"],
+    "balances_assets": ["account", "asset"],
+    "snapshot_daily_balances": ["account", "UTCTime", "asset"],
+    "snapshot_daily_assets": ["account", "UTCTime", "asset"],
+    "snapshot_daily_positions": ["account", "UTCTime", "symbol"],
+    "trades": ["account", "symbol", "id"],
+    "orders": ["account", "symbol", "orderId"],
+    "open_orders": ["account", "symbol", "orderId"],
+    "deposits": ["account", "txId"],
+    "withdrawals": ["account", "id"],
+    "prices": ["symbol"],
+    "klines": ["interval", "pair", "open time ux"],
+    "cost_basis": ["account", "symbol"],
+    "ledger_daily_balances": ["account", "UTCTime", "asset"],
+}
+
+# additional indexes for the typical reporting queries
+TABLE_INDEXES = {
+    "trades": [["account", "time"]],
+    "orders": [["account", "time"]],
+    "deposits": [["account", "insertTime"]],
+    "withdrawals": [["account", "insertTime"]],
+    "snapshot_daily_balances": [["UTCTime"]],
+}
+
+# views replacing the merged csv files of start.main
+ALL_ACCOUNTS_VIEWS = {
+    "balances_all_accounts": "balances",
+    "snapshots_daily_all_accounts": "snapshot_daily_balances",
+    "deposits_all_accounts": "deposits",
+    "withdrawals_all_accounts": "withdrawals",
+}
+
+
+def _quote(name):
+    """quote an identifier; column names like 'USDT price' contain blanks"""
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _columns(con, table):
+    """list of columns of a table; empty list if the table does not exist"""
+    return [row[1] for row in con.execute("PRAGMA table_info(" + _quote(table) + ")")]
+
+
+def _prepare(data):
+    """convert a dataframe into rows, which can be written by sqlite3
+
+    timestamps are written as ISO strings, missing values as NULL
+    """
+    data = data.copy()
+    for column in data.columns:
+        if pd.api.types.is_datetime64_any_dtype(data[column]):
+            data[column] = data[column].astype(str)
+        elif pd.api.types.is_bool_dtype(data[column]):
+            data[column] = data[column].astype(int)
+    data = data.astype(object).where(pd.notnull(data), None)
+    return data.values.tolist()
+
+
+def connect(db_file: str):
+    """open (and create if needed) the warehouse database
+
+    :param str db_file: required; name and location of the database file
+
+    :returns: sqlite3 connection
+    """
+    logging.debug("opening warehouse %s", db_file)
+    db_dir = os.path.dirname(db_file)
+    if db_dir != '' and not os.path.exists(db_dir):
+        os.makedirs(db_dir)
+    con = sqlite3.connect(db_file)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("PRAGMA synchronous=NORMAL")
+    return con
+
+
+def ensure_table(con, table: str, columns: list):
+    """create the table and its indexes if needed and add missing columns
+
+    new columns are added, as the exchange adds fields to its responses from time to time
+    """
+    existing = _columns(con, table)
+    keys = TABLE_KEYS.get(table, [])
+    if not existing:
+        logging.debug("creating warehouse table %s", table)
+        all_columns = keys + [column for column in columns if column not in keys]
+        con.execute(
+            "CREATE TABLE " + _quote(table) + " (" + ", ".join(_quote(c) for c in all_columns) + ")")
+        if keys:
+            con.execute(
+                "CREATE UNIQUE INDEX " + _quote("ux_" + table) + " ON " + _quote(table)
+                + " (" + ", ".join(_quote(c) for c in keys) + ")")
+        for nbr, index in enumerate(TABLE_INDEXES.get(table, [])):
+            con.execute(
+                "CREATE INDEX " + _quote("ix_" + table + "_" + str(nbr)) + " ON " + _quote(table)
+                + " (" + ", ".join(_quote(c) for c in index) + ")")
+        return
+    for column in columns:
+        if column not in existing:
+            logging.debug("adding column %s to warehouse table %s", column, table)
+            con.execute("ALTER TABLE " + _quote(table) + " ADD COLUMN " + _quote(column))
+
+
+def upsert(con, table: str, data):
+    """insert new records or replace existing records with the same key
+
+    **Goal**
+        - replace the read-concat-dedupe-rewrite cycle of the csv files
+
+    **Procedure**
+        - create table / missing columns
+        - insert all records; records with an existing key (see TABLE_KEYS) are replaced
+
+    :param object con: required; warehouse connection
+    :param str table: required; name of the table
+    :param data: required; records to be written
+    :type data: pandas DataFrame
+
+    :returns: amount of records written
+    """
+    if data is None or data.empty:
+        return 0
+    columns = [str(column) for column in data.columns]
+    ensure_table(con, table, columns)
+    statement = (
+        "INSERT OR REPLACE INTO " + _quote(table)
+        + " (" + ", ".join(_quote(c) for c in columns) + ")"
+        + " VALUES (" + ", ".join("?" for c in columns) + ")")
+    with con:
+        con.executemany(statement, _prepare(data))
+    metrics.record_rows('written', len(data))
+    logging.debug("upserted %s records into warehouse table %s", str(len(data)), table)
+    return len(data)
+
+
+def replace(con, table: str, data, **filters):
+    """delete all records matching the filters and write the given records instead
+
+    used for datasets, which are a current state instead of a history (e.g. balances, open orders)
+
+    :param object con: required; warehouse connection
+    :param str table: required; name of the table
+    :param data: required; records to be written
+    :type data: pandas DataFrame
+    :param filters: optional; column=value pairs identifying the records to be replaced (e.g. account='A1')
+
+    :returns: amount of records written
+    """
+    if _columns(con, table):
+        where, params = _where(filters)
+        with con:
+            con.execute("DELETE FROM " + _quote(table) + where, params)
+    return upsert(con, table, data)
+
+
+def _where(filters):
+    """build where clause and parameters from column=value pairs"""
+    if not filters:
+        return "", []
+    clause = " WHERE " + " AND ".join(_quote(column) + " = ?" for column in filters)
+    return clause, list(filters.values())
+
+
+def read(con, table: str, columns: list = None, **filters):
+    """read records of a table
+
+    :param object con: required; warehouse connection
+    :param str table: required; name of the table
+    :param list columns: optional; columns to be read (default: all)
+    :param filters: optional; column=value pairs to filter on (e.g. account='A1', symbol='BTCUSDT')
+
+    :returns: dataframe with the records; empty dataframe if table does not exist
+    """
+    if not _columns(con, table):
+        return pd.DataFrame()
+    select = "*" if columns is None else ", ".join(_quote(c) for c in columns)
+    where, params = _where(filters)
+    return pd.read_sql_query("SELECT " + select + " FROM " + _quote(table) + where, con, params=params)
+
+
+def watermark(con, table: str, column: str, **filters):
+    """last recorded value of a column (e.g. last trade time of a pair)
+
+    :param object con: required; warehouse connection
+    :param str table: required; name of the table
+    :param str column: required; column to get the max value from
+    :param filters: optional; column=value pairs to filter on
+
+    :returns: max value of the column or None if there are no records
+    """
+    if not _columns(con, table):
+        return None
+    where, params = _where(filters)
+    return con.execute(
+        "SELECT MAX(" + _quote(column) + ") FROM " + _quote(table) + where, params).fetchone()[0]
+
+
+def watermarks(con, table: str, column: str, group_by: str, **filters):
+    """last recorded value of a column per group (e.g. last trade time per trading pair)
+
+    :returns: dataframe with columns group_by and column
+    """
+    if not _columns(con, table):
+        return pd.DataFrame(columns=[group_by, column])
+    where, params = _where(filters)
+    return pd.read_sql_query(
+        "SELECT " + _quote(group_by) + ", MAX(" + _quote(column) + ") AS " + _quote(column)
+        + " FROM " + _quote(table) + where + " GROUP BY " + _quote(group_by), con, params=params)
+
+
+def create_views(con):
+    """create the *_all_accounts views
+
+    **Goal**
+        - replacing the merged csv files (balances_all_accounts.csv etc.) by views, so no data is copied
+
+    **Procedure**
+        - one view per dataset for all accounts
+        - transfers_all_accounts as union of deposits and withdrawals (missing columns are filled with NULL)
+    """
+    logging.debug("creating views for all accounts in warehouse")
+    with con:
+        for view, table in ALL_ACCOUNTS_VIEWS.items():
+            con.execute("DROP VIEW IF EXISTS " + _quote(view))
+            if _columns(con, table):
+                con.execute("CREATE VIEW " + _quote(view) + " AS SELECT * FROM " + _quote(table))
+
+        con.execute("DROP VIEW IF EXISTS transfers_all_accounts")
+        tables = [table for table in ["deposits", "withdrawals"] if _columns(con, table)]
+        if tables:
+            columns = []
+            for table in tables:
+                columns.extend(column for column in _columns(con, table) if column not in columns)
+            selects = []
+            for table in tables:
+                table_columns = _columns(con, table)
+                selects.append("SELECT " + ", ".join(
+                    (_quote(c) if c in table_columns else "NULL") + " AS " + _quote(c) for c in columns
+                    ) + " FROM " + _quote(table))
+            con.execute("CREATE VIEW transfers_all_accounts AS " + " UNION ALL ".join(selects))
+
+
+def query(con, sql: str, params: list = None):
+    """run any sql statement against the warehouse and return the result as dataframe"""
+    return pd.read_sql_query(sql, con, params=params or [])
+
+
+def latest_balances(con, account: str = None):
+    """current balances of all (or one) account(s)
+
+    :returns: dataframe with one line per account and asset
+    """
+    if account is None:
+        return read(con, "balances")
+    return read(con, "balances", account=account)
+
+
+def portfolio_history(con, account: str = None):
+    """daily portfolio value per account out of the daily snapshots
+
+    :returns: dataframe with UTCTime, account and Asset value
+    """
+    if not _columns(con, "snapshot_daily_balances"):
+        return pd.DataFrame()
+    sql = ('SELECT "UTCTime", "account", "Asset value" FROM snapshot_daily_balances'
+           " WHERE asset = 'PortVal'")
+    params = []
+    if account is not None:
+        sql = sql + " AND account = ?"
+        params.append(account)
+    return query(con, sql + ' ORDER BY "UTCTime", "account"', params)
+
+
+def transfers(con, account: str = None):
+    """all deposits and withdrawals (of one account) ordered by time
+
+    :returns: dataframe with the transfers
+    """
+    create_views(con)
+    columns = _columns(con, "transfers_all_accounts")
+    if not columns:
+        return pd.DataFrame()
+    sql = "SELECT * FROM transfers_all_accounts"
+    params = []
+    if account is not None:
+        sql = sql + " WHERE account = ?"
+        params.append(account)
+    if "insertTime" in columns:
+        sql = sql + ' ORDER BY "insertTime"'
+    return query(con, sql, params)
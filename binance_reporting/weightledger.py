@@ -0,0 +1,144 @@
+"""API weight shared by all processes on a host (cross-process weight ledger)
+
+**Goal**
+    - several jobs running at the same time (e.g. cron jobs with different configs for balances and klines)
+      must not exceed the rate limit of the IP together; API_weight_check and helper.WeightBudget only know the
+      requests of their own process, so overlapping jobs run into 429 errors and 418 bans
+    - every process is admitted against the budget of the whole host
+
+**Procedure**
+    - one small ledger file per host (default: binance_reporting_weight.json in the temp directory), holding the
+      weight used per area (api, sapi, fapi) in the current minute; every access locks the file
+      (fcntl on Linux / MacOS, msvcrt on Windows)
+    - before a request is sent, its weight is reserved in the ledger (admit); if the budget of the area is used up,
+      the process waits for the next minute (the exchange resets the weight every minute)
+    - after the request, the used weight reported by the exchange is taken over (update); it includes requests of
+      processes, which do not use the ledger
+
+.. note:: the ledger is activated in the section 'weight_ledger' of the config file (see configure)
+"""
+import os
+import json
+import time
+import random
+import logging
+import tempfile
+import threading
+import contextlib
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+try:
+    from binance_reporting import metrics
+except:
+    import metrics
+
+active = False
+filename = os.path.join(tempfile.gettempdir(), 'binance_reporting_weight.json')
+threshold = 0.75        # share of the rate limit to be used by all processes together
+
+_lock = threading.Lock()    # threads of this process; the file lock is taken per process
+
+
+def configure(settings: dict):
+    """take over the settings of the config file (section 'weight_ledger')
+
+    :param dict settings: required; e.g. {'activate': True, 'file': '/tmp/binance_reporting_weight.json'}
+    """
+    global active, filename, threshold
+    active = settings.get('activate', active)
+    filename = settings.get('file') or filename
+    threshold = settings.get('threshold', threshold)
+
+
+@contextlib.contextmanager
+def _locked():
+    """content of the ledger file, locked for all processes; changes are written back"""
+    with _lock:
+        fd = os.open(filename, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            else:
+                msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+            content = b''
+            while True:
+                block = os.read(fd, 65536)
+                if not block:
+                    break
+                content += block
+            try:
+                ledger = json.loads(content) if content else {}
+            except ValueError:
+                # e.g. a process died while writing; the exchange reports the used weight with the next response
+                ledger = {}
+            original = json.dumps(ledger, sort_keys=True)
+            yield ledger
+            data = json.dumps(ledger, sort_keys=True)
+            if data != original:
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.ftruncate(fd, 0)
+                os.write(fd, data.encode())
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+            os.close(fd)
+
+
+def _current(ledger, area, minute):
+    """entry of an area for the current minute"""
+    entry = ledger.get(area)
+    if entry is None or entry['minute'] != minute:
+        entry = ledger[area] = {'minute': minute, 'used': 0}
+    return entry
+
+
+def admit(area: str, weight: int, limit: int):
+    """reserve the weight of a request in the ledger; waits for the next minute, if the budget of the host is used up
+
+    :param str area: required; area of the exchange, e.g. 'api' (see helper.rate_limits)
+    :param int weight: required; weight of the request (see helper.endpoint_weights)
+    :param int limit: required; rate limit of the area per minute
+    """
+    if not active:
+        return
+    while True:
+        with _locked() as ledger:
+            minute = int(time.time() // 60)
+            entry = _current(ledger, area, minute)
+            used = entry['used']
+            # a single request above the budget (e.g. snapshots) is admitted at the start of a minute
+            if used == 0 or used + weight <= limit * threshold:
+                entry['used'] = used + weight
+                return
+        seconds = (minute + 1) * 60 - time.time() + random.uniform(0.1, 1.0)
+        logging.warning("weight of %s used up by all processes on this host (%s); waiting %.1f sec",
+            area, str(used), seconds)
+        metrics.count('weight_ledger_waits_total', 1, 'requests waiting for the weight of the host', area=area)
+        time.sleep(max(seconds, 0))
+        metrics.record_sleep(max(seconds, 0), 'weight-ledger')
+
+
+def update(area: str, used: int):
+    """take over the used weight of the current minute as reported by the exchange
+
+    :param str area: required; area of the exchange, e.g. 'api'
+    :param int used: required; value of the used-weight header of the response
+    """
+    if not active:
+        return
+    with _locked() as ledger:
+        entry = _current(ledger, area, int(time.time() // 60))
+        entry['used'] = max(entry['used'], int(used))
+
+
+def current_weight(area: str):
+    """weight of an area used by all processes in the current minute"""
+    with _locked() as ledger:
+        entry = ledger.get(area)
+        return entry['used'] if entry is not None and entry['minute'] == int(time.time() // 60) else 0
@@ -0,0 +1,30 @@
+"""kline downloads with matrix build against the exchange stand-in (see simulator)"""
+import os
+import pytest
+from binance_reporting import simulator, helper, downloader, klinematrix
+
+
+@pytest.fixture
+def exchange():
+    server = simulator.serve(simulator.Market(pairs=3, days=20))
+    api_url = helper.api_url
+    helper.api_url = server.url
+    yield server
+    helper.api_url = api_url
+    server.stop()
+
+
+def test_build_and_merge_twice(exchange, tmp_path):
+    dir = str(tmp_path / 'klines_data')
+    symbols = exchange.market.symbols
+    for run in range(2):
+        # as in start.run with 'matrix: yes'; the second download merges the 1d files again
+        downloader.klines(dir, symbols, ['1d'], workers=1)
+        path = klinematrix.build(dir, '1d')
+
+    assert not os.path.exists(dir + '/1d/' + klinematrix.store_dir_name)
+    assert os.path.isdir(path)
+    matrix = klinematrix.load(dir, '1d')
+    assert matrix.pairs == sorted(symbols)
+    merged = helper.read_csv(dir + '/history_1d_klines_all_Assets.csv')
+    assert sorted(merged['pair'].unique()) == sorted(symbols)